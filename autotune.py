@@ -0,0 +1,197 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import itertools
+import json
+import os
+import socket
+import time
+from typing import Callable, Optional
+
+import torch
+from torch import nn
+from torch.utils.data import Dataset, DataLoader, IterableDataset
+
+__all__ = [
+    "measure_step_time", "probe_dataloader", "autotune_dataloader", "load_or_autotune_dataloader",
+]
+
+
+def measure_step_time(
+        model: nn.Module,
+        batch_size: int,
+        image_size: int,
+        device: torch.device,
+        num_steps: int = 5,
+) -> float:
+    """Time one training step (forward + backward) of the model on random data, in seconds per sample"""
+    model.train()
+    images = torch.randn([batch_size, 3, image_size, image_size], device=device).contiguous(memory_format=torch.channels_last)
+
+    step_times = []
+    for step in range(num_steps + 1):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start_time = time.perf_counter()
+        with torch.autocast(device.type, enabled=device.type == "cuda"):
+            output = model(images)
+        output.float().sum().backward()
+        model.zero_grad(set_to_none=True)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        # The first step includes the cudnn benchmark search
+        if step > 0:
+            step_times.append(time.perf_counter() - start_time)
+
+    return min(step_times) / batch_size
+
+
+def probe_dataloader(
+        dataset: Dataset,
+        batch_size: int,
+        num_workers: int,
+        prefetch_factor: int,
+        sample_step_time: float,
+        num_probe_batches: int = 20,
+        collate_fn: Optional[Callable] = None,
+) -> dict:
+    """Run a short probe window and measure how long a consumer of the given speed waits for data
+
+    Args:
+        dataset (Dataset): Dataset to load.
+        batch_size (int): How many samples per batch to load.
+        num_workers (int): Number of processes to use for data loading.
+        prefetch_factor (int): Batches loaded in advance by each worker.
+        sample_step_time (float): Seconds the consumer spends on every sample, e.g. from ``measure_step_time``.
+        num_probe_batches (int): Batches measured after the warm up.
+        collate_fn (Callable): Optional collate function of the dataloader.
+
+    Returns:
+        result (dict): The setting with its ``images_per_second`` and ``stall_fraction``.
+    """
+    dataloader = DataLoader(dataset,
+                            batch_size=batch_size,
+                            shuffle=not isinstance(dataset, IterableDataset),
+                            num_workers=num_workers,
+                            prefetch_factor=prefetch_factor if num_workers > 0 else None,
+                            collate_fn=collate_fn,
+                            pin_memory=torch.cuda.is_available(),
+                            drop_last=True)
+    data_iter = iter(dataloader)
+
+    # Let every worker start up and fill its prefetch queue before measuring
+    num_warmup_batches = max(num_workers, 1) * prefetch_factor
+    for _ in range(num_warmup_batches):
+        try:
+            next(data_iter)
+        except StopIteration:
+            # Too few batches to measure this setting, it never qualifies
+            return {
+                "batch_size": batch_size,
+                "num_workers": num_workers,
+                "prefetch_factor": prefetch_factor,
+                "images_per_second": 0.0,
+                "stall_fraction": 1.0,
+            }
+        time.sleep(sample_step_time * batch_size)
+
+    stall_time = 0.0
+    num_batches = 0
+    start_time = time.perf_counter()
+    for _ in range(num_probe_batches):
+        wait_start_time = time.perf_counter()
+        try:
+            next(data_iter)
+        except StopIteration:
+            break
+        stall_time += time.perf_counter() - wait_start_time
+        num_batches += 1
+        # Stand-in for the training step
+        time.sleep(sample_step_time * batch_size)
+    elapsed_time = time.perf_counter() - start_time
+    del data_iter
+
+    return {
+        "batch_size": batch_size,
+        "num_workers": num_workers,
+        "prefetch_factor": prefetch_factor,
+        "images_per_second": num_batches * batch_size / elapsed_time,
+        "stall_fraction": stall_time / elapsed_time,
+    }
+
+
+def autotune_dataloader(
+        dataset: Dataset,
+        batch_sizes: list,
+        num_workers_candidates: list,
+        prefetch_factor_candidates: list,
+        sample_step_time: float,
+        max_stall_fraction: float = 0.05,
+        num_probe_batches: int = 20,
+        collate_fn: Optional[Callable] = None,
+) -> dict:
+    """Pick the cheapest dataloader setting that keeps the consumer fed
+
+    Every combination of the candidates is probed. The settings whose consumer stall stays below
+    ``max_stall_fraction`` qualify, and the one with the fewest workers, then the smallest prefetch
+    depth, then the largest batch size wins. When none qualifies the fastest setting is used.
+    """
+    results = []
+    for batch_size, num_workers, prefetch_factor in itertools.product(batch_sizes,
+                                                                       num_workers_candidates,
+                                                                       prefetch_factor_candidates):
+        result = probe_dataloader(dataset, batch_size, num_workers, prefetch_factor, sample_step_time,
+                                  num_probe_batches, collate_fn)
+        print(f"Autotune: batch_size {batch_size:4d}, num_workers {num_workers:3d}, prefetch_factor {prefetch_factor:2d}: "
+              f"{result['images_per_second']:8.1f} images/s, stall {result['stall_fraction'] * 100:5.1f}%")
+        results.append(result)
+
+    fed_results = [result for result in results if result["stall_fraction"] <= max_stall_fraction]
+    if fed_results:
+        return min(fed_results, key=lambda x: (x["num_workers"], x["prefetch_factor"], -x["batch_size"]))
+
+    return max(results, key=lambda x: x["images_per_second"])
+
+
+def load_or_autotune_dataloader(
+        cache_path: str,
+        cache_key: str,
+        autotune_fn: Callable[[], dict],
+) -> Optional[dict]:
+    """Reuse the cached setting of this host and dataset, or run ``autotune_fn`` and cache its result
+
+    Returns:
+        result (dict): The chosen setting, None when no probe could measure a setting. Such a result is not cached,
+            so a later run probes again.
+    """
+    cache_key = f"{socket.gethostname()}|{cache_key}"
+
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+    if cache_key in cache:
+        return cache[cache_key]
+
+    result = autotune_fn()
+    # E.g. the dataset holds fewer batches than the warm up of every setting
+    if result["images_per_second"] == 0:
+        return None
+
+    cache[cache_key] = result
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    with open(cache_path + ".tmp", "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(cache_path + ".tmp", cache_path)
+
+    return result
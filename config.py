@@ -42,19 +42,106 @@ if mode == "train":
     train_image_dir = "./data/ImageNet_1K/ILSVRC2012_img_train"
     valid_image_dir = "./data/ImageNet_1K/ILSVRC2012_img_val"
 
+    # Dataset storage format. `folder` reads one file per image, `shard` streams the tar shards
+    # written by `scripts/pack_shards.py`
+    dataset_format = "folder"
+    train_shard_dir = "./data/ImageNet_1K/ILSVRC2012_img_train_shards"
+    valid_shard_dir = "./data/ImageNet_1K/ILSVRC2012_img_val_shards"
+    shuffle_buffer_size = 10000
+    # Image decoder, `opencv`, `opencv_reduced`, `pil_draft` or `torchvision`. The reduced ones skip resolution that the
+    # transform throws away anyway, see `scripts/benchmark_decode.py`
+    decode_backend = "opencv"
+    # Cached file manifests of the `folder` format, built by `scripts/build_manifest.py`. Empty means glob every launch
+    train_manifest_path = ""
+    valid_manifest_path = ""
+    # Keep the decoded validation crops, `mmap` (reused across runs), `memory` or empty to decode every epoch
+    valid_cache_mode = ""
+    cache_dir = "./data/cache"
+
     image_size = 224
     batch_size = 128
     num_workers = 4
+    # Keep samples uint8 through the augmentations and normalize once per batch on the device
+    uint8_pipeline = False
+    # Run the random rotation and flips of the training images as batched ops on the device instead of in the workers
+    batch_augment = False
+    # Batch loader, `torch` uses the stock DataLoader, `shared_memory` writes the batches into a ring of shared memory
+    # slots (`folder` format only)
+    dataloader_type = "torch"
+    shared_memory_slots = 8
+    # Batches loaded in advance by each dataloader worker
+    prefetch_factor = 2
+    # Probe the candidate loader settings once per host and dataset and reuse the cheapest one that keeps the model fed.
+    # Overrides `batch_size`, `num_workers` and `prefetch_factor`, only with the `torch` dataloader
+    dataloader_autotune = False
+    autotune_cache_path = "./results/dataloader_autotune.json"
+    # Candidate batch sizes as multiples of the batch size of the current progressive resizing stage, e.g. `[0.5, 1, 2]`
+    autotune_batch_size_scales = [1]
+    autotune_num_workers = [2, 4, 8, 12, 16]
+    autotune_prefetch_factors = [2, 4]
+    autotune_max_stall_fraction = 0.05
 
     # The address to load the pretrained model
     pretrained_model_weights_path = "./results/pretrained_models/ResNet18-ImageNet_1K-57bb63e.pth.tar"
 
     # Incremental training and migration training
     resume = ""
+    # Seed of the training sample order, resumed runs continue the same order
+    sampler_seed = 0
+    # Save a resumable checkpoint every n training batches, 0 to only save at the end of every epoch
+    checkpoint_step_interval = 0
+    # Number of epoch checkpoints kept in `samples`, besides the best one, 0 keeps all of them
+    checkpoint_keep_last = 3
+    # Write the checkpoints on a background thread from a CPU copy of the state, training goes on meanwhile
+    checkpoint_async = True
 
     # Total num epochs
     epochs = 600
 
+    # Data echoing for input-bound training, every loaded batch is trained on `data_echo_factor` times.
+    # The repeats get a fresh random shift of up to `data_echo_max_shift` pixels and horizontal flip
+    data_echo_factor = 1
+    data_echo_max_shift = 16
+
+    # Quantization aware training, fine-tunes the fp32 `pretrained_model_weights_path` with fake-quant modules for a
+    # few epochs (use a small `model_lr`) and writes the converted int8 EMA model to `int8.pth.tar` at the end.
+    # The BatchNorm statistics and the observer ranges are frozen from the given epochs on
+    qat = False
+    qat_backend = "fbgemm"
+    qat_freeze_bn_epoch = 2
+    qat_freeze_observer_epoch = 3
+
+    # Progressive resizing, `[start_epoch, image_size, batch_size]` stages sorted by start epoch,
+    # e.g. `[[0, 128, 512], [240, 192, 256], [480, 224, batch_size]]`. Empty trains at `image_size` throughout
+    progressive_resize_schedule = []
+    # FixRes test resolution correction, validate at `fixres_valid_ratio` times the training image size
+    fixres_valid_ratio = 1.0
+
+    # Knowledge distillation from a frozen teacher of any architecture, empty `teacher_model_arch_name` trains on the
+    # labels only. The loss blends `distill_alpha` of the soft-target KL divergence at `distill_temperature` with the
+    # label cross entropy
+    teacher_model_arch_name = ""
+    teacher_model_weights_path = ""
+    distill_temperature = 4.0
+    distill_alpha = 0.5
+    # Cache of the top-k teacher logits of every training sample (center crops, `folder` format), computed once and
+    # memory mapped afterwards, another list of training images rebuilds it. Use a new path for another teacher.
+    # Empty runs the teacher on every batch
+    teacher_logits_cache_path = ""
+    teacher_logits_topk = 10
+
+    # Activation checkpointing of the residual stages, `stage` or `block` granularity, empty keeps every activation.
+    # Recomputes the checkpointed forward passes during backward so that larger batches fit, pick the trade-off with
+    # `scripts/benchmark_checkpointing.py`
+    model_checkpoint_policy = ""
+
+    # Classifier heads after `layer2` and `layer3` for early-exit inference, trained with the weighted sum of the losses
+    # of both exits and of the final classifier. A frozen trunk trains only the heads on top of the pretrained weights,
+    # pick the exit threshold with `scripts/benchmark_early_exit.py`
+    model_early_exits = False
+    early_exit_loss_weights = [0.3, 0.3, 1.0]
+    early_exit_freeze_trunk = False
+
     # Loss parameters
     loss_label_smoothing = 0.1
     loss_weights = 1.0
@@ -78,12 +165,31 @@ if mode == "test":
     # Test data address
     test_image_dir = "./data/ImageNet_1K/ILSVRC2012_img_val"
 
+    # Dataset storage format, `folder` or `shard`
+    dataset_format = "folder"
+    test_shard_dir = "./data/ImageNet_1K/ILSVRC2012_img_val_shards"
+    test_manifest_path = ""
+    # Image decoder, `opencv`, `opencv_reduced`, `pil_draft` or `torchvision`
+    decode_backend = "opencv"
+    # Keep the decoded test crops, `mmap` (reused across runs), `memory` or empty to decode every run
+    test_cache_mode = ""
+    cache_dir = "./data/cache"
+
     # Test dataloader parameters
     image_size = 224
     batch_size = 256
     num_workers = 4
+    # Keep samples uint8 through the preprocessing and normalize once per batch on the device
+    uint8_pipeline = False
+    # Batch loader, `torch` or `shared_memory` (`folder` format only)
+    dataloader_type = "torch"
+    shared_memory_slots = 8
 
     # How many iterations to print the testing result
     test_print_frequency = 20
 
     model_weights_path = "./results/pretrained_models/ResNet18-ImageNet_1K-57bb63e.pth.tar"
+    # Fold the BatchNorms into the convolutions before testing
+    model_fuse_for_inference = False
+    # `model_weights_path` is an int8 checkpoint written by `quantize.py`, tested on the CPU
+    model_quantized = False
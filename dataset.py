@@ -11,15 +11,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import hashlib
+import json
+import math
+import os
 import queue
+import random
 import sys
+import tarfile
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 
 import cv2
+import numpy as np
 import torch
 from PIL import Image
-from torch.utils.data import Dataset, DataLoader
+from torch import distributed as dist
+from torch import multiprocessing
+from torch.utils.data import Dataset, DataLoader, IterableDataset, Sampler, default_collate, get_worker_info
 from torchvision import transforms
 from torchvision.datasets.folder import find_classes## import the find_classes method from the specified module 
 from torchvision.transforms import TrivialAugmentWide## import the TrivialAugmentWide method or class from the specified module  
@@ -28,7 +38,10 @@ import imgproc## imports imgproc which is a small python image processing packag
 
 __all__ = [ # this is a list of strings defining what symbols in a module will be exported when from <module> import * is used on the module.
     "ImageDataset",## means that ImageDataset will be imported when we import * from the current module in a different file
-    "PrefetchGenerator", "PrefetchDataLoader", "CPUPrefetcher", "CUDAPrefetcher",
+    "ShardedImageDataset",
+    "build_manifest", "load_manifest", "collate_uint8_batch", "ResumableRandomSampler", "TRAIN_ROTATION_DEGREES",
+    "VALID_CROP_FRACTION",
+    "PrefetchGenerator", "PrefetchDataLoader", "CPUPrefetcher", "CUDAPrefetcher", "SharedMemoryPrefetcher",
 ]
 
 # Image formats supported by the image processing library
@@ -40,6 +53,216 @@ if sys.platform == "win32":## if the Python interpreter is running on a Windows
 else:## else branch of the if statemenet
     delimiter = "/"## defines the delimiter in the image file path for other systems
 
+# Range of the random rotation of the `Train` images
+TRAIN_ROTATION_DEGREES = [0, 270]
+# Smallest area fraction of the `Train` random resized crop
+TRAIN_CROP_MIN_SCALE = 0.08
+
+# Shorter side of the `Valid`/`Test` images before the center crop
+VALID_RESIZE_SIZE = 256
+# Share of the shorter side kept by the `Valid`/`Test` center crop (224 of 256)
+VALID_CROP_FRACTION = 0.875
+
+# Name of the file describing the shards of a packed dataset
+SHARD_INDEX_FILE_NAME = "index.json"
+# Shards are read sequentially, so use a large read buffer
+SHARD_READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def _build_transforms(
+        image_size: int,
+        mean: list,
+        std: list,
+        mode: str,
+        batch_augment: bool = False,
+        resize_size: int = VALID_RESIZE_SIZE,
+) -> [transforms.Compose, transforms.Compose]:
+    if mode == "Train" and batch_augment:
+        # The rotation and the flips run later on the whole batch, see `imgproc.batch_*`
+        pre_transform = transforms.Compose([
+            transforms.RandomResizedCrop(image_size, (TRAIN_CROP_MIN_SCALE, 1.0), antialias=True),
+            TrivialAugmentWide(),
+        ])
+    elif mode == "Train":## if we are running in training mode...
+        # Use PyTorch's own data enhancement to enlarge and enhance data
+        pre_transform = transforms.Compose([## composes the following transformations together and stored them in the pre_transform field
+            transforms.RandomResizedCrop(image_size, (TRAIN_CROP_MIN_SCALE, 1.0), antialias=True),## crops a random portion of image and resize it to the given size
+            TrivialAugmentWide(),## init a TrivialAugmentWide object and give as parameter
+            transforms.RandomRotation(TRAIN_ROTATION_DEGREES),## rotates the image with 270 degrees
+            transforms.RandomHorizontalFlip(0.5),## flips the image horizontaly with the probability of 0.5
+            transforms.RandomVerticalFlip(0.5),## flips the image verticaly with the probability of 0.5
+        ])
+    elif mode == "Valid" or mode == "Test":## else, if we are in validation or testing mode...
+        # Use PyTorch's own data enhancement to enlarge and enhance data
+        pre_transform = transforms.Compose([## again, composes the following transformations together
+            transforms.Resize(resize_size, antialias=True),## resize the input image to the given size
+            transforms.CenterCrop([image_size, image_size]),## crops the given image at the center to the given size
+        ])
+    else:
+        raise ValueError("Unsupported data read type. Please use `Train` or `Valid` or `Test`")
+
+    post_transform = transforms.Compose([## and again, composes the following transformations together
+        transforms.ConvertImageDtype(torch.float),## converts the image to the float dtype and scale the values accordingly
+        transforms.Normalize(mean, std)## normalizes a tensor image with mean and standard deviation
+    ])
+
+    return pre_transform, post_transform
+
+
+def _pre_transform_image(image: np.ndarray, pre_transform: transforms.Compose) -> Image.Image:
+    # OpenCV convert PIL
+    image = Image.fromarray(image)
+
+    # Data preprocess
+    image = pre_transform(image)
+
+    return image
+
+
+def _decode_min_size(image_size: int, mode: str, resize_size: int = VALID_RESIZE_SIZE) -> int:
+    # The decoder may drop any resolution below what the first resize/crop of the transform keeps
+    if mode == "Valid" or mode == "Test":
+        return resize_size
+    # The smallest random crop spans about `sqrt(TRAIN_CROP_MIN_SCALE)` of a side and is upscaled to `image_size`, so
+    # the decoded image keeps enough pixels for that crop to be upscaled from full resolution
+    return math.ceil(image_size / math.sqrt(TRAIN_CROP_MIN_SCALE))
+
+
+def _preprocess_image(
+        image: np.ndarray,
+        pre_transform: transforms.Compose,
+        post_transform: transforms.Compose,
+        uint8_output: bool = False,
+) -> torch.Tensor:
+    if uint8_output:
+        # The torchvision transforms also accept uint8 CHW tensors, so the image never leaves uint8. The resizes are
+        # antialiased like the ones of PIL images
+        tensor = torch.from_numpy(image).permute(2, 0, 1)
+        return pre_transform(tensor)
+
+    image = _pre_transform_image(image, pre_transform)
+
+    # Convert image data into Tensor stream format (PyTorch).
+    # Note: The range of input and output is between [0, 1]
+    tensor = imgproc.image_to_tensor(image, False, False)
+
+    # Data postprocess
+    tensor = post_transform(tensor)
+
+    return tensor
+
+
+def _manifest_meta_path(manifest_path: str) -> str:
+    return os.path.splitext(manifest_path)[0] + ".json"
+
+
+def _scan_class_dir(image_dir: str, class_name: str, verify: bool) -> list:
+    records = []
+    for entry in os.scandir(os.path.join(image_dir, class_name)):
+        if not entry.is_file() or entry.name.split(".")[-1].lower() not in IMG_EXTENSIONS:
+            continue
+        stat = entry.stat()
+
+        # Only the header is parsed here, unless a full decode is requested
+        try:
+            with Image.open(entry.path) as image:
+                width, height = image.size
+            valid = not verify or cv2.imread(entry.path) is not None
+        except Exception:
+            width, height = 0, 0
+            valid = False
+
+        records.append((f"{class_name}/{entry.name}", class_name, stat.st_size, stat.st_mtime_ns, height, width, valid))
+
+    return sorted(records)
+
+
+def build_manifest(image_dir: str, manifest_path: str, num_workers: int = 8, verify: bool = False) -> np.ndarray:
+    """Create or refresh the file manifest of a class-folder dataset.
+
+    The manifest is a structured numpy array (relative path, class index, file size, mtime,
+    image height/width and a validity flag) saved as ``.npy`` so it can be memory-mapped, plus a
+    ``.json`` sidecar holding the class list and the mtime of every class directory. Only the class
+    directories whose mtime changed since the last build are scanned again.
+
+    Args:
+        image_dir (str): Train/Valid dataset address.
+        manifest_path (str): Where to save the manifest ``.npy`` file.
+        num_workers (int): How many class directories are scanned in parallel.
+        verify (bool): Fully decode every new image instead of only reading its header.
+
+    Returns:
+        manifest (np.ndarray): Memory-mapped manifest records.
+    """
+    meta_path = _manifest_meta_path(manifest_path)
+    class_dir_mtimes = {entry.name: entry.stat().st_mtime_ns for entry in os.scandir(image_dir) if entry.is_dir()}
+    class_names = sorted(class_dir_mtimes.keys())
+
+    old_class_dir_mtimes = {}
+    if os.path.exists(manifest_path) and os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        old_class_dir_mtimes = meta["class_dir_mtimes"]
+        # Nothing changed, the records are not read at all
+        if old_class_dir_mtimes == class_dir_mtimes:
+            return np.load(manifest_path, mmap_mode="r")
+
+    changed_class_names = [class_name for class_name in class_names
+                           if old_class_dir_mtimes.get(class_name) != class_dir_mtimes[class_name]]
+    with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as executor:
+        scanned_records = dict(zip(changed_class_names,
+                                   executor.map(lambda class_name: _scan_class_dir(image_dir, class_name, verify),
+                                                changed_class_names)))
+
+    # Reuse the records of every class directory that did not change. The records are grouped by class in the order of
+    # the class indices, so every class is one slice of the old manifest
+    old_records = {}
+    if old_class_dir_mtimes:
+        old_manifest = np.load(manifest_path, mmap_mode="r")
+        old_class_bounds = np.searchsorted(old_manifest["target"], np.arange(len(meta["classes"]) + 1))
+        for old_class_index, class_name in enumerate(meta["classes"]):
+            if class_name in class_dir_mtimes and class_name not in scanned_records:
+                old_records[class_name] = old_manifest[old_class_bounds[old_class_index]:
+                                                       old_class_bounds[old_class_index + 1]]
+
+    path_length = max([len(record[0].encode("utf-8")) for records in scanned_records.values() for record in records] +
+                      [records.dtype["path"].itemsize for records in old_records.values()] + [1])
+    manifest_dtype = np.dtype([("path", f"S{path_length}"), ("target", np.int32),
+                               ("size", np.int64), ("mtime", np.int64),
+                               ("height", np.int32), ("width", np.int32), ("valid", np.bool_)])
+    class_manifests = []
+    for class_index, class_name in enumerate(class_names):
+        if class_name in scanned_records:
+            class_manifest = np.array([(path.encode("utf-8"), class_index, size, mtime, height, width, valid)
+                                       for path, _, size, mtime, height, width, valid in scanned_records[class_name]],
+                                      dtype=manifest_dtype)
+        else:
+            class_manifest = old_records[class_name].astype(manifest_dtype)
+            class_manifest["target"] = class_index
+        class_manifests.append(class_manifest)
+    manifest = np.concatenate(class_manifests) if class_manifests else np.empty(0, dtype=manifest_dtype)
+
+    # Write to a temporary file first so an interrupted build never leaves a broken manifest behind
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    with open(manifest_path + ".tmp", "wb") as f:
+        np.save(f, manifest)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    with open(meta_path, "w") as f:
+        json.dump({"image_dir": os.path.abspath(image_dir),
+                   "classes": class_names,
+                   "class_dir_mtimes": class_dir_mtimes}, f)
+
+    return np.load(manifest_path, mmap_mode="r")
+
+
+def load_manifest(image_dir: str, manifest_path: str, num_workers: int = 8) -> [np.ndarray, dict]:
+    manifest = build_manifest(image_dir, manifest_path, num_workers)
+    with open(_manifest_meta_path(manifest_path), "r") as f:
+        class_names = json.load(f)["classes"]
+    class_to_idx = {class_name: class_index for class_index, class_name in enumerate(class_names)}
+
+    return manifest, class_to_idx
+
 
 class ImageDataset(Dataset):# defines the class ImageDataset which inherits from 
     """Define training/valid dataset loading methods.
@@ -49,73 +272,409 @@ class ImageDataset(Dataset):# defines the class ImageDataset which inherits from
         image_size (int): Image size.
         mode (str): Data set loading method, the training data set is for data enhancement,
             and the verification data set is not for data enhancement.
+        manifest_path (str): Optional manifest file built by ``build_manifest``. When given, the file
+            list and the classes come from the manifest instead of a glob, and unreadable images are skipped.
+        cache_mode (str): Keep the deterministic `Valid`/`Test` crops decoded as uint8 CHW images. `mmap` stores them
+            in a memory-mapped file under `cache_dir` that is reused by later runs, `memory` holds them in RAM
+            (and reuses the file under `cache_dir` when one is given). Empty disables the cache.
+        cache_dir (str): Directory of the decoded image caches.
+        decode_backend (str): Image decoder, one of ``imgproc.DECODE_BACKENDS``. The reduced backends decode JPEGs
+            straight to the smallest resolution the transform still needs.
+        uint8_output (bool): Return augmented but unnormalized uint8 CHW images. Batch them with ``collate_uint8_batch``
+            and convert them once per batch with ``imgproc.normalize_image_batch``.
+        batch_augment (bool): Leave the random rotation and flips of the `Train` mode to the batched
+            ``imgproc.batch_random_rotate`` and ``imgproc.batch_random_*_flip`` of the consumer.
+        resize_size (int): Shorter side of the `Valid`/`Test` images before the center crop.
     """
 
-    def __init__(self, image_dir: str, image_size: int, mean: list, std: list, mode: str) -> None:
+    def __init__(
+            self,
+            image_dir: str,
+            image_size: int,
+            mean: list,
+            std: list,
+            mode: str,
+            manifest_path: str = "",
+            cache_mode: str = "",
+            cache_dir: str = "",
+            decode_backend: str = "opencv",
+            uint8_output: bool = False,
+            batch_augment: bool = False,
+            resize_size: int = VALID_RESIZE_SIZE,
+    ) -> None:
         super(ImageDataset, self).__init__()## call the init of the parent class in the init of the current class
-        # Iterate over all image paths
-        self.image_file_paths = glob(f"{image_dir}/*/*")## search for files that match the specific file pattern
-        # Form image class label pairs by the folder where the image is located
-        _, self.class_to_idx = find_classes(image_dir)## tries to find the folders named as the image_dir variable in the data set
+        self.image_dir = image_dir
+        self.manifest_path = manifest_path
+        self._manifest = None
+        if self.manifest_path:
+            # Only keep the images that could be read while building the manifest
+            manifest, self.class_to_idx = load_manifest(image_dir, manifest_path)
+            self.manifest_indices = np.flatnonzero(manifest["valid"])
+            self.image_file_paths = None
+        else:
+            # Iterate over all image paths
+            # Sorted, so that the sample indices address the same images in every run
+            self.image_file_paths = sorted(glob(f"{image_dir}/*/*"))## search for files that match the specific file pattern
+            # Form image class label pairs by the folder where the image is located
+            _, self.class_to_idx = find_classes(image_dir)## tries to find the folders named as the image_dir variable in the data set
         self.image_size = image_size## set the image_size class parameter with the value from the initializer
         self.mode = mode## set the mode class parameter with the value from the initializer
         self.delimiter = delimiter## set the delimiter class parameter with the value from the initializer
 
-        if self.mode == "Train":## if we are running in training mode...
-            # Use PyTorch's own data enhancement to enlarge and enhance data
-            self.pre_transform = transforms.Compose([## composes the following transformations together and stored them in the pre_transform field
-                transforms.RandomResizedCrop(self.image_size),## crops a random portion of image and resize it to the given size
-                TrivialAugmentWide(),## init a TrivialAugmentWide object and give as parameter
-                transforms.RandomRotation([0, 270]),## rotates the image with 270 degrees
-                transforms.RandomHorizontalFlip(0.5),## flips the image horizontaly with the probability of 0.5
-                transforms.RandomVerticalFlip(0.5),## flips the image verticaly with the probability of 0.5
-            ])
-        elif self.mode == "Valid" or self.mode == "Test":## else, if we are in validation or testing mode...
-            # Use PyTorch's own data enhancement to enlarge and enhance data
-            self.pre_transform = transforms.Compose([## again, composes the following transformations together
-                transforms.Resize(256),## resize the input image to the given size
-                transforms.CenterCrop([self.image_size, self.image_size]),## crops the given image at the center to the given size
-            ])
-        else:
-            raise "Unsupported data read type. Please use `Train` or `Valid` or `Test`"
-
-        self.post_transform = transforms.Compose([## and again, composes the following transformations together
-            transforms.ConvertImageDtype(torch.float),## converts the image to the float dtype and scale the values accordingly
-            transforms.Normalize(mean, std)## normalizes a tensor image with mean and standard deviation
-        ])
-
-    def __getitem__(self, batch_index: int) -> [torch.Tensor, int]:##  __getitem__ enabling the Python objects to behave like sequences or containers e.g lists, dictionaries, and tuples
-        image_dir, image_name = self.image_file_paths[batch_index].split(self.delimiter)[-2:]## split the image file path based on the system delimiter astablised earlier
-        # Read a batch of image data
-        if image_name.split(".")[-1].lower() in IMG_EXTENSIONS:## check if the extension of the current image is in the defined extensions
-            image = cv2.imread(self.image_file_paths[batch_index])## reads the image using openCV
-            target = self.class_to_idx[image_dir]## gets the images in the image_dir folder set earlier
+        self.pre_transform, self.post_transform = _build_transforms(self.image_size, mean, std, self.mode, batch_augment,
+                                                                    resize_size)
+        self.decode_backend = decode_backend
+        self.decode_min_size = _decode_min_size(self.image_size, self.mode, resize_size)
+        self.uint8_output = uint8_output
+
+        self.cache_mode = cache_mode
+        self.cache_path = ""
+        self._cache = None
+        if self.cache_mode:
+            if self.mode not in ["Valid", "Test"]:
+                raise ValueError("The decoded image cache only supports the deterministic `Valid` or `Test` mode.")
+            if self.cache_mode not in ["mmap", "memory"]:
+                raise ValueError(f"Unsupported cache mode `{self.cache_mode}`, please use `mmap` or `memory`.")
+            if self.cache_mode == "mmap" and not cache_dir:
+                raise ValueError("The `mmap` cache mode needs a `cache_dir`.")
+            if cache_dir:
+                self.cache_path = os.path.join(cache_dir, f"{self._cache_key()}.npy")
+                if not os.path.exists(self.cache_path):
+                    self._build_cache()
+            if self.cache_mode == "memory":
+                self._cache = np.load(self.cache_path) if self.cache_path else self._decode_all()
+
+    @property
+    def manifest(self) -> np.ndarray:
+        # Opened lazily so that every dataloader worker maps the file itself
+        if self._manifest is None:
+            self._manifest = np.load(self.manifest_path, mmap_mode="r")
+        return self._manifest
+
+    @property
+    def cache(self) -> np.ndarray:
+        if self._cache is None:
+            self._cache = np.load(self.cache_path, mmap_mode="r")
+        return self._cache
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_manifest"] = None
+        if self.cache_mode == "mmap":
+            state["_cache"] = None
+        return state
+
+    def file_list_hash(self) -> str:
+        """Hash of the ordered image files, per-sample records keyed by the sample index are only valid for it"""
+        key = hashlib.sha1()
+        key.update(os.path.abspath(self.image_dir).encode("utf-8"))
+        if self.manifest_path:
+            key.update(self.manifest["path"][self.manifest_indices].tobytes())
         else:
+            key.update("\n".join(self.image_file_paths).encode("utf-8"))
+        return key.hexdigest()
+
+    def _cache_key(self) -> str:
+        # Any change of the file list or of the deterministic transform gives a new cache file
+        key = hashlib.sha1()
+        key.update(self.file_list_hash().encode("utf-8"))
+        key.update(repr(self.pre_transform).encode("utf-8"))
+        key.update(self.decode_backend.encode("utf-8"))
+        return f"{self.mode.lower()}-{self.image_size}-{key.hexdigest()[:16]}"
+
+    def _decode_cache_image(self, batch_index: int) -> np.ndarray:
+        image, _ = self._read_image(batch_index)
+        image = _pre_transform_image(image, self.pre_transform)
+        return np.asarray(image).transpose(2, 0, 1)
+
+    def _decode_all(self, cache: np.ndarray = None) -> np.ndarray:
+        if cache is None:
+            cache = np.empty((len(self), 3, self.image_size, self.image_size), dtype=np.uint8)
+
+        # OpenCV and PIL release the GIL while decoding and resizing
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for batch_index, image in enumerate(executor.map(self._decode_cache_image, range(len(self)))):
+                cache[batch_index] = image
+
+        return cache
+
+    def _build_cache(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        # Every process decodes into its own file, so processes that build the same cache at once never rename each
+        # other's file. Distributed training builds it on the main process first, see `train.load_dataset`
+        temp_cache_path = f"{self.cache_path}.{os.getpid()}.tmp.npy"
+        cache = np.lib.format.open_memmap(temp_cache_path, mode="w+", dtype=np.uint8,
+                                          shape=(len(self), 3, self.image_size, self.image_size))
+        self._decode_all(cache)
+        cache.flush()
+        del cache
+        os.replace(temp_cache_path, self.cache_path)
+
+    def _image_file(self, batch_index: int) -> [str, int, tuple]:
+        if self.manifest_path:
+            record = self.manifest[self.manifest_indices[batch_index]]
+            image_file_path = os.path.join(self.image_dir, record["path"].decode("utf-8"))
+            return image_file_path, int(record["target"]), (int(record["height"]), int(record["width"]))
+
+        image_file_path = self.image_file_paths[batch_index]
+        image_dir, image_name = image_file_path.split(self.delimiter)[-2:]## split the image file path based on the system delimiter astablised earlier
+        if image_name.split(".")[-1].lower() not in IMG_EXTENSIONS:## check if the extension of the current image is in the defined extensions
             raise ValueError(f"Unsupported image extensions, Only support `{IMG_EXTENSIONS}`, "## throws an exception if the extension of the image is not a supported one
                              "please check the image file extensions.")
+        target = self.class_to_idx[image_dir]## gets the images in the image_dir folder set earlier
 
-        # BGR to RGB
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)## converts the image from the BGR color space to the RGB color space using openCV
+        return image_file_path, target, None
 
-        # OpenCV convert PIL
-        image = Image.fromarray(image)## creates an image memory from an object exporting the array interface
+    def _read_image(self, batch_index: int) -> [np.ndarray, int]:
+        image_file_path, target, image_shape = self._image_file(batch_index)
+        # Read a batch of image data
+        image = imgproc.decode_image(image_file_path, self.decode_backend, self.decode_min_size, image_shape)
+        if image is None:
+            raise ValueError(f"Failed to read image `{image_file_path}`, "
+                             "build the dataset manifest to find and skip unreadable images.")
+
+        return image, target
 
-        # Data preprocess
-        image = self.pre_transform(image)## applies the previously composed pre transformation on the image
+    def __getitem__(self, batch_index: int) -> [torch.Tensor, int]:##  __getitem__ enabling the Python objects to behave like sequences or containers e.g lists, dictionaries, and tuples
+        if self.cache_mode:
+            # The crop is already decoded, only the dtype conversion and normalization are left
+            tensor = torch.from_numpy(np.array(self.cache[batch_index]))
+            if not self.uint8_output:
+                tensor = self.post_transform(tensor)
+            _, target, _ = self._image_file(batch_index)
+            return {"image": tensor, "target": target, "index": batch_index}
 
-        # Convert image data into Tensor stream format (PyTorch).
-        # Note: The range of input and output is between [0, 1]
-        tensor = imgproc.image_to_tensor(image, False, False)## converts the image into a tensor
+        image, target = self._read_image(batch_index)
 
-        # Data postprocess
-        tensor = self.post_transform(tensor)## applies the previously composed post transformation on the tensor
+        # Decode, augment and normalize the image
+        tensor = _preprocess_image(image, self.pre_transform, self.post_transform, self.uint8_output)
 
-        return {"image": tensor, "target": target}## returns the composed tensor and target
+        # The index addresses per-sample records such as the cached teacher logits
+        return {"image": tensor, "target": target, "index": batch_index}## returns the composed tensor and target
 
     def __len__(self) -> int:# this method is a special method in Python that allows an object to define its length or size
+        if self.manifest_path:
+            return len(self.manifest_indices)
         return len(self.image_file_paths)## defines the length of image_file_paths
 
 
+class ShardedImageDataset(IterableDataset):
+    """Stream training/valid samples from the tar shards written by ``scripts/pack_shards.py``.
+
+    Every shard is read front to back, so an epoch costs a few large sequential reads per worker
+    instead of one small random read per image. Shards are split across the distributed processes and
+    the dataloader workers, and in training mode the shard order is shuffled every epoch and the samples are shuffled
+    through a fixed-size buffer.
+
+    Args:
+        shard_dir (str): Directory holding the shards and their ``index.json``.
+        image_size (int): Image size.
+        mode (str): Data set loading method, the training data set is for data enhancement,
+            and the verification data set is not for data enhancement.
+        shuffle_buffer_size (int): How many encoded samples are kept for shuffling. Only used in `Train` mode.
+        decode_backend (str): Image decoder, one of ``imgproc.DECODE_BACKENDS``.
+        uint8_output (bool): Return augmented but unnormalized uint8 CHW images.
+        batch_augment (bool): Leave the random rotation and flips of the `Train` mode to the consumer.
+        resize_size (int): Shorter side of the `Valid`/`Test` images before the center crop.
+    """
+
+    def __init__(
+            self,
+            shard_dir: str,
+            image_size: int,
+            mean: list,
+            std: list,
+            mode: str,
+            shuffle_buffer_size: int = 10000,
+            decode_backend: str = "opencv",
+            uint8_output: bool = False,
+            batch_augment: bool = False,
+            resize_size: int = VALID_RESIZE_SIZE,
+    ) -> None:
+        super(ShardedImageDataset, self).__init__()
+        with open(os.path.join(shard_dir, SHARD_INDEX_FILE_NAME), "r") as f:
+            shard_index = json.load(f)
+
+        self.shard_file_paths = [os.path.join(shard_dir, shard["name"]) for shard in shard_index["shards"]]
+        self.shard_num_samples = [shard["num_samples"] for shard in shard_index["shards"]]
+        self.class_to_idx = shard_index["class_to_idx"]
+        self.num_samples = shard_index["num_samples"]
+        self.image_size = image_size
+        self.mode = mode
+        self.shuffle = mode == "Train"
+        self.shuffle_buffer_size = shuffle_buffer_size
+        # Shared with the dataloader workers, persistent workers keep their copy of the dataset between epochs
+        self._epoch = multiprocessing.Value("q", 0)
+
+        # Every distributed process reads its own subset of the shards
+        if dist.is_available() and dist.is_initialized():
+            self.rank, self.world_size = dist.get_rank(), dist.get_world_size()
+        else:
+            self.rank, self.world_size = 0, 1
+
+        self.pre_transform, self.post_transform = _build_transforms(self.image_size, mean, std, self.mode, batch_augment,
+                                                                    resize_size)
+        self.decode_backend = decode_backend
+        self.decode_min_size = _decode_min_size(self.image_size, self.mode, resize_size)
+        self.uint8_output = uint8_output
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch.value
+
+    def set_epoch(self, epoch: int) -> None:
+        """Select the shard order of this epoch, call it before every epoch like ``DistributedSampler.set_epoch``"""
+        self._epoch.value = epoch
+
+    def _rank_shard_indices(self, epoch_seed: int) -> list:
+        # All processes and workers draw the same shard order, then each process takes its own slice of it
+        shard_indices = list(range(len(self.shard_file_paths)))
+        if self.shuffle:
+            random.Random(epoch_seed).shuffle(shard_indices)
+        return shard_indices[self.rank::self.world_size]
+
+    def _iter_shard(self, shard_file_path: str):
+        # Stream mode only ever moves forward through the file
+        with open(shard_file_path, "rb", buffering=SHARD_READ_BUFFER_SIZE) as f:
+            with tarfile.open(fileobj=f, mode="r|") as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    image_dir, image_name = member.name.split("/")[-2:]
+                    if image_name.split(".")[-1].lower() not in IMG_EXTENSIONS:
+                        continue
+                    yield tar.extractfile(member).read(), self.class_to_idx[image_dir]
+
+    def _iter_samples(self, shard_file_paths: list, rng: random.Random):
+        if not self.shuffle or self.shuffle_buffer_size <= 1:
+            for shard_file_path in shard_file_paths:
+                yield from self._iter_shard(shard_file_path)
+            return
+
+        # Reservoir style buffer, every new sample replaces a randomly chosen buffered one
+        buffer = []
+        for shard_file_path in shard_file_paths:
+            for sample in self._iter_shard(shard_file_path):
+                if len(buffer) < self.shuffle_buffer_size:
+                    buffer.append(sample)
+                    continue
+                index = rng.randrange(len(buffer))
+                yield buffer[index]
+                buffer[index] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        if worker_info is None:
+            worker_id, num_workers = 0, 1
+            base_seed = torch.initial_seed()
+        else:
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+            base_seed = worker_info.seed - worker_info.id
+
+        # The worker seeds differ between processes, so the shard order is seeded by the epoch alone there
+        epoch_seed = (base_seed if self.world_size == 1 else 0) + self.epoch
+        shard_indices = self._rank_shard_indices(epoch_seed)[worker_id::num_workers]
+        shard_file_paths = [self.shard_file_paths[shard_index] for shard_index in shard_indices]
+        rng = random.Random(epoch_seed * num_workers + worker_id)
+
+        for image_bytes, target in self._iter_samples(shard_file_paths, rng):
+            image = imgproc.decode_image(image_bytes, self.decode_backend, self.decode_min_size)
+            if image is None:
+                continue
+
+            # Decode, augment and normalize the image
+            tensor = _preprocess_image(image, self.pre_transform, self.post_transform, self.uint8_output)
+
+            yield {"image": tensor, "target": target}
+
+    def __len__(self) -> int:
+        # The slice of the shards of this process, and with it its number of samples, changes every epoch
+        if self.world_size == 1:
+            return self.num_samples
+        return sum(self.shard_num_samples[shard_index] for shard_index in self._rank_shard_indices(self.epoch))
+
+
+def collate_uint8_batch(batch: list) -> dict:
+    """Collate uint8 samples into one channels_last uint8 batch.
+
+    The batch is written straight into its final memory layout, so pinning it and copying it to the
+    device moves a quarter of the bytes of a float batch without any further reordering.
+
+    Args:
+        batch (list): Samples returned by a dataset created with ``uint8_output=True``.
+
+    Returns:
+        batch_data (dict): Collated batch, ``image`` is a uint8 NCHW tensor in channels_last memory format.
+    """
+    images = torch.empty((len(batch), *batch[0]["image"].shape), dtype=torch.uint8, memory_format=torch.channels_last)
+    for sample_index, sample in enumerate(batch):
+        images[sample_index].copy_(sample["image"])
+
+    batch_data = default_collate([{k: v for k, v in sample.items() if k != "image"} for sample in batch])
+    batch_data["image"] = images
+
+    return batch_data
+
+
+class ResumableRandomSampler(Sampler):
+    """Seeded random sampler whose position inside the epoch can be saved and restored.
+
+    The order of every epoch only depends on ``seed`` and the epoch number, so a run resumed from
+    ``state_dict`` continues with exactly the samples that were not trained on yet. Like
+    ``DistributedSampler``, every one of ``num_replicas`` processes takes its own slice of the
+    permutation, padded so that all of them get the same number of samples.
+
+    Args:
+        data_source (Dataset): Map-style dataset to sample from.
+        seed (int): Seed of the per-epoch permutations.
+        num_replicas (int): Number of distributed processes.
+        rank (int): Rank of the current process.
+    """
+
+    def __init__(self, data_source: Dataset, seed: int = 0, num_replicas: int = 1, rank: int = 0) -> None:
+        super(ResumableRandomSampler, self).__init__()
+        self.dataset_size = len(data_source)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.num_samples = (self.dataset_size + num_replicas - 1) // num_replicas
+        self.seed = seed
+        self.epoch = 0
+        # Index into the permutation of the current epoch where the iteration starts
+        self.start_index = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        # A restored position only applies to the epoch it was saved in
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self.start_index = 0
+
+    def state_dict(self, num_consumed_samples: int = 0) -> dict:
+        """Position after ``num_consumed_samples`` more samples of the current iteration were trained on"""
+        return {"seed": self.seed, "epoch": self.epoch, "start_index": self.start_index + num_consumed_samples}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self.seed = state_dict["seed"]
+        self.epoch = state_dict["epoch"]
+        self.start_index = state_dict["start_index"]
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        indices = torch.randperm(self.dataset_size, generator=generator).tolist()
+
+        # Repeat the first samples until the permutation splits evenly across the processes
+        total_size = self.num_samples * self.num_replicas
+        indices += indices[:total_size - len(indices)]
+        indices = indices[self.rank:total_size:self.num_replicas]
+
+        yield from indices[self.start_index:]
+
+    def __len__(self) -> int:
+        return max(self.num_samples - self.start_index, 0)
+
+
 class PrefetchGenerator(threading.Thread):
     """A fast data prefetch generator.
 
@@ -183,6 +742,11 @@ class CPUPrefetcher:
     def reset(self):## set all members (of an iterator??) to their initial value
         self.data = iter(self.original_dataloader)
 
+    def close(self) -> None:
+        # The persistent workers shut down once the last reference to their dataloader is gone
+        self.original_dataloader = None
+        self.data = None
+
     def __len__(self) -> int:## this method is a special method in Python that allows an object to define its length or size
         return len(self.original_dataloader)
 
@@ -226,5 +790,206 @@ class CUDAPrefetcher:## define the CUDAPrefetcher, this time not inheriting from
         self.data = iter(self.original_dataloader)
         self.preload()
 
+    def close(self) -> None:
+        # The persistent workers shut down once the last reference to their dataloader is gone
+        self.original_dataloader = None
+        self.data = None
+        self.batch_data = None
+
     def __len__(self) -> int:
         return len(self.original_dataloader)
+
+
+def _shared_memory_worker_loop(
+        dataset: Dataset,
+        slots: list,
+        task_queue: multiprocessing.Queue,
+        result_queue: multiprocessing.Queue,
+        seed: int,
+) -> None:
+    # Every worker draws its own augmentation parameters
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    torch.manual_seed(seed)
+    torch.set_num_threads(1)
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        batch_index, slot_index, indices = task
+
+        try:
+            # Write every sample straight into its row of the shared batch slot
+            slot = slots[slot_index]
+            for sample_index, index in enumerate(indices):
+                for key, value in dataset[index].items():
+                    if torch.is_tensor(value):
+                        slot[key][sample_index].copy_(value)
+                    else:
+                        slot[key][sample_index] = value
+            result_queue.put((batch_index, slot_index, len(indices), None))
+        except Exception as e:
+            result_queue.put((batch_index, slot_index, 0, f"{type(e).__name__}: {e}"))
+
+
+class SharedMemoryPrefetcher:
+    """Load batches through a ring of preallocated shared memory batch slots.
+
+    Every slot holds one full batch. The workers decode the samples directly into the slot of their batch,
+    so nothing is pickled or copied between processes, and ``next`` returns views of the slot. A view is only
+    valid until the following ``next`` call, when its slot goes back to the workers.
+
+    Args:
+        dataset (Dataset): Map-style dataset whose samples all have the same shape, e.g. ``ImageDataset``.
+        batch_size (int): How many samples per batch to load.
+        shuffle (bool): Reshuffle the samples at every ``reset``. Ignored when a ``sampler`` is given.
+        drop_last (bool): Drop the last incomplete batch.
+        num_workers (int): Number of processes to use for data loading.
+        num_slots (int): Size of the ring, i.e. how many batches can be loaded ahead of the consumer.
+        sampler (Sampler): Optional sampler that decides the sample order.
+        seed (int): Base seed of the shuffling and of the workers.
+    """
+
+    def __init__(
+            self,
+            dataset: Dataset,
+            batch_size: int,
+            shuffle: bool = False,
+            drop_last: bool = False,
+            num_workers: int = 4,
+            num_slots: int = 8,
+            sampler: Sampler = None,
+            seed: int = 0,
+    ) -> None:
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.sampler = sampler
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
+
+        # One preallocated batch per slot, laid out like the first sample of the dataset
+        sample = dataset[0]
+        self.slots = []
+        for _ in range(max(num_slots, 2)):
+            slot = {}
+            for key, value in sample.items():
+                if torch.is_tensor(value):
+                    memory_format = torch.channels_last if value.dim() == 3 else torch.contiguous_format
+                    slot[key] = torch.empty((batch_size, *value.shape), dtype=value.dtype, memory_format=memory_format)
+                else:
+                    slot[key] = torch.empty(batch_size, dtype=torch.as_tensor(value).dtype)
+                slot[key].share_memory_()
+            self.slots.append(slot)
+
+        self.task_queue = multiprocessing.Queue()
+        self.result_queue = multiprocessing.Queue()
+        self.workers = []
+        for worker_id in range(max(num_workers, 1)):
+            worker = multiprocessing.Process(target=_shared_memory_worker_loop,
+                                             args=(dataset, self.slots, self.task_queue, self.result_queue,
+                                                   seed + worker_id + 1),
+                                             daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+        self.batches = []
+        self.ready_batches = {}
+        self.free_slots = []
+        self.current_slot = None
+        self.next_submit_index = 0
+        self.next_batch_index = 0
+        self.num_in_flight = 0
+        self.reset()
+
+    def _make_batches(self) -> list:
+        if self.sampler is not None:
+            indices = list(self.sampler)
+        elif self.shuffle:
+            indices = torch.randperm(len(self.dataset), generator=self.generator).tolist()
+        else:
+            indices = list(range(len(self.dataset)))
+
+        batches = [indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+
+        return batches
+
+    def _submit(self) -> None:
+        while self.free_slots and self.next_submit_index < len(self.batches):
+            slot_index = self.free_slots.pop()
+            self.task_queue.put((self.next_submit_index, slot_index, self.batches[self.next_submit_index]))
+            self.next_submit_index += 1
+            self.num_in_flight += 1
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                batch_index, slot_index, num_samples, error = self.result_queue.get(timeout=5.0)
+                break
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError("A shared memory dataloader worker exited unexpectedly.")
+        self.num_in_flight -= 1
+        if error is not None:
+            raise RuntimeError(f"Shared memory dataloader worker failed on batch {batch_index}: {error}")
+        self.ready_batches[batch_index] = (slot_index, num_samples)
+
+    def next(self):
+        # The consumer is done with the previous batch, hand its slot back to the workers
+        if self.current_slot is not None:
+            self.free_slots.append(self.current_slot)
+            self.current_slot = None
+        self._submit()
+
+        if self.next_batch_index >= len(self.batches):
+            return None
+
+        while self.next_batch_index not in self.ready_batches:
+            self._receive()
+        slot_index, num_samples = self.ready_batches.pop(self.next_batch_index)
+        self.next_batch_index += 1
+        self.current_slot = slot_index
+
+        return {key: value[:num_samples] for key, value in self.slots[slot_index].items()}
+
+    def reset(self):
+        # Wait for the batches of the previous pass that are still being written
+        while self.num_in_flight > 0:
+            self._receive()
+
+        self.batches = self._make_batches()
+        self.ready_batches = {}
+        self.free_slots = list(range(len(self.slots)))
+        self.current_slot = None
+        self.next_submit_index = 0
+        self.next_batch_index = 0
+        self._submit()
+
+    def close(self) -> None:
+        workers = getattr(self, "workers", [])
+        for _ in workers:
+            self.task_queue.put(None)
+        for worker in workers:
+            worker.join(timeout=5.0)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        # Release the shared memory of the batch slots
+        self.slots = []
+        self.current_slot = None
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self) -> int:
+        if self.sampler is not None:
+            num_samples = len(self.sampler)
+        else:
+            num_samples = len(self.dataset)
+        if self.drop_last:
+            return num_samples // self.batch_size
+        return (num_samples + self.batch_size - 1) // self.batch_size
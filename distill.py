@@ -0,0 +1,189 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import json
+import os
+import time
+from typing import Optional
+
+import numpy as np
+import torch
+from torch import Tensor
+from torch import distributed as dist
+from torch import nn
+from torch.nn import functional as F
+from torch.utils.data import DataLoader, Dataset
+
+import model
+from utils import build_model_from_checkpoint
+
+__all__ = [
+    "DistillationLoss", "load_teacher_model", "teacher_logits_dtype", "build_teacher_logits_cache",
+    "load_teacher_logits_cache",
+]
+
+
+class DistillationLoss(nn.Module):
+    """Blend of the label cross entropy and the KL divergence to the softened teacher distribution.
+
+    The teacher output is either the full logits of a live teacher, or the top-k logits of a cache together with
+    their class indices. In the latter case the teacher distribution is renormalized over its top-k classes and the
+    student is matched on those classes.
+
+    Args:
+        temperature (float): Softmax temperature of both distributions, the soft loss is scaled by its square.
+        alpha (float): Weight of the soft loss, the label loss gets ``1 - alpha``.
+        label_smoothing (float): Label smoothing of the cross entropy.
+    """
+
+    def __init__(self, temperature: float, alpha: float, label_smoothing: float = 0.0) -> None:
+        super(DistillationLoss, self).__init__()
+        self.temperature = temperature
+        self.alpha = alpha
+        self.label_smoothing = label_smoothing
+
+    def forward(
+            self,
+            output: Tensor,
+            target: Tensor,
+            teacher_output: Tensor,
+            teacher_indices: Optional[Tensor] = None,
+    ) -> Tensor:
+        label_loss = F.cross_entropy(output, target, label_smoothing=self.label_smoothing)
+
+        # The softened distributions are computed in fp32 under autocast as well
+        log_probs = F.log_softmax(output.float() / self.temperature, dim=1)
+        if teacher_indices is not None:
+            log_probs = log_probs.gather(1, teacher_indices)
+        teacher_probs = F.softmax(teacher_output.float() / self.temperature, dim=1)
+        soft_loss = F.kl_div(log_probs, teacher_probs, reduction="batchmean") * self.temperature ** 2
+
+        return self.alpha * soft_loss + (1 - self.alpha) * label_loss
+
+
+def load_teacher_model(
+        model_arch_name: str,
+        model_num_classes: int,
+        model_weights_path: str,
+        device: torch.device,
+) -> nn.Module:
+    """Build any ``model.py`` architecture from its checkpoint as a frozen teacher in evaluation mode"""
+    teacher_model = build_model_from_checkpoint(model.__dict__[model_arch_name], model_weights_path,
+                                                num_classes=model_num_classes)
+    teacher_model = teacher_model.to(device=device, memory_format=torch.channels_last).eval()
+    teacher_model.requires_grad_(False)
+
+    return teacher_model
+
+
+def teacher_logits_dtype(topk: int) -> np.dtype:
+    # One record per training sample, the largest teacher logits and their class indices
+    return np.dtype([("values", np.float16, (topk,)), ("indices", np.int32, (topk,))])
+
+
+def _teacher_logits_meta_path(cache_path: str) -> str:
+    # The hash of the file list the records were written for, next to the records
+    return cache_path + ".json"
+
+
+def load_teacher_logits_cache(
+        cache_path: str,
+        num_samples: int,
+        topk: int,
+        file_list_hash: str,
+) -> Optional[np.ndarray]:
+    """Memory map a cache written by ``build_teacher_logits_cache``, None if it is missing or does not match"""
+    meta_path = _teacher_logits_meta_path(cache_path)
+    if not os.path.exists(cache_path) or not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    if meta.get("file_list_hash") != file_list_hash:
+        print(f"Teacher logits cache `{cache_path}` was written for a different list of training images.")
+        return None
+
+    teacher_logits = np.lib.format.open_memmap(cache_path, mode="r")
+    if teacher_logits.shape != (num_samples,) or teacher_logits.dtype != teacher_logits_dtype(topk):
+        print(f"Teacher logits cache `{cache_path}` holds {teacher_logits.shape[0]} samples of {teacher_logits.dtype}, "
+              f"expected {num_samples} top-{topk} samples.")
+        return None
+
+    return teacher_logits
+
+
+def build_teacher_logits_cache(
+        teacher_model: nn.Module,
+        dataset: Dataset,
+        cache_path: str,
+        topk: int,
+        batch_size: int,
+        num_workers: int,
+        device: torch.device,
+        file_list_hash: str,
+) -> np.ndarray:
+    """Run the teacher once over every sample and store its top-k logits in a memory-mapped ``.npy`` file
+
+    The records are addressed by the ``index`` of the samples, so ``dataset`` must list the training images in the
+    order of the training dataset, e.g. the same ``ImageDataset`` directory and manifest in `Valid` mode. The
+    ``file_list_hash`` of that order is stored next to the records, a later run with other images rebuilds the cache.
+    Distributed processes each fill their share of the records of one file, the cache directory must be shared
+    between them.
+
+    Returns:
+        teacher_logits (np.ndarray): Read-only memory map of ``teacher_logits_dtype(topk)`` records
+    """
+    rank, world_size = (dist.get_rank(), dist.get_world_size()) if dist.is_initialized() else (0, 1)
+    start_time = time.time()
+
+    # Written under a temporary name, so an interrupted run never leaves a cache that looks complete
+    tmp_cache_path = cache_path + ".tmp.npy"
+    if rank == 0:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        np.lib.format.open_memmap(tmp_cache_path, mode="w+", dtype=teacher_logits_dtype(topk), shape=(len(dataset),))
+    if world_size > 1:
+        dist.barrier()
+
+    teacher_logits = np.lib.format.open_memmap(tmp_cache_path, mode="r+")
+    dataloader = DataLoader(dataset,
+                            batch_size=batch_size,
+                            sampler=range(rank, len(dataset), world_size),
+                            num_workers=num_workers,
+                            pin_memory=device.type == "cuda")
+    with torch.no_grad():
+        for batch_data in dataloader:
+            images = batch_data["image"].to(device=device, memory_format=torch.channels_last, non_blocking=True)
+            with torch.autocast(device.type, enabled=device.type == "cuda"):
+                output = teacher_model(images)
+            values, indices = output.float().topk(topk, dim=1)
+
+            sample_indices = batch_data["index"].numpy()
+            teacher_logits["values"][sample_indices] = values.cpu().numpy()
+            teacher_logits["indices"][sample_indices] = indices.cpu().numpy()
+    teacher_logits.flush()
+    del teacher_logits
+
+    if world_size > 1:
+        dist.barrier()
+    if rank == 0:
+        meta_path = _teacher_logits_meta_path(cache_path)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"file_list_hash": file_list_hash}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        os.replace(tmp_cache_path, cache_path)
+        print(f"Cache the top-{topk} teacher logits of {len(dataset)} samples to `{cache_path}` "
+              f"in {time.time() - start_time:.1f}s.")
+    if world_size > 1:
+        dist.barrier()
+
+    return load_teacher_logits_cache(cache_path, len(dataset), topk, file_list_hash)
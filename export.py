@@ -0,0 +1,192 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import json
+import os
+import time
+
+import torch
+from torch import nn
+
+import model
+from quantize import load_quantized_model
+from utils import build_model_from_checkpoint, load_checkpoint, load_torchscript, measure_latency, \
+    save_indexed_checkpoint, state_dict_sha256, TORCHSCRIPT_META_FILE
+
+__all__ = [
+    "export_torchscript", "export_weights",
+]
+
+model_names = sorted(
+    name for name in model.__dict__ if name.islower() and not name.startswith("_") and callable(model.__dict__[name]))
+
+
+def export_torchscript(resnet_model: nn.Module, method: str, image_size: int, channels_last: bool) -> torch.jit.ScriptModule:
+    """Compile the model to TorchScript and freeze its weights and attributes into the graph
+
+    Args:
+        resnet_model (nn.Module): Model in evaluation mode.
+        method (str): `script` compiles the Python code, `trace` records one forward pass of a random image.
+        image_size (int): Image size of the trace input.
+        channels_last (bool): Trace the model with a channels_last input.
+
+    Returns:
+        script_model (torch.jit.ScriptModule): The frozen model
+    """
+    with torch.no_grad():
+        if method == "script":
+            script_model = torch.jit.script(resnet_model)
+        elif method == "trace":
+            images = torch.randn([1, 3, image_size, image_size])
+            if channels_last:
+                images = images.contiguous(memory_format=torch.channels_last)
+            script_model = torch.jit.trace(resnet_model, images)
+        else:
+            raise ValueError(f"Unsupported export method `{method}`.")
+
+        # The weights become constants of the graph. `torch.jit.optimize_for_inference` is left to the loading side,
+        # its graphs depend on the host and can not be serialized
+        script_model = torch.jit.freeze(script_model)
+
+    return script_model
+
+
+def export_weights(checkpoint: dict, weights_source: str, dtype: torch.dtype) -> dict:
+    """Keep only the model weights of a training checkpoint, for serving
+
+    Args:
+        checkpoint (dict): Checkpoint of ``train.py``.
+        weights_source (str): `ema` takes the weights of the EMA model, `model` the trained weights.
+        dtype (torch.dtype): The floating point tensors are cast to it, `torch.float16` or `torch.bfloat16` halve the file.
+
+    Returns:
+        state_dict (dict): The weights under the names of ``model.py``
+    """
+    if weights_source == "ema":
+        if "ema_state_dict" not in checkpoint:
+            raise ValueError("The checkpoint has no EMA weights, export them with `--weights_source model`.")
+        # `AveragedModel` wraps the model as `module` and counts the averaged steps in `n_averaged`
+        state_dict = {k[len("module."):]: v for k, v in checkpoint["ema_state_dict"].items() if k.startswith("module.")}
+    elif weights_source == "model":
+        state_dict = dict(checkpoint["state_dict"].items())
+    else:
+        raise ValueError(f"Unsupported weights source `{weights_source}`.")
+
+    return {k: v.to(dtype) if v.is_floating_point() else v for k, v in state_dict.items()}
+
+
+def main(args) -> None:
+    torch.set_num_threads(args.num_threads)
+
+    if args.format == "weights":
+        if args.quantized:
+            raise ValueError("Export int8 checkpoints with `--format torchscript`.")
+        checkpoint = load_checkpoint(args.model_weights_path)
+        state_dict = export_weights(checkpoint, args.weights_source, getattr(torch, args.dtype))
+        # `utils.build_model_from_checkpoint` reads the pruned channels and checks the hash
+        save_indexed_checkpoint({"state_dict": state_dict,
+                                 "block_channels": checkpoint.get("block_channels"),
+                                 "model_arch_name": args.model_arch_name,
+                                 "model_num_classes": args.model_num_classes,
+                                 "weights_source": args.weights_source,
+                                 "dtype": args.dtype,
+                                 "source_weights_path": os.path.abspath(args.model_weights_path),
+                                 "sha256": state_dict_sha256(state_dict)},
+                                args.output_path)
+        print(f"Save `{args.weights_source}` {args.dtype} weights to `{os.path.abspath(args.output_path)}`, "
+              f"{os.path.getsize(args.model_weights_path) / 1024 / 1024:.1f}MB -> "
+              f"{os.path.getsize(args.output_path) / 1024 / 1024:.1f}MB.")
+
+        # The weights are loaded back the way `inference.py` does, against the source weights
+        resnet_model = build_model_from_checkpoint(model.__dict__[args.model_arch_name], args.output_path,
+                                                   num_classes=args.model_num_classes).eval()
+        source_model = build_model_from_checkpoint(model.__dict__[args.model_arch_name], args.model_weights_path,
+                                                   num_classes=args.model_num_classes)
+        source_model.load_state_dict(export_weights(checkpoint, args.weights_source, torch.float32), strict=False)
+        images = torch.randn([2, 3, args.image_size, args.image_size])
+        with torch.no_grad():
+            max_difference = (source_model.eval()(images) - resnet_model(images)).abs().max().item()
+        print(f"Max output difference to the source weights: {max_difference:.2e}")
+        return
+
+    if args.quantized:
+        resnet_model = load_quantized_model(args.model_arch_name, args.model_num_classes, args.model_weights_path)
+    else:
+        resnet_model = build_model_from_checkpoint(model.__dict__[args.model_arch_name], args.model_weights_path,
+                                                   num_classes=args.model_num_classes)
+    resnet_model.eval()
+    print(f"Load `{args.model_arch_name}` model weights `{os.path.abspath(args.model_weights_path)}` successfully.")
+
+    # A quantized model is fused already
+    if args.fuse_for_inference and not args.quantized:
+        resnet_model.fuse_for_inference()
+    if args.channels_last:
+        resnet_model = resnet_model.to(memory_format=torch.channels_last)
+
+    start_time = time.time()
+    script_model = export_torchscript(resnet_model, args.method, args.image_size, args.channels_last)
+    print(f"Export `{args.model_arch_name}` with `torch.jit.{args.method}` in {time.time() - start_time:.1f}s.")
+
+    meta = {
+        "model_arch_name": args.model_arch_name,
+        "model_num_classes": args.model_num_classes,
+        "model_mean_parameters": args.model_mean_parameters,
+        "model_std_parameters": args.model_std_parameters,
+        "image_size": args.image_size,
+        "channels_last": args.channels_last,
+        "fuse_for_inference": args.fuse_for_inference or args.quantized,
+        "quantized": args.quantized,
+        "method": args.method,
+        "source_weights_path": os.path.abspath(args.model_weights_path),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_path)), exist_ok=True)
+    torch.jit.save(script_model, args.output_path, _extra_files={TORCHSCRIPT_META_FILE: json.dumps(meta)})
+    print(f"Save TorchScript model to `{os.path.abspath(args.output_path)}`.")
+
+    # The saved model is loaded back the way `inference.py` does, it must still compute the outputs of the eager model
+    script_model, _ = load_torchscript(args.output_path, torch.device("cpu"))
+    images = torch.randn([2, 3, args.image_size, args.image_size]).contiguous(memory_format=torch.channels_last)
+    with torch.no_grad():
+        max_difference = (resnet_model(images) - script_model(images)).abs().max().item()
+    print(f"Max output difference to the eager model: {max_difference:.2e}")
+
+    eager_latency = measure_latency(resnet_model, 1, args.image_size, args.num_iters)
+    script_latency = measure_latency(script_model, 1, args.image_size, args.num_iters)
+    print(f"Batch size 1 latency: eager {eager_latency:.2f}ms, torchscript {script_latency:.2f}ms.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a checkpoint to a frozen TorchScript model, or to its bare "
+                                                 "weights, for inference.")
+    parser.add_argument("--model_arch_name", type=str, default="resnet18", choices=model_names)
+    parser.add_argument("--model_mean_parameters", type=float, nargs=3, default=[0.485, 0.456, 0.406])
+    parser.add_argument("--model_std_parameters", type=float, nargs=3, default=[0.229, 0.224, 0.225])
+    parser.add_argument("--model_num_classes", type=int, default=1000)
+    parser.add_argument("--model_weights_path", type=str, default="./results/pretrained_models/ResNet18-ImageNet_1K-57bb63e.pth.tar")
+    parser.add_argument("--output_path", type=str, default="./results/pretrained_models/ResNet18-ImageNet_1K.pt")
+    parser.add_argument("--format", type=str, default="torchscript", choices=["torchscript", "weights"],
+                        help="`weights` writes only the model weights, as an indexed checkpoint that `inference.py` loads.")
+    parser.add_argument("--weights_source", type=str, default="ema", choices=["ema", "model"], help="Weights of the `weights` format.")
+    parser.add_argument("--dtype", type=str, default="float16", choices=["float32", "float16", "bfloat16"],
+                        help="Floating point type of the `weights` format, the weights are cast back to fp32 on load.")
+    parser.add_argument("--quantized", action="store_true", help="`model_weights_path` is an int8 checkpoint written by `quantize.py`.")
+    parser.add_argument("--method", type=str, default="script", choices=["script", "trace"])
+    parser.add_argument("--image_size", type=int, default=224)
+    parser.add_argument("--fuse_for_inference", action="store_true", help="Fold the BatchNorms into the convolutions.")
+    parser.add_argument("--channels_last", action="store_true", help="Store the weights in the channels_last memory format.")
+    parser.add_argument("--num_threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--num_iters", type=int, default=20)
+    args = parser.parse_args()
+
+    main(args)
@@ -11,6 +11,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import io
 import random## import module to be able to generate random numbers
 from typing import Any## import module that provides runtime support for type hints
 from torch import Tensor## import the Tensor class from torch module
@@ -18,14 +19,104 @@ from numpy import ndarray
 import cv2
 import numpy as np
 import torch
+import torchvision
+from PIL import Image
+from torch.nn import functional as F_torch
 from torchvision.transforms import functional as F_vision## import the functional module from torchvision.transforms and alias it to F_vision
 
 __all__ = [
-    "image_to_tensor", "tensor_to_image",
+    "DECODE_BACKENDS", "decode_image",
+    "image_to_tensor", "tensor_to_image", "normalize_image_batch",
     "center_crop", "random_crop", "random_rotate", "random_vertically_flip", "random_horizontally_flip",
+    "batch_random_crop", "batch_random_shift", "batch_random_rotate", "batch_random_rotate_crop",
+    "batch_random_horizontally_flip", "batch_random_vertically_flip",
 ]
 
 
+# Image decoders supported by ``decode_image``
+DECODE_BACKENDS = ("opencv", "opencv_reduced", "pil_draft", "torchvision")
+
+# JPEG decoders can scale the image down by these factors in the DCT domain
+_OPENCV_REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+
+def _read_image_shape(image_file: str | bytes) -> tuple:
+    # Only parses the header, no pixel data is decoded
+    with Image.open(io.BytesIO(image_file) if isinstance(image_file, bytes) else image_file) as image:
+        width, height = image.size
+    return height, width
+
+
+def decode_image(
+        image_file: str | bytes,
+        backend: str = "opencv",
+        min_size: int = 0,
+        image_shape: tuple = None,
+) -> ndarray:
+    """Decode an image file into an RGB uint8 np.ndarray (HWC)
+
+    The reduced backends let the JPEG decoder skip the resolution that the following resize throws away,
+    the shorter side of the result is kept at least ``min_size`` pixels.
+
+    Args:
+        image_file (str | bytes): Image file path or the encoded file content
+        backend (str): One of ``DECODE_BACKENDS``. ``opencv`` and ``torchvision`` always decode at full resolution,
+            ``opencv_reduced`` uses ``cv2.IMREAD_REDUCED_COLOR_*`` and ``pil_draft`` uses ``PIL.Image.draft``
+        min_size (int): Smallest acceptable shorter side of the decoded image, 0 decodes at full resolution
+        image_shape (tuple): Optional known (height, width) of the image, saves reading the header for ``opencv_reduced``
+
+    Returns:
+        image (np.ndarray): RGB image, the data range is [0, 255]
+
+    Examples:
+        >>> example_image = decode_image("example_image.JPEG", "pil_draft", 256)
+
+    """
+    if backend == "opencv" or (backend == "opencv_reduced" and min_size <= 0):
+        if isinstance(image_file, bytes):
+            image = cv2.imdecode(np.frombuffer(image_file, np.uint8), cv2.IMREAD_COLOR)
+        else:
+            image = cv2.imread(image_file)
+    elif backend == "opencv_reduced":
+        if image_shape is None:
+            image_shape = _read_image_shape(image_file)
+        # Pick the strongest reduction that keeps the shorter side above `min_size`
+        flags = cv2.IMREAD_COLOR
+        for factor, reduced_flags in _OPENCV_REDUCED_FLAGS.items():
+            if min(image_shape) // factor >= min_size:
+                flags = reduced_flags
+                break
+        if isinstance(image_file, bytes):
+            image = cv2.imdecode(np.frombuffer(image_file, np.uint8), flags)
+        else:
+            image = cv2.imread(image_file, flags)
+    elif backend == "pil_draft":
+        with Image.open(io.BytesIO(image_file) if isinstance(image_file, bytes) else image_file) as image:
+            if min_size > 0:
+                # Only affects JPEG, both sides of the result stay at least `min_size`
+                image.draft("RGB", (min_size, min_size))
+            return np.asarray(image.convert("RGB"))
+    elif backend == "torchvision":
+        if isinstance(image_file, bytes):
+            data = torch.frombuffer(bytearray(image_file), dtype=torch.uint8)
+        else:
+            data = torchvision.io.read_file(image_file)
+        image = torchvision.io.decode_image(data, mode=torchvision.io.ImageReadMode.RGB)
+        return image.permute(1, 2, 0).numpy()
+    else:
+        raise ValueError(f"Unsupported decode backend `{backend}`, only support `{DECODE_BACKENDS}`.")
+
+    if image is None:
+        return None
+
+    # BGR to RGB
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
 def image_to_tensor(image: np.ndarray, range_norm: bool, half: bool) -> torch.Tensor:## defining a function that converts the image data type to the tensor data type
     """Convert the image data type to the Tensor (NCWH) data type supported by PyTorch
 
@@ -85,6 +176,29 @@ def tensor_to_image(tensor: torch.Tensor, range_norm: bool, half: bool) -> Any:
     return image## return the image with all the previously applied operations and transformations
 
 
+def normalize_image_batch(images: Tensor, mean: list, std: list) -> Tensor:
+    """Convert a uint8 image batch to normalized torch.float32 in one pass
+
+    Args:
+        images (Tensor): uint8 image batch (NCHW), the data range is [0, 255]
+        mean (list): Per channel mean of the [0, 1] scaled images
+        std (list): Per channel standard deviation of the [0, 1] scaled images
+
+    Returns:
+        tensor (Tensor): Normalized image batch, in the memory format of ``images``
+
+    Examples:
+        >>> example_images = torch.randint(0, 256, [8, 3, 224, 224], dtype=torch.uint8)
+        >>> example_tensor = normalize_image_batch(example_images, [0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+
+    """
+    # Fold the [0, 255] -> [0, 1] scaling into the normalization constants
+    mean = torch.tensor(mean, dtype=torch.float32, device=images.device).view(1, -1, 1, 1).mul_(255.0)
+    std = torch.tensor(std, dtype=torch.float32, device=images.device).view(1, -1, 1, 1).mul_(255.0)
+
+    return images.float().sub_(mean).div_(std)
+
+
 def center_crop(## defines a function meant to crop an image given as parameter
         images: ndarray | Tensor | list[ndarray] | list[Tensor],## image input parameter which can be of multiple data types
         patch_size: int,## the patch size we want to crop to
@@ -254,3 +368,189 @@ def random_vertically_flip(
         images = images[0]
 
     return images
+
+
+def _batch_affine_sample(images: Tensor, theta: Tensor, output_size: list, interpolation: str) -> Tensor:
+    # grid_sample only works on floating point data
+    input_dtype = images.dtype
+    if not images.is_floating_point():
+        images = images.float()
+
+    grid = F_torch.affine_grid(theta.to(images.dtype), [images.size(0), images.size(1), *output_size], align_corners=False)
+    images = F_torch.grid_sample(images, grid, mode=interpolation, padding_mode="zeros", align_corners=False)
+
+    if not input_dtype.is_floating_point:
+        images = images.round_().clamp_(0, 255).to(input_dtype)
+
+    return images
+
+
+def _batch_rotate_crop_theta(
+        batch_size: int,
+        image_height: int,
+        image_width: int,
+        patch_height: int,
+        patch_width: int,
+        degrees: tuple,
+        random_offset: bool,
+        device: torch.device,
+) -> Tensor:
+    # Per sample angle, counter-clockwise like torchvision
+    angles = torch.empty(batch_size, device=device).uniform_(degrees[0], degrees[1]).deg2rad_()
+    cos, sin = angles.cos(), angles.sin()
+
+    # Per sample patch center in pixels
+    if random_offset:
+        center_x = torch.rand(batch_size, device=device) * (image_width - patch_width) + patch_width / 2
+        center_y = torch.rand(batch_size, device=device) * (image_height - patch_height) + patch_height / 2
+    else:
+        center_x = torch.full((batch_size,), image_width / 2, device=device)
+        center_y = torch.full((batch_size,), image_height / 2, device=device)
+
+    # Maps the normalized output coordinates to the normalized input coordinates
+    theta = torch.stack([
+        torch.stack([cos * patch_width / image_width, -sin * patch_height / image_width, 2 * center_x / image_width - 1], 1),
+        torch.stack([sin * patch_width / image_height, cos * patch_height / image_height, 2 * center_y / image_height - 1], 1),
+    ], 1)
+
+    return theta
+
+
+def batch_random_crop(images: Tensor, patch_size: int) -> Tensor:
+    """Crop every image of a batch at its own random position
+
+    Args:
+        images (Tensor): Image batch (NCHW), any dtype
+        patch_size (int): The patch size we want to crop to
+
+    Returns:
+        images (Tensor): Cropped image batch (N, C, patch_size, patch_size)
+
+    Examples:
+        >>> example_images = torch.randint(0, 256, [8, 3, 256, 256], dtype=torch.uint8)
+        >>> example_patches = batch_random_crop(example_images, 224)
+
+    """
+    batch_size, _, image_height, image_width = images.size()
+    top = torch.randint(0, image_height - patch_size + 1, (batch_size, 1, 1), device=images.device)
+    left = torch.randint(0, image_width - patch_size + 1, (batch_size, 1, 1), device=images.device)
+    offsets = torch.arange(patch_size, device=images.device)
+
+    # One gather for the whole batch: (N, patch_size, patch_size, C)
+    batch_indices = torch.arange(batch_size, device=images.device).view(-1, 1, 1)
+    images = images.permute(0, 2, 3, 1)[batch_indices, top + offsets.view(1, -1, 1), left + offsets.view(1, 1, -1)]
+
+    return images.permute(0, 3, 1, 2).contiguous(memory_format=torch.channels_last)
+
+
+def batch_random_shift(images: Tensor, max_shift: int) -> Tensor:
+    """Shift every image of a batch by its own random offset of up to ``max_shift`` pixels, keeping the image size
+
+    Args:
+        images (Tensor): Image batch (NCHW), any dtype
+        max_shift (int): Largest shift along each axis, the uncovered border is filled with zeros
+
+    Returns:
+        images (Tensor): Shifted image batch
+
+    Examples:
+        >>> example_images = torch.randint(0, 256, [8, 3, 224, 224], dtype=torch.uint8)
+        >>> example_images = batch_random_shift(example_images, 16)
+
+    """
+    batch_size, _, image_height, image_width = images.size()
+    images = F_torch.pad(images, [max_shift, max_shift, max_shift, max_shift])
+    top = torch.randint(0, 2 * max_shift + 1, (batch_size, 1, 1), device=images.device)
+    left = torch.randint(0, 2 * max_shift + 1, (batch_size, 1, 1), device=images.device)
+
+    # One gather for the whole batch: (N, H, W, C)
+    batch_indices = torch.arange(batch_size, device=images.device).view(-1, 1, 1)
+    rows = top + torch.arange(image_height, device=images.device).view(1, -1, 1)
+    columns = left + torch.arange(image_width, device=images.device).view(1, 1, -1)
+    images = images.permute(0, 2, 3, 1)[batch_indices, rows, columns]
+
+    return images.permute(0, 3, 1, 2).contiguous(memory_format=torch.channels_last)
+
+
+def batch_random_rotate(images: Tensor, degrees: tuple, interpolation: str = "nearest") -> Tensor:
+    """Rotate every image of a batch by its own random angle around the image center
+
+    Args:
+        images (Tensor): Image batch (NCHW), uint8 or floating point
+        degrees (tuple): Range (min, max) of the counter-clockwise angles, like ``transforms.RandomRotation``
+        interpolation (str): ``nearest`` or ``bilinear``
+
+    Returns:
+        images (Tensor): Rotated image batch, the corners are filled with zeros
+
+    Examples:
+        >>> example_images = torch.randint(0, 256, [8, 3, 224, 224], dtype=torch.uint8)
+        >>> example_images = batch_random_rotate(example_images, (0, 270))
+
+    """
+    batch_size, _, image_height, image_width = images.size()
+    theta = _batch_rotate_crop_theta(batch_size, image_height, image_width, image_height, image_width,
+                                     degrees, False, images.device)
+
+    return _batch_affine_sample(images, theta, [image_height, image_width], interpolation)
+
+
+def batch_random_rotate_crop(
+        images: Tensor,
+        patch_size: int,
+        degrees: tuple,
+        interpolation: str = "nearest",
+) -> Tensor:
+    """Randomly crop and rotate every image of a batch with a single resampling pass
+
+    Args:
+        images (Tensor): Image batch (NCHW), uint8 or floating point
+        patch_size (int): The patch size we want to crop to
+        degrees (tuple): Range (min, max) of the counter-clockwise angles around the patch center
+        interpolation (str): ``nearest`` or ``bilinear``
+
+    Returns:
+        images (Tensor): Image batch (N, C, patch_size, patch_size)
+
+    Examples:
+        >>> example_images = torch.randint(0, 256, [8, 3, 256, 256], dtype=torch.uint8)
+        >>> example_patches = batch_random_rotate_crop(example_images, 224, (-15, 15))
+
+    """
+    batch_size, _, image_height, image_width = images.size()
+    theta = _batch_rotate_crop_theta(batch_size, image_height, image_width, patch_size, patch_size,
+                                     degrees, True, images.device)
+
+    return _batch_affine_sample(images, theta, [patch_size, patch_size], interpolation)
+
+
+def batch_random_horizontally_flip(images: Tensor, p: float = 0.5) -> Tensor:
+    """Flip every image of a batch horizontally with probability ``p``, decided per image
+
+    Args:
+        images (Tensor): Image batch (NCHW), any dtype
+        p (float): Flip probability of each image
+
+    Returns:
+        images (Tensor): Image batch
+
+    """
+    flip_mask = torch.rand(images.size(0), device=images.device).lt(p).view(-1, 1, 1, 1)
+
+    return torch.where(flip_mask, images.flip(-1), images)
+
+
+def batch_random_vertically_flip(images: Tensor, p: float = 0.5) -> Tensor:
+    """Flip every image of a batch vertically with probability ``p``, decided per image
+
+    Args:
+        images (Tensor): Image batch (NCHW), any dtype
+        p (float): Flip probability of each image
+
+    Returns:
+        images (Tensor): Image batch
+
+    """
+    flip_mask = torch.rand(images.size(0), device=images.device).lt(p).view(-1, 1, 1, 1)
+
+    return torch.where(flip_mask, images.flip(-2), images)
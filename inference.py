@@ -22,11 +22,7 @@ from torch import nn## import torch, ML library
 from torchvision.transforms import Resize, ConvertImageDtype, Normalize## import a few classes from the torchvision transform module for transforamtions
 
 import imgproc## import module defined in the same project
-import model## models is a lightweight framework for mapping Python classes to schema-less databases, according to Google
-from utils import load_state_dict## import function to work with dictionaries
-
-model_names = sorted(## function that returns a sorted list of the specified iterable object filtered by the if condition
-    name for name in model.__dict__ if name.islower() and not name.startswith("__") and callable(model.__dict__[name]))
+from utils import build_model_from_checkpoint, load_torchscript## import function to work with dictionaries
 
 
 def load_class_label(class_label_file: str, num_classes: int) -> list:
@@ -45,8 +41,18 @@ def choice_device(device_type: str) -> torch.device:
     return device
 
 
-def build_model(model_arch_name: str, model_num_classes: int, device: torch.device) -> [nn.Module, nn.Module]:## class used to build a module
-    resnet_model = model.__dict__[model_arch_name](num_classes=model_num_classes)## created an instance of a ResNet model based on the specified architecture name model_arch_name and the number of classes model_num_classes.
+def build_model(
+        model_arch_name: str,
+        model_num_classes: int,
+        device: torch.device,
+        model_weights_path: str,
+) -> [nn.Module, nn.Module]:## class used to build a module
+    # Imported here, so a TorchScript model starts without the model code
+    import model## models is a lightweight framework for mapping Python classes to schema-less databases, according to Google
+
+    # The weights come straight from the memory-mapped checkpoint, the model is not initialized first
+    resnet_model = build_model_from_checkpoint(model.__dict__[model_arch_name], model_weights_path,
+                                               num_classes=model_num_classes)## created an instance of a ResNet model based on the specified architecture name model_arch_name and the number of classes model_num_classes.
     resnet_model = resnet_model.to(device=device, memory_format=torch.channels_last)
 
     return resnet_model
@@ -82,17 +88,36 @@ def main():
 
     device = choice_device(args.device_type)## select model processing equipment type for the one given as argument
 
-    # Initialize the model
-    resnet_model = build_model(args.model_arch_name, args.model_num_classes, device)## build the ResNet model by calling the function defined earlier
-    print(f"Build `{args.model_arch_name}` model successfully.")
-
-    # Load model weights
-    resnet_model, _, _, _, _, _ = load_state_dict(resnet_model, args.model_weights_path)## load the state dictionary from "./results/pretrained_models/ResNet18-ImageNet_1K-57bb63e.pth.tar"
-    print(f"Load `{args.model_arch_name}` model weights `{os.path.abspath(args.model_weights_path)}` successfully.")## prints message to tell that the loading was successfuly completed
+    if args.torchscript:
+        # The exported model carries its own architecture and preprocessing parameters
+        resnet_model, meta = load_torchscript(args.model_weights_path, device)
+        args.image_size = meta["image_size"]
+        args.model_mean_parameters = meta["model_mean_parameters"]
+        args.model_std_parameters = meta["model_std_parameters"]
+        print(f"Load `{meta['model_arch_name']}` TorchScript model `{os.path.abspath(args.model_weights_path)}` successfully.")
+    elif args.quantized:
+        from quantize import load_quantized_model
+
+        # int8 models written by `quantize.py` only run on the CPU
+        device = torch.device("cpu")
+        resnet_model = load_quantized_model(args.model_arch_name, args.model_num_classes, args.model_weights_path)
+        print(f"Load `{args.model_arch_name}` int8 model weights `{os.path.abspath(args.model_weights_path)}` successfully.")
+    else:
+        # Build the model with its weights
+        resnet_model = build_model(args.model_arch_name,
+                                   args.model_num_classes,
+                                   device,
+                                   args.model_weights_path)## build the ResNet model by calling the function defined earlier
+        print(f"Load `{args.model_arch_name}` model weights `{os.path.abspath(args.model_weights_path)}` successfully.")## prints message to tell that the loading was successfuly completed
 
     # Start the verification mode of the model.
     resnet_model.eval()## sets ResNet the module in evaluation mode
 
+    # Fold the BatchNorms into the convolutions, quantized and exported models are fused already
+    if args.fuse_for_inference and not args.quantized and not args.torchscript:
+        resnet_model.fuse_for_inference()
+        print(f"Fuse `{args.model_arch_name}` model for inference successfully.")
+
     tensor = preprocess_image(args.image_path, args.image_size, device)## preprocesses the image from the argument list
 
     # Inference
@@ -120,6 +145,9 @@ if __name__ == "__main__":
     parser.add_argument("--image_path", type=str, default="./figure/n01440764_36.JPEG")## defines the path to the image
     parser.add_argument("--image_size", type=int, default=224)## defines the image size
     parser.add_argument("--device_type", type=str, default="cpu", choices=["cpu", "cuda"])## defines the type of the devide the model is running on
+    parser.add_argument("--fuse_for_inference", action="store_true", help="Fold the BatchNorms into the convolutions.")
+    parser.add_argument("--quantized", action="store_true", help="Load an int8 checkpoint written by `quantize.py`.")
+    parser.add_argument("--torchscript", action="store_true", help="Load a TorchScript model written by `export.py`.")
     args = parser.parse_args()
 
     main()
@@ -11,11 +11,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
-from typing import Any, List, Type, Union, Optional## import some data types
+import contextlib
+import functools
+from typing import Any, Callable, List, Type, Union, Optional## import some data types
 
 import torch## import torch
+import torch.utils.checkpoint
 from torch import Tensor## import tensor class
 from torch import nn## import neural network module 
+from torch.ao import quantization
+from torch.ao.nn.quantized import FloatFunctional
+from torch.nn.utils import fusion
 
 __all__ = [## define the classes which are going to be shown when importing * from the current module
     "ResNet",## ResNet class
@@ -23,6 +29,83 @@ __all__ = [## define the classes which are going to be shown when importing * fr
 ]
 
 
+@contextlib.contextmanager
+def _restore_buffers(module: nn.Module):
+    # The recomputation of a checkpointed segment runs it in training mode a second time. Put the BatchNorm running
+    # statistics (and the observer ranges of quantization aware training) back to what the forward pass left
+    buffers = [buffer for buffer in module.buffers()]
+    saved_buffers = [buffer.detach().clone() for buffer in buffers]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for buffer, saved_buffer in zip(buffers, saved_buffers):
+                if buffer.shape == saved_buffer.shape:
+                    buffer.copy_(saved_buffer)
+
+
+def _recompute_context(module: nn.Module) -> tuple:
+    # Contexts of the forward pass and of the recomputation of a checkpointed segment
+    return contextlib.nullcontext(), _restore_buffers(module)
+
+
+def _fuse_conv_bn(module: nn.Module, conv_name: str, bn_name: str) -> None:
+    # Fold the BatchNorm statistics and affine parameters into the convolution weight and bias
+    setattr(module, conv_name, fusion.fuse_conv_bn_eval(getattr(module, conv_name), getattr(module, bn_name)))
+    setattr(module, bn_name, nn.Identity())
+
+
+def _fuse_downsample(downsample: Optional[nn.Module]) -> None:
+    if downsample is not None:
+        _fuse_conv_bn(downsample, "0", "1")
+
+
+def _prune_conv_bn(
+        module: nn.Module,
+        conv_name: str,
+        bn_name: str,
+        next_conv_name: str,
+        keep_indices: Tensor,
+) -> None:
+    # Keep the selected output channels of the convolution and its BatchNorm, and the matching input channels of the
+    # convolution that consumes them
+    conv = getattr(module, conv_name)
+    bn = getattr(module, bn_name)
+    next_conv = getattr(module, next_conv_name)
+    if not isinstance(bn, nn.BatchNorm2d):
+        raise RuntimeError("Channel pruning needs the BatchNorms, prune the model before fusing it.")
+
+    pruned_conv = nn.Conv2d(conv.in_channels, len(keep_indices), conv.kernel_size, conv.stride, conv.padding, bias=False)
+    pruned_conv.weight = nn.Parameter(conv.weight.detach()[keep_indices].clone())
+
+    pruned_bn = nn.BatchNorm2d(len(keep_indices), bn.eps, bn.momentum)
+    pruned_bn.weight = nn.Parameter(bn.weight.detach()[keep_indices].clone())
+    pruned_bn.bias = nn.Parameter(bn.bias.detach()[keep_indices].clone())
+    pruned_bn.running_mean = bn.running_mean[keep_indices].clone()
+    pruned_bn.running_var = bn.running_var[keep_indices].clone()
+    pruned_bn.num_batches_tracked = bn.num_batches_tracked.clone()
+
+    pruned_next_conv = nn.Conv2d(len(keep_indices),
+                                 next_conv.out_channels,
+                                 next_conv.kernel_size,
+                                 next_conv.stride,
+                                 next_conv.padding,
+                                 bias=False)
+    pruned_next_conv.weight = nn.Parameter(next_conv.weight.detach()[:, keep_indices].clone())
+
+    setattr(module, conv_name, pruned_conv.train(conv.training))
+    setattr(module, bn_name, pruned_bn.train(bn.training))
+    setattr(module, next_conv_name, pruned_next_conv.train(next_conv.training))
+
+
+def _fuse_modules(module: nn.Module, modules_to_fuse: list, is_qat: bool) -> None:
+    # Training-aware fusion keeps the BatchNorms trainable inside the fused modules
+    if is_qat:
+        quantization.fuse_modules_qat(module, modules_to_fuse, inplace=True)
+    else:
+        quantization.fuse_modules(module, modules_to_fuse, inplace=True)
+
+
 class _BasicBlock(nn.Module):## define the _BasicClock class whichi inherits from nn.Module (the underscore might mean that the class is not intented to be accessed outside this file)
     expansion: int = 1## defines the expansion attribute of the calss
 
@@ -34,18 +117,24 @@ class _BasicBlock(nn.Module):## define the _BasicClock class whichi inherits fro
             downsample: Optional[nn.Module] = None,## downsample optional attribute
             groups: int = 1,## groups optional attribute
             base_channels: int = 64,## base channel optional attribute
+            channels: Optional[List[int]] = None,
     ) -> None:
         super(_BasicBlock, self).__init__()## calles the init of the parent class
         self.stride = stride## set object's stride attribute
         self.downsample = downsample## set object's downsample attribute
         self.groups = groups## set object's groups atribute
         self.base_channels = base_channels## set object's base_channels attribute
+        # Output channels of `conv1`, fewer than `out_channels` in a pruned model. `conv2` feeds the residual add and
+        # keeps all of them
+        self.channels = list(channels) if channels is not None else [out_channels]
 
-        self.conv1 = nn.Conv2d(in_channels, out_channels, (3, 3), (stride, stride), (1, 1), bias=False)## applies a 2D convolution over an input signal composed of several input planes
-        self.bn1 = nn.BatchNorm2d(out_channels)## applies Batch Normalization over a 4D input
+        self.conv1 = nn.Conv2d(in_channels, self.channels[0], (3, 3), (stride, stride), (1, 1), bias=False)## applies a 2D convolution over an input signal composed of several input planes
+        self.bn1 = nn.BatchNorm2d(self.channels[0])## applies Batch Normalization over a 4D input
         self.relu = nn.ReLU(True)## applies relu on the input
-        self.conv2 = nn.Conv2d(out_channels, out_channels, (3, 3), (1, 1), (1, 1), bias=False)## apply the 2D convolution again
+        self.conv2 = nn.Conv2d(self.channels[0], out_channels, (3, 3), (1, 1), (1, 1), bias=False)## apply the 2D convolution again
         self.bn2 = nn.BatchNorm2d(out_channels)## and the normalization again
+        # Residual add followed by ReLU, becomes a single quantized op after quantization
+        self.skip_add_relu = FloatFunctional()
 
     def forward(self, x: Tensor) -> Tensor:
         identity = x
@@ -60,11 +149,24 @@ class _BasicBlock(nn.Module):## define the _BasicClock class whichi inherits fro
         if self.downsample is not None:## if downsample is present
             identity = self.downsample(x)## apply it on the input
 
-        out = torch.add(out, identity)## add the identity to the torch
-        out = self.relu(out)## apply relu again on the data being processed
+        out = self.skip_add_relu.add_relu(out, identity)## add the identity and apply relu again on the data being processed
 
         return out
 
+    def fuse_for_inference(self) -> None:
+        _fuse_conv_bn(self, "conv1", "bn1")
+        _fuse_conv_bn(self, "conv2", "bn2")
+        _fuse_downsample(self.downsample)
+
+    def prune_channels(self, select_fn: Callable[[nn.Conv2d, nn.BatchNorm2d], Tensor]) -> None:
+        _prune_conv_bn(self, "conv1", "bn1", "conv2", select_fn(self.conv1, self.bn1))
+        self.channels = [self.conv1.out_channels]
+
+    def fuse_model(self, is_qat: bool = False) -> None:
+        _fuse_modules(self, [["conv1", "bn1", "relu"], ["conv2", "bn2"]], is_qat)
+        if self.downsample is not None:
+            _fuse_modules(self.downsample, [["0", "1"]], is_qat)
+
 
 class _Bottleneck(nn.Module):## defines a fileprivat class whichi inherits from nn.Module
     expansion: int = 4## defines the expansion attribute of the calss
@@ -78,6 +180,7 @@ class _Bottleneck(nn.Module):## defines a fileprivat class whichi inherits from
             downsample: Optional[nn.Module] = None,## optional downstride
             groups: int = 1,## optional groups
             base_channels: int = 64,## optional base_channels
+            channels: Optional[List[int]] = None,
     ) -> None:
         super(_Bottleneck, self).__init__()## call the init of the parent class
         self.stride = stride## set the stride attribute with the one provided to the init function
@@ -85,15 +188,21 @@ class _Bottleneck(nn.Module):## defines a fileprivat class whichi inherits from
         self.groups = groups## set the groups attribute with the one provided to the init function
         self.base_channels = base_channels## set the base_channels attribute with the one provided to the init function
 
-        channels = int(out_channels * (base_channels / 64.0)) * groups## calculate the channels based on some formula
+        width = int(out_channels * (base_channels / 64.0)) * groups## calculate the channels based on some formula
+        # Output channels of `conv1` and `conv2`, fewer than `width` in a pruned model
+        self.channels = list(channels) if channels is not None else [width, width]
 
-        self.conv1 = nn.Conv2d(in_channels, channels, (1, 1), (1, 1), (0, 0), bias=False)## applies a 2D convolution on the input channels
-        self.bn1 = nn.BatchNorm2d(channels)## applies Batch Normalization over a 4D on the channels
-        self.conv2 = nn.Conv2d(channels, channels, (3, 3), (stride, stride), (1, 1), groups=groups, bias=False)## applies a 2D convolution on the channels
-        self.bn2 = nn.BatchNorm2d(channels)
-        self.conv3 = nn.Conv2d(channels, int(out_channels * self.expansion), (1, 1), (1, 1), (0, 0), bias=False)## applies a 2D convolution on the channels
+        self.conv1 = nn.Conv2d(in_channels, self.channels[0], (1, 1), (1, 1), (0, 0), bias=False)## applies a 2D convolution on the input channels
+        self.bn1 = nn.BatchNorm2d(self.channels[0])## applies Batch Normalization over a 4D on the channels
+        self.conv2 = nn.Conv2d(self.channels[0], self.channels[1], (3, 3), (stride, stride), (1, 1), groups=groups, bias=False)## applies a 2D convolution on the channels
+        self.bn2 = nn.BatchNorm2d(self.channels[1])
+        self.conv3 = nn.Conv2d(self.channels[1], int(out_channels * self.expansion), (1, 1), (1, 1), (0, 0), bias=False)## applies a 2D convolution on the channels
         self.bn3 = nn.BatchNorm2d(int(out_channels * self.expansion))## applies Batch Normalization over a 4D on the output channels
         self.relu = nn.ReLU(True)## creates an instance of relu with the inplace argument set to true (meaning that the result is set on the input, not on a new variable)
+        # Every conv-bn-relu needs its own ReLU module to be fused
+        self.relu2 = nn.ReLU(True)
+        # Residual add followed by ReLU, becomes a single quantized op after quantization
+        self.skip_add_relu = FloatFunctional()
 
     def forward(self, x: Tensor) -> Tensor:## the function that does the forward pass, feeding the input into the model
         identity = x## identity tensor, rememebering it
@@ -104,7 +213,7 @@ class _Bottleneck(nn.Module):## defines a fileprivat class whichi inherits from
 
         out = self.conv2(out)## convolution again
         out = self.bn2(out)## normalization again
-        out = self.relu(out)## relu again
+        out = self.relu2(out)## relu again
 
         out = self.conv3(out)## 3D convolution
         out = self.bn3(out)## normalization again
@@ -112,11 +221,54 @@ class _Bottleneck(nn.Module):## defines a fileprivat class whichi inherits from
         if self.downsample is not None:## is downsample is present
             identity = self.downsample(x)## apply it on the input
 
-        out = torch.add(out, identity)## add the identity to the torch
-        out = self.relu(out)## apply relu once again
+        out = self.skip_add_relu.add_relu(out, identity)## add the identity and apply relu once again
 
         return out
 
+    def fuse_for_inference(self) -> None:
+        _fuse_conv_bn(self, "conv1", "bn1")
+        _fuse_conv_bn(self, "conv2", "bn2")
+        _fuse_conv_bn(self, "conv3", "bn3")
+        _fuse_downsample(self.downsample)
+
+    def prune_channels(self, select_fn: Callable[[nn.Conv2d, nn.BatchNorm2d], Tensor]) -> None:
+        if self.groups != 1:
+            raise RuntimeError("Channel pruning does not support grouped convolutions.")
+
+        _prune_conv_bn(self, "conv1", "bn1", "conv2", select_fn(self.conv1, self.bn1))
+        _prune_conv_bn(self, "conv2", "bn2", "conv3", select_fn(self.conv2, self.bn2))
+        self.channels = [self.conv1.out_channels, self.conv2.out_channels]
+
+    def fuse_model(self, is_qat: bool = False) -> None:
+        _fuse_modules(self, [["conv1", "bn1", "relu"], ["conv2", "bn2", "relu2"], ["conv3", "bn3"]], is_qat)
+        if self.downsample is not None:
+            _fuse_modules(self.downsample, [["0", "1"]], is_qat)
+
+
+class _ExitHead(nn.Module):
+    """Lightweight classifier on the features of an intermediate stage, for early-exit inference"""
+
+    def __init__(self, in_channels: int, num_classes: int) -> None:
+        super(_ExitHead, self).__init__()
+        self.conv = nn.Conv2d(in_channels, in_channels, (1, 1), (1, 1), (0, 0), bias=False)
+        self.bn = nn.BatchNorm2d(in_channels)
+        self.relu = nn.ReLU(True)
+        self.avgpool = nn.AdaptiveAvgPool2d((1, 1))
+        self.fc = nn.Linear(in_channels, num_classes)
+
+    def forward(self, x: Tensor) -> Tensor:
+        out = self.conv(x)
+        out = self.bn(out)
+        out = self.relu(out)
+        out = self.avgpool(out)
+        out = torch.flatten(out, 1)
+        out = self.fc(out)
+
+        return out
+
+    def fuse_for_inference(self) -> None:
+        _fuse_conv_bn(self, "conv", "bn")
+
 
 class ResNet(nn.Module):## defines the ResNet class whichi inherits from nn.Module
 
@@ -127,8 +279,16 @@ class ResNet(nn.Module):## defines the ResNet class whichi inherits from nn.Modu
             groups: int = 1,## groups optional attribute
             channels_per_group: int = 64,## channels_per_group optional attribute
             num_classes: int = 1000,## num_classes optional attribute
+            block_channels: Optional[List[List[int]]] = None,
+            checkpoint_policy: str = "",
+            early_exits: bool = False,
     ) -> None:
         super(ResNet, self).__init__()## call the init of the super class
+        # Activation checkpointing of `layer1`-`layer4` in training, `stage` or `block` granularity, empty to keep every
+        # activation. Checkpointed segments only keep their input and are recomputed during the backward pass
+        if checkpoint_policy not in ("", "stage", "block"):
+            raise ValueError(f"Unsupported checkpoint policy `{checkpoint_policy}`.")
+        self.checkpoint_policy = checkpoint_policy
         self.in_channels = 64## set the input channels of the object to 64
         self.dilation = 1## set the dilatation to 1
         self.groups = groups## set the groups to the provided parameter
@@ -139,15 +299,35 @@ class ResNet(nn.Module):## defines the ResNet class whichi inherits from nn.Modu
         self.relu = nn.ReLU(True)## creates an instance of relu with the inplace argument set to true (meaning that the result is set on the input, not on a new variable)
         self.maxpool = nn.MaxPool2d((3, 3), (2, 2), (1, 1))## creates an instance of a 2D max pooling with the given parameters
 
-        self.layer1 = self._make_layer(arch_cfg[0], block, 64, 1)## undefined
-        self.layer2 = self._make_layer(arch_cfg[1], block, 128, 2)## undefined
-        self.layer3 = self._make_layer(arch_cfg[2], block, 256, 2)## undefined
-        self.layer4 = self._make_layer(arch_cfg[3], block, 512, 2)## undefined
+        # The inner channels of every block of a pruned model, see `block_channels()`
+        if block_channels is None:
+            block_channels = [None] * sum(arch_cfg)
+        if len(block_channels) != sum(arch_cfg):
+            raise ValueError(f"`block_channels` describes {len(block_channels)} blocks, the model has {sum(arch_cfg)}.")
+        layer_block_channels = [block_channels[sum(arch_cfg[:i]):sum(arch_cfg[:i + 1])] for i in range(4)]
+
+        self.layer1 = self._make_layer(arch_cfg[0], block, 64, 1, layer_block_channels[0])## undefined
+        self.layer2 = self._make_layer(arch_cfg[1], block, 128, 2, layer_block_channels[1])## undefined
+        self.layer3 = self._make_layer(arch_cfg[2], block, 256, 2, layer_block_channels[2])## undefined
+        self.layer4 = self._make_layer(arch_cfg[3], block, 512, 2, layer_block_channels[3])## undefined
 
         self.avgpool = nn.AdaptiveAvgPool2d((1, 1))## undefined
 
         self.fc = nn.Linear(512 * block.expansion, num_classes)## undefined
 
+        # Optional classifiers after `layer2` and `layer3`, see `forward_exits` and `forward_early_exit`
+        if early_exits:
+            self.exit_heads = nn.ModuleList([_ExitHead(128 * block.expansion, num_classes),
+                                             _ExitHead(256 * block.expansion, num_classes)])
+        else:
+            self.exit_heads = None
+        # Set by `freeze_trunk`, only the exit heads are trained then
+        self.frozen_trunk = False
+
+        # Mark where the tensors switch between float and int8 in a quantized model, identities otherwise
+        self.quant = quantization.QuantStub()
+        self.dequant = quantization.DeQuantStub()
+
         # Initialize neural network weights
         self._initialize_weights()## undefined
 
@@ -157,6 +337,7 @@ class ResNet(nn.Module):## defines the ResNet class whichi inherits from nn.Modu
             block: Type[Union[_BasicBlock, _Bottleneck]],
             channels: int,
             stride: int = 1,
+            block_channels: Optional[list] = None,
     ) -> nn.Sequential:
         downsample = None
 
@@ -173,11 +354,12 @@ class ResNet(nn.Module):## defines the ResNet class whichi inherits from nn.Modu
                 stride,## undefined
                 downsample,## undefined
                 self.groups,## undefined
-                self.base_channels## undefined
+                self.base_channels,## undefined
+                block_channels[0] if block_channels else None,
             )
         ]
         self.in_channels = channels * block.expansion## undefined
-        for _ in range(1, repeat_times):## undefined
+        for i in range(1, repeat_times):## undefined
             layers.append(## undefined
                 block(
                     self.in_channels,## undefined
@@ -186,6 +368,7 @@ class ResNet(nn.Module):## defines the ResNet class whichi inherits from nn.Modu
                     None,
                     self.groups,
                     self.base_channels,
+                    block_channels[i] if block_channels else None,
                 )
             )
 
@@ -198,23 +381,195 @@ class ResNet(nn.Module):## defines the ResNet class whichi inherits from nn.Modu
 
     # Support torch.script function
     def _forward_impl(self, x: Tensor) -> Tensor:## undefined
+        out = self.quant(x)
+        out = self._forward_stem(out)
+        out = self._forward_layers(out, 0, 4)
+        out = self._forward_classifier(out)
+        out = self.dequant(out)
+
+        return out
+
+    def _forward_stem(self, x: Tensor) -> Tensor:
         out = self.conv1(x)## undefined
         out = self.bn1(out)## undefined
         out = self.relu(out)## undefined
         out = self.maxpool(out)## undefined
 
-        out = self.layer1(out)## undefined
-        out = self.layer2(out)## undefined
-        out = self.layer3(out)## undefined
-        out = self.layer4(out)## undefined
+        return out
+
+    def _forward_layers(self, x: Tensor, start: int, end: int) -> Tensor:
+        # Runs the residual stages `layer{start + 1}` to `layer{end}`, with activation checkpointing while training
+        if not torch.jit.is_scripting() and self.checkpoint_policy != "" and self.training and torch.is_grad_enabled():
+            return self._checkpointed_layers(x, start, end)
+
+        if start <= 0 < end:
+            x = self.layer1(x)## undefined
+        if start <= 1 < end:
+            x = self.layer2(x)## undefined
+        if start <= 2 < end:
+            x = self.layer3(x)## undefined
+        if start <= 3 < end:
+            x = self.layer4(x)## undefined
 
-        out = self.avgpool(out)## undefined
+        return x
+
+    def _forward_classifier(self, x: Tensor) -> Tensor:
+        out = self.avgpool(x)## undefined
         out = torch.flatten(out, 1)## undefined
         out = self.fc(out)## undefined
 
         return out
 
+    def forward_exits(self, x: Tensor) -> List[Tensor]:
+        """The logits of the exits after `layer2` and `layer3` and of the final classifier, for training the heads"""
+        if self.exit_heads is None:
+            raise RuntimeError("The model was built without early exits, pass `early_exits=True`.")
+
+        out = self.quant(x)
+        out = self._forward_stem(out)
+        out = self._forward_layers(out, 0, 2)
+        exit2_output = self.exit_heads[0](out)
+        out = self._forward_layers(out, 2, 3)
+        exit3_output = self.exit_heads[1](out)
+        out = self._forward_layers(out, 3, 4)
+
+        return [self.dequant(exit2_output), self.dequant(exit3_output), self.dequant(self._forward_classifier(out))]
+
+    def forward_early_exit(self, x: Tensor, threshold: float) -> [Tensor, Tensor]:
+        """Classify every image at the first exit whose softmax confidence reaches ``threshold``
+
+        The images that exit are taken out of the batch, only the remaining ones run through the next stage, so one
+        batch can leave at different exits. Call it in evaluation mode under ``torch.no_grad()``.
+
+        Args:
+            x (Tensor): Batch of images.
+            threshold (float): Top-1 softmax probability that ends the inference of an image, 1 disables early exits.
+
+        Returns:
+            output (Tensor): The logits of every image, from the exit it left at
+            exit_indices (Tensor): The exit of every image, 0 after `layer2`, 1 after `layer3`, 2 the final classifier
+        """
+        if self.exit_heads is None:
+            raise RuntimeError("The model was built without early exits, pass `early_exits=True`.")
+
+        output = torch.empty([x.size(0), self.fc.out_features], device=x.device)
+        exit_indices = torch.full([x.size(0)], len(self.exit_heads), dtype=torch.int64, device=x.device)
+        # Positions in the batch of the images that are still running
+        remaining_indices = torch.arange(x.size(0), device=x.device)
+
+        out = self._forward_stem(x)
+        out = self._forward_layers(out, 0, 2)
+        for exit_index, next_layer in enumerate([self.layer3, self.layer4]):
+            exit_output = self.exit_heads[exit_index](out)
+            is_exit = torch.softmax(exit_output.float(), dim=1).amax(dim=1) >= threshold
+            output[remaining_indices[is_exit]] = exit_output[is_exit].float()
+            exit_indices[remaining_indices[is_exit]] = exit_index
+
+            remaining_indices = remaining_indices[~is_exit]
+            if remaining_indices.numel() == 0:
+                return output, exit_indices
+            out = next_layer(out[~is_exit])
+
+        output[remaining_indices] = self._forward_classifier(out).float()
+
+        return output, exit_indices
+
+    def freeze_trunk(self) -> "ResNet":
+        """Only train the exit heads, the rest of the model keeps its weights and BatchNorm statistics"""
+        if self.exit_heads is None:
+            raise RuntimeError("The model was built without early exits, pass `early_exits=True`.")
+
+        for name, parameter in self.named_parameters():
+            if not name.startswith("exit_heads."):
+                parameter.requires_grad_(False)
+        self.frozen_trunk = True
+        self.train(self.training)
+
+        return self
+
+    def train(self, mode: bool = True) -> "ResNet":
+        super(ResNet, self).train(mode)
+        # A frozen trunk stays in evaluation mode, so its BatchNorms keep their statistics
+        if self.frozen_trunk:
+            for name, module in self.named_children():
+                if name != "exit_heads":
+                    module.eval()
+
+        return self
+
+    @torch.jit.unused
+    def _checkpointed_layers(self, x: Tensor, start: int, end: int) -> Tensor:
+        # The running statistics are only updated by the forward pass, not by the recomputation
+        for layer in [self.layer1, self.layer2, self.layer3, self.layer4][start:end]:
+            segments = [layer] if self.checkpoint_policy == "stage" else list(layer)
+            for segment in segments:
+                x = torch.utils.checkpoint.checkpoint(segment,
+                                                      x,
+                                                      use_reentrant=False,
+                                                      context_fn=functools.partial(_recompute_context, segment))
+
+        return x
+
+    def fuse_for_inference(self) -> "ResNet":
+        """Fold every BatchNorm into the preceding convolution, including the downsample branches
+
+        The BatchNorms are replaced by ``nn.Identity``, so every conv+BN pair runs as a single convolution with
+        bias. The ReLUs already run in place and are left as they are, backends such as TorchScript freezing
+        or oneDNN fuse them into the convolutions. The model can only be used for inference afterwards.
+
+        Returns:
+            model (ResNet): The model itself, fused in place
+        """
+        if self.training:
+            raise RuntimeError("BatchNorm folding uses the running statistics, call `eval()` before fusing the model.")
+
+        _fuse_conv_bn(self, "conv1", "bn1")
+        for module in list(self.modules()):
+            if isinstance(module, (_BasicBlock, _Bottleneck, _ExitHead)):
+                module.fuse_for_inference()
+
+        return self
+
+    def prune_channels(self, select_fn: Callable[[nn.Conv2d, nn.BatchNorm2d], Tensor]) -> "ResNet":
+        """Remove output channels of the inner convolutions of every block
+
+        Only the convolutions whose outputs stay inside a block are pruned, `conv1` of the basic blocks and `conv1`
+        and `conv2` of the bottlenecks, so the residual connections keep their width. The BatchNorm of a pruned
+        convolution and the input channels of the next convolution are cut down to match.
+
+        Args:
+            select_fn (Callable): Gets a convolution and its BatchNorm and returns the sorted indices of the output
+                channels to keep
+
+        Returns:
+            model (ResNet): The model itself, pruned in place. Rebuild it with ``block_channels=model.block_channels()``
+        """
+        for module in list(self.modules()):
+            if isinstance(module, (_BasicBlock, _Bottleneck)):
+                module.prune_channels(select_fn)
+
+        return self
+
+    def block_channels(self) -> List[List[int]]:
+        """The inner channels of every block, the ``block_channels`` argument that rebuilds a pruned model"""
+        return [list(module.channels) for module in self.modules() if isinstance(module, (_BasicBlock, _Bottleneck))]
+
+    def fuse_model(self, is_qat: bool = False) -> None:
+        """Fuse the conv-bn(-relu) sequences into single modules before quantization
+
+        Args:
+            is_qat (bool): Fuse for quantization aware training, which keeps the BatchNorms trainable
+        """
+        _fuse_modules(self, [["conv1", "bn1", "relu"]], is_qat)
+        for module in list(self.modules()):
+            if isinstance(module, (_BasicBlock, _Bottleneck)):
+                module.fuse_model(is_qat)
+
     def _initialize_weights(self) -> None:## undefined
+        # A model built on the meta device gets its weights from a checkpoint, see `utils.build_model_from_checkpoint`
+        if self.fc.weight.is_meta:
+            return
+
         for module in self.modules():## undefined
             if isinstance(module, nn.Conv2d):## undefined
                 nn.init.kaiming_normal_(module.weight, mode="fan_out", nonlinearity="relu")## undefined
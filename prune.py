@@ -0,0 +1,236 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import copy
+import os
+from typing import Callable
+
+import torch
+from torch import Tensor
+from torch import nn
+from torch.cuda import amp
+from torch.optim import lr_scheduler
+
+import config
+import imgproc
+import model
+import train
+from dataset import CUDAPrefetcher
+from utils import build_model_from_checkpoint, make_divisible, measure_latency
+
+__all__ = [
+    "channel_importance", "select_channels", "recalibrate_batch_norm", "count_flops", "count_parameters", "finetune",
+]
+
+
+def channel_importance(conv: nn.Conv2d, bn: nn.BatchNorm2d, criterion: str) -> Tensor:
+    """Score every output channel of a convolution, the lowest scoring ones are pruned
+
+    Args:
+        conv (nn.Conv2d): Convolution whose output channels are scored.
+        bn (nn.BatchNorm2d): The BatchNorm that follows the convolution.
+        criterion (str): `bn_gamma` uses the magnitude of the BatchNorm scale, `l1` the L1 norm of the filters.
+
+    Returns:
+        importance (Tensor): One score per output channel
+    """
+    if criterion == "bn_gamma":
+        return bn.weight.detach().abs()
+    elif criterion == "l1":
+        return conv.weight.detach().abs().sum(dim=(1, 2, 3))
+    else:
+        raise ValueError(f"Unsupported pruning criterion `{criterion}`.")
+
+
+def select_channels(criterion: str, ratio: float, channel_divisor: int) -> Callable[[nn.Conv2d, nn.BatchNorm2d], Tensor]:
+    """The ``select_fn`` of ``ResNet.prune_channels`` that keeps the most important ``1 - ratio`` of the channels"""
+
+    def select_fn(conv: nn.Conv2d, bn: nn.BatchNorm2d) -> Tensor:
+        importance = channel_importance(conv, bn, criterion)
+        # Channel counts that are a multiple of `channel_divisor` keep the convolution kernels efficient
+        num_channels = min(make_divisible(importance.numel() * (1 - ratio), channel_divisor), importance.numel())
+
+        return importance.topk(num_channels).indices.sort().values
+
+    return select_fn
+
+
+def recalibrate_batch_norm(resnet_model: nn.Module, data_prefetcher: CUDAPrefetcher, num_batches: int) -> None:
+    """Re-estimate the BatchNorm statistics, the pruned convolutions change the distributions that follow them"""
+    momenta = {}
+    for module in resnet_model.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.reset_running_stats()
+            # A cumulative average weighs every calibration batch the same
+            momenta[module] = module.momentum
+            module.momentum = None
+
+    resnet_model.train()
+    data_prefetcher.reset()
+    batch_data = data_prefetcher.next()
+    batch_index = 0
+    with torch.no_grad():
+        while batch_data is not None and batch_index < num_batches:
+            images = batch_data["image"].to(device=config.device, memory_format=torch.channels_last, non_blocking=True)
+            if images.dtype == torch.uint8:
+                images = imgproc.normalize_image_batch(images, config.model_mean_parameters, config.model_std_parameters)
+            resnet_model(images)
+
+            batch_data = data_prefetcher.next()
+            batch_index += 1
+
+    for module, momentum in momenta.items():
+        module.momentum = momentum
+    resnet_model.eval()
+
+
+def count_flops(resnet_model: nn.Module, image_size: int) -> int:
+    """Multiply-accumulates of the convolutions and the classifier for one image"""
+    flops = []
+
+    def conv_hook(module: nn.Conv2d, _, output: Tensor) -> None:
+        kernel_flops = module.in_channels // module.groups * module.kernel_size[0] * module.kernel_size[1]
+        flops.append(output[0].numel() * kernel_flops)
+
+    def linear_hook(module: nn.Linear, _, output: Tensor) -> None:
+        flops.append(output[0].numel() * module.in_features)
+
+    hooks = []
+    for module in resnet_model.modules():
+        if isinstance(module, nn.Conv2d):
+            hooks.append(module.register_forward_hook(conv_hook))
+        elif isinstance(module, nn.Linear):
+            hooks.append(module.register_forward_hook(linear_hook))
+
+    device = next(resnet_model.parameters()).device
+    with torch.no_grad():
+        resnet_model(torch.zeros([1, 3, image_size, image_size], device=device))
+    for hook in hooks:
+        hook.remove()
+
+    return sum(flops)
+
+
+def count_parameters(resnet_model: nn.Module) -> int:
+    return sum(parameter.numel() for parameter in resnet_model.parameters())
+
+
+def finetune(
+        resnet_model: nn.Module,
+        train_prefetcher: CUDAPrefetcher,
+        valid_prefetcher: CUDAPrefetcher,
+        train_sampler,
+        epochs: int,
+        lr: float,
+) -> [nn.Module, float]:
+    """Recover the accuracy of a pruned model with a short run of ``train.train`` and return the EMA model"""
+    ema_resnet_model = train.define_ema_model(resnet_model)
+    criterion = train.define_loss()
+    optimizer = train.define_optimizer(resnet_model)
+    for param_group in optimizer.param_groups:
+        param_group["lr"] = lr
+    scheduler = lr_scheduler.CosineAnnealingLR(optimizer, epochs, config.lr_scheduler_eta_min)
+    scaler = amp.GradScaler(enabled=config.device.type == "cuda")
+
+    acc1 = 0.0
+    for epoch in range(epochs):
+        train.train(resnet_model,
+                    ema_resnet_model,
+                    train_prefetcher,
+                    criterion,
+                    optimizer,
+                    epoch,
+                    scaler,
+                    None,
+                    train_sampler)
+        acc1 = train.validate(ema_resnet_model, valid_prefetcher, epoch, None, "Valid")
+        scheduler.step()
+
+    return ema_resnet_model.module, acc1
+
+
+def main(args) -> None:
+    # The data, the device and the fine-tune optimizer come from the `train` section of `config.py`
+    train_prefetcher, valid_prefetcher, train_sampler = train.load_dataset(config.image_size, config.batch_size)
+    print(f"Load `{config.model_arch_name}` datasets successfully.")
+
+    resnet_model = build_model_from_checkpoint(model.__dict__[config.model_arch_name], args.model_weights_path,
+                                               num_classes=config.model_num_classes)
+    resnet_model = resnet_model.to(device=config.device, memory_format=torch.channels_last).eval()
+    print(f"Load `{config.model_arch_name}` model weights `{os.path.abspath(args.model_weights_path)}` successfully.")
+
+    def report(pruned_model: nn.Module, ratio: float, acc1: float, finetune_acc1: float = None) -> dict:
+        cpu_model = copy.deepcopy(pruned_model).cpu().eval()
+        return {"ratio": ratio,
+                "flops": count_flops(cpu_model, config.image_size),
+                "params": count_parameters(cpu_model),
+                "latency": measure_latency(cpu_model, 1, config.image_size, args.num_iters),
+                "acc1": acc1,
+                "finetune_acc1": finetune_acc1}
+
+    results = [report(resnet_model, 0.0, train.validate(resnet_model, valid_prefetcher, 0, None, "Valid"))]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for ratio in args.ratios:
+        pruned_model = copy.deepcopy(resnet_model)
+        pruned_model.prune_channels(select_channels(args.criterion, ratio, args.channel_divisor))
+        pruned_model = pruned_model.to(memory_format=torch.channels_last)
+        recalibrate_batch_norm(pruned_model, train_prefetcher, args.num_calibration_batches)
+        print(f"Prune {ratio * 100:.0f}% of the block channels by `{args.criterion}`.")
+        acc1 = train.validate(pruned_model, valid_prefetcher, 0, None, "Valid")
+
+        finetune_acc1 = None
+        if args.finetune_epochs > 0:
+            pruned_model, finetune_acc1 = finetune(pruned_model,
+                                                   train_prefetcher,
+                                                   valid_prefetcher,
+                                                   train_sampler,
+                                                   args.finetune_epochs,
+                                                   args.finetune_lr)
+        results.append(report(pruned_model, ratio, acc1, finetune_acc1))
+
+        # `block_channels` rebuilds the pruned architecture, see `utils.load_block_channels`
+        output_path = os.path.join(args.output_dir, f"{config.exp_name}-pruned{round(ratio * 100)}.pth.tar")
+        torch.save({"state_dict": pruned_model.state_dict(),
+                    "model_arch_name": config.model_arch_name,
+                    "block_channels": pruned_model.block_channels(),
+                    "pruning_ratio": ratio,
+                    "pruning_criterion": args.criterion,
+                    "best_acc1": acc1 if finetune_acc1 is None else finetune_acc1},
+                   output_path)
+        print(f"Save pruned model weights to `{os.path.abspath(output_path)}`.")
+
+    print(f"{'Ratio':>6} {'GFLOPs':>8} {'Params(M)':>10} {'CPU ms':>8} {'Acc@1':>8} {'Tuned@1':>8}")
+    for result in results:
+        finetune_acc1 = f"{result['finetune_acc1']:>8.2f}" if result["finetune_acc1"] is not None else f"{'-':>8}"
+        print(f"{result['ratio']:>6.2f} {result['flops'] / 1e9:>8.2f} {result['params'] / 1e6:>10.2f} "
+              f"{result['latency']:>8.2f} {result['acc1']:>8.2f} {finetune_acc1}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Structured channel pruning of the ResNet blocks, with BatchNorm "
+                                                 "recalibration and an optional fine-tune. The model, data and "
+                                                 "optimizer settings come from the `train` section of `config.py`.")
+    parser.add_argument("--model_weights_path", type=str, default="./results/pretrained_models/ResNet18-ImageNet_1K-57bb63e.pth.tar")
+    parser.add_argument("--output_dir", type=str, default="./results/pruned_models")
+    parser.add_argument("--ratios", type=float, nargs="+", default=[0.25, 0.5], help="Fractions of the block channels to remove.")
+    parser.add_argument("--criterion", type=str, default="bn_gamma", choices=["bn_gamma", "l1"])
+    parser.add_argument("--channel_divisor", type=int, default=8, help="Round the kept channels to a multiple of this.")
+    parser.add_argument("--num_calibration_batches", type=int, default=100)
+    parser.add_argument("--finetune_epochs", type=int, default=0, help="0 only recalibrates the BatchNorms.")
+    parser.add_argument("--finetune_lr", type=float, default=0.01)
+    parser.add_argument("--num_iters", type=int, default=20)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,172 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import os
+import time
+import warnings
+
+import torch
+from torch import nn
+from torch.ao import quantization
+from torch.utils.data import DataLoader
+
+import model
+from utils import accuracy, build_dataloader, build_model_from_checkpoint, load_checkpoint, measure_latency, AverageMeter
+
+__all__ = [
+    "prepare_static_quantization", "prepare_quantization_aware_training", "convert_static_quantization",
+    "load_quantized_model",
+]
+
+model_names = sorted(
+    name for name in model.__dict__ if name.islower() and not name.startswith("_") and callable(model.__dict__[name]))
+
+
+def prepare_static_quantization(resnet_model: nn.Module, backend: str = "fbgemm") -> nn.Module:
+    """Fuse the model and insert the observers that record the activation ranges during calibration"""
+    torch.backends.quantized.engine = backend
+    resnet_model.eval()
+    resnet_model.fuse_model()
+    resnet_model.qconfig = quantization.get_default_qconfig(backend)
+    quantization.prepare(resnet_model, inplace=True)
+
+    return resnet_model
+
+
+def prepare_quantization_aware_training(resnet_model: nn.Module, backend: str = "fbgemm") -> nn.Module:
+    """Fuse the model with trainable BatchNorms and insert the fake-quant modules of quantization aware training"""
+    torch.backends.quantized.engine = backend
+    resnet_model.train()
+    resnet_model.fuse_model(is_qat=True)
+    resnet_model.qconfig = quantization.get_default_qat_qconfig(backend)
+    quantization.prepare_qat(resnet_model, inplace=True)
+
+    return resnet_model
+
+
+def convert_static_quantization(resnet_model: nn.Module) -> nn.Module:
+    """Replace the observed float modules by their int8 counterparts"""
+    quantization.convert(resnet_model, inplace=True)
+
+    return resnet_model
+
+
+def load_quantized_model(model_arch_name: str, model_num_classes: int, model_weights_path: str) -> nn.Module:
+    """Rebuild the int8 model structure and load an int8 checkpoint written by ``quantize.py``"""
+    checkpoint = load_checkpoint(model_weights_path)
+
+    resnet_model = model.__dict__[model_arch_name](num_classes=model_num_classes,
+                                                   block_channels=checkpoint.get("block_channels"))
+    resnet_model = prepare_static_quantization(resnet_model, checkpoint["quantization_backend"])
+    # The observers never saw data, their placeholder ranges are overwritten by the checkpoint
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        resnet_model = convert_static_quantization(resnet_model)
+    resnet_model.load_state_dict(checkpoint["state_dict"])
+
+    return resnet_model
+
+
+def evaluate(resnet_model: nn.Module, dataloader: DataLoader, num_batches: int) -> [float, float]:
+    acc1 = AverageMeter("Acc@1", ":6.2f")
+    acc5 = AverageMeter("Acc@5", ":6.2f")
+
+    with torch.no_grad():
+        for batch_index, batch_data in enumerate(dataloader):
+            if 0 < num_batches <= batch_index:
+                break
+            images = batch_data["image"].contiguous(memory_format=torch.channels_last)
+            output = resnet_model(images)
+
+            top1, top5 = accuracy(output, batch_data["target"], topk=(1, 5))
+            acc1.update(top1[0].item(), images.size(0))
+            acc5.update(top5[0].item(), images.size(0))
+
+    return acc1.avg, acc5.avg
+
+
+def main(args) -> None:
+    torch.set_num_threads(args.num_threads)
+
+    # Build the fp32 model with its weights
+    resnet_model = build_model_from_checkpoint(model.__dict__[args.model_arch_name], args.model_weights_path,
+                                               num_classes=args.model_num_classes)
+    block_channels = resnet_model.block_channels()
+    resnet_model = resnet_model.to(memory_format=torch.channels_last).eval()
+    print(f"Load `{args.model_arch_name}` model weights `{os.path.abspath(args.model_weights_path)}` successfully.")
+
+    calibration_dataloader = build_dataloader(args.calibration_image_dir, args, True)
+    eval_dataloader = build_dataloader(args.eval_image_dir, args, False)
+
+    fp32_acc1, fp32_acc5 = evaluate(resnet_model, eval_dataloader, args.num_eval_batches)
+    fp32_latencies = [measure_latency(resnet_model, batch_size, args.image_size, args.num_iters)
+                      for batch_size in args.latency_batch_sizes]
+
+    # Record the activation ranges on a random subset of the `Valid` split
+    quantized_model = model.__dict__[args.model_arch_name](num_classes=args.model_num_classes,
+                                                           block_channels=block_channels)
+    quantized_model.load_state_dict(resnet_model.state_dict())
+    quantized_model = prepare_static_quantization(quantized_model, args.backend)
+    start_time = time.time()
+    evaluate(quantized_model, calibration_dataloader, args.num_calibration_batches)
+    print(f"Calibrate on {min(args.num_calibration_batches, len(calibration_dataloader))} batches "
+          f"in {time.time() - start_time:.1f}s.")
+    quantized_model = convert_static_quantization(quantized_model)
+
+    int8_acc1, int8_acc5 = evaluate(quantized_model, eval_dataloader, args.num_eval_batches)
+    int8_latencies = [measure_latency(quantized_model, batch_size, args.image_size, args.num_iters)
+                      for batch_size in args.latency_batch_sizes]
+
+    print(f"{'':<6} {'Acc@1':>8} {'Acc@5':>8}")
+    print(f"{'fp32':<6} {fp32_acc1:>8.2f} {fp32_acc5:>8.2f}")
+    print(f"{'int8':<6} {int8_acc1:>8.2f} {int8_acc5:>8.2f}")
+    print(f"{'delta':<6} {int8_acc1 - fp32_acc1:>+8.2f} {int8_acc5 - fp32_acc5:>+8.2f}")
+    print(f"{'Batch size':>10} {'fp32 ms':>10} {'int8 ms':>10} {'Speedup':>8}")
+    for batch_size, fp32_latency, int8_latency in zip(args.latency_batch_sizes, fp32_latencies, int8_latencies):
+        print(f"{batch_size:>10d} {fp32_latency:>10.2f} {int8_latency:>10.2f} {fp32_latency / int8_latency:>7.2f}x")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_path)), exist_ok=True)
+    torch.save({"state_dict": quantized_model.state_dict(),
+                "model_arch_name": args.model_arch_name,
+                "block_channels": block_channels,
+                "quantization_backend": args.backend,
+                "fp32_acc1": fp32_acc1,
+                "int8_acc1": int8_acc1},
+               args.output_path)
+    print(f"Save int8 model weights to `{os.path.abspath(args.output_path)}`.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post-training int8 static quantization for CPU inference.")
+    parser.add_argument("--model_arch_name", type=str, default="resnet18", choices=model_names)
+    parser.add_argument("--model_mean_parameters", type=list, default=[0.485, 0.456, 0.406])
+    parser.add_argument("--model_std_parameters", type=list, default=[0.229, 0.224, 0.225])
+    parser.add_argument("--model_num_classes", type=int, default=1000)
+    parser.add_argument("--model_weights_path", type=str, default="./results/pretrained_models/ResNet18-ImageNet_1K-57bb63e.pth.tar")
+    parser.add_argument("--output_path", type=str, default="./results/pretrained_models/ResNet18-ImageNet_1K-int8.pth.tar")
+    parser.add_argument("--calibration_image_dir", type=str, default="./data/ImageNet_1K/ILSVRC2012_img_val")
+    parser.add_argument("--eval_image_dir", type=str, default="./data/ImageNet_1K/ILSVRC2012_img_val")
+    parser.add_argument("--image_size", type=int, default=224)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--num_calibration_batches", type=int, default=200)
+    parser.add_argument("--num_eval_batches", type=int, default=0, help="0 evaluates the whole directory.")
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument("--decode_backend", type=str, default="opencv")
+    parser.add_argument("--backend", type=str, default="fbgemm", choices=["fbgemm", "x86", "qnnpack"])
+    parser.add_argument("--num_threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--latency_batch_sizes", type=int, nargs="+", default=[1, 32])
+    parser.add_argument("--num_iters", type=int, default=20)
+    args = parser.parse_args()
+
+    main(args)
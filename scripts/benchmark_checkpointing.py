@@ -0,0 +1,124 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from contextlib import nullcontext
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import model
+from utils import peak_host_memory
+
+
+def measure_training_step(args, checkpoint_policy: str, batch_size: int) -> [int, int, float]:
+    """Measure one training step of the model
+
+    Returns:
+        saved_memory (int): Bytes of the activations kept for the backward pass at the end of the forward pass
+        peak_memory (int): Peak bytes that the step adds on top of the model, allocated on the GPU or resident on the host
+        step_time (float): Seconds per step
+    """
+    torch.set_num_threads(args.num_threads)
+    device = torch.device(args.device_type, 0) if args.device_type == "cuda" else torch.device("cpu")
+
+    resnet_model = model.__dict__[args.model_arch_name](num_classes=args.model_num_classes,
+                                                        checkpoint_policy=checkpoint_policy)
+    resnet_model = resnet_model.to(device=device, memory_format=torch.channels_last).train()
+    images = torch.randn([batch_size, 3, args.image_size, args.image_size], device=device).contiguous(
+        memory_format=torch.channels_last)
+
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base_memory = torch.cuda.memory_allocated(device)
+    else:
+        base_memory = peak_host_memory()
+
+    # Every storage that autograd keeps for the backward pass, counted once. Recomputed segments only keep their input
+    saved_storages = {}
+
+    def pack_hook(tensor: torch.Tensor) -> torch.Tensor:
+        saved_storages[tensor.untyped_storage().data_ptr()] = tensor.untyped_storage().nbytes()
+        return tensor
+
+    step_times = []
+    for step in range(args.num_steps + 1):
+        start_time = time.perf_counter()
+        saved_tensors_context = torch.autograd.graph.saved_tensors_hooks(pack_hook, lambda x: x) if step == 0 \
+            else nullcontext()
+        with saved_tensors_context, torch.autocast(device.type, enabled=device.type == "cuda"):
+            output = resnet_model(images)
+        output.float().sum().backward()
+        resnet_model.zero_grad(set_to_none=True)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        # The first step includes the allocator and cudnn warm up
+        if step > 0:
+            step_times.append(time.perf_counter() - start_time)
+
+    if device.type == "cuda":
+        peak_memory = torch.cuda.max_memory_allocated(device) - base_memory
+    else:
+        peak_memory = peak_host_memory() - base_memory
+
+    return sum(saved_storages.values()), peak_memory, min(step_times)
+
+
+def main(args) -> None:
+    # Every setting runs in a fresh process, the peak resident memory of a process never goes down. The host allocator
+    # keeps freed blocks around, so on the CPU the saved activations show the effect of a policy more clearly
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for batch_size in args.batch_sizes:
+        for checkpoint_policy in args.policies:
+            checkpoint_policy = "" if checkpoint_policy == "none" else checkpoint_policy
+            with context.Pool(1) as pool:
+                saved_memory, peak_memory, step_time = pool.apply(measure_training_step,
+                                                                  (args, checkpoint_policy, batch_size))
+            results.append((checkpoint_policy or "none", batch_size, saved_memory, peak_memory, step_time))
+            print(f"`{checkpoint_policy or 'none'}` batch size {batch_size}: {saved_memory / 1024 / 1024:.0f}MB saved, "
+                  f"{peak_memory / 1024 / 1024:.0f}MB peak, {step_time * 1000:.1f}ms per step.")
+
+    print(f"{'Policy':>8} {'Batch size':>10} {'Saved MB':>10} {'Peak MB':>10} {'Step ms':>10} {'Images/s':>10} "
+          f"{'Saved':>8} {'Time':>8}")
+    baselines = {batch_size: (saved_memory, step_time)
+                 for policy, batch_size, saved_memory, _, step_time in results if policy == "none"}
+    for policy, batch_size, saved_memory, peak_memory, step_time in results:
+        base_saved_memory, base_step_time = baselines.get(batch_size, (saved_memory, step_time))
+        print(f"{policy:>8} {batch_size:>10d} {saved_memory / 1024 / 1024:>10.0f} {peak_memory / 1024 / 1024:>10.0f} "
+              f"{step_time * 1000:>10.1f} {batch_size / step_time:>10.1f} "
+              f"{saved_memory / base_saved_memory:>7.2f}x {step_time / base_step_time:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the peak training memory and step time of the activation "
+                                                 "checkpointing policies of ResNet.")
+    parser.add_argument("--model_arch_name", type=str, default="resnet101")
+    parser.add_argument("--model_num_classes", type=int, default=1000)
+    parser.add_argument("--policies", type=str, nargs="+", default=["none", "stage", "block"],
+                        choices=["none", "stage", "block"])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[32, 64])
+    parser.add_argument("--image_size", type=int, default=224)
+    parser.add_argument("--device_type", type=str, default="cuda" if torch.cuda.is_available() else "cpu",
+                        choices=["cpu", "cuda"])
+    parser.add_argument("--num_threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--num_steps", type=int, default=3)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,66 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import os
+import random
+import sys
+import time
+from glob import glob
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import imgproc
+
+
+def benchmark_backend(image_files: list, backend: str, min_size: int) -> [float, float]:
+    decode_times = []
+    short_sides = []
+    for image_file in image_files:
+        start_time = time.perf_counter()
+        image = imgproc.decode_image(image_file, backend, min_size)
+        decode_times.append(time.perf_counter() - start_time)
+        short_sides.append(min(image.shape[:2]))
+
+    return float(np.median(decode_times)) * 1000, float(np.mean(short_sides))
+
+
+def main(args) -> None:
+    image_files = sorted(glob(f"{args.image_dir}/*/*"))
+    random.Random(0).shuffle(image_files)
+    image_files = image_files[:args.num_images]
+    print(f"Benchmark {len(image_files)} images from `{args.image_dir}`.")
+
+    # Read every file once so that all backends see a warm page cache
+    for image_file in image_files:
+        with open(image_file, "rb") as f:
+            f.read()
+
+    print(f"{'Backend':<16} {'Min size':>8} {'Median ms/image':>16} {'Mean short side':>16}")
+    for min_size in args.min_sizes:
+        for backend in args.backends:
+            decode_time, short_side = benchmark_backend(image_files, backend, min_size)
+            print(f"{backend:<16} {min_size:>8d} {decode_time:>16.3f} {short_side:>16.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the per-image decode time of every decode backend.")
+    parser.add_argument("--image_dir", type=str, default="../data/ImageNet_1K/ILSVRC2012_img_val")
+    parser.add_argument("--num_images", type=int, default=500)
+    parser.add_argument("--backends", type=str, nargs="+", default=list(imgproc.DECODE_BACKENDS))
+    parser.add_argument("--min_sizes", type=int, nargs="+", default=[0, 224, 256])
+    args = parser.parse_args()
+
+    main(args)
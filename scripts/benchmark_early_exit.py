@@ -0,0 +1,112 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import os
+import sys
+import time
+
+import torch
+from torch import nn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import model
+from utils import build_dataloader, build_model_from_checkpoint
+
+
+def run_threshold(resnet_model: nn.Module, batches: list, threshold: float) -> [float, float, list]:
+    """Classify the cached batches, a threshold above 1 runs the full model
+
+    Returns:
+        latency (float): Milliseconds per image
+        acc1 (float): Top-1 accuracy in percent
+        exit_fractions (list): Fraction of the images that leave at every exit
+    """
+    num_exits = len(resnet_model.exit_heads) + 1
+    num_images = 0
+    num_correct = 0
+    exit_counts = torch.zeros([num_exits], dtype=torch.int64)
+    elapsed_time = 0.0
+    with torch.no_grad():
+        for images, target in batches:
+            start_time = time.perf_counter()
+            if threshold > 1:
+                output = resnet_model(images)
+                exit_indices = torch.full([images.size(0)], num_exits - 1, dtype=torch.int64)
+            else:
+                output, exit_indices = resnet_model.forward_early_exit(images, threshold)
+            elapsed_time += time.perf_counter() - start_time
+
+            num_images += images.size(0)
+            num_correct += (output.argmax(dim=1) == target).sum().item()
+            exit_counts += torch.bincount(exit_indices, minlength=num_exits)
+
+    return elapsed_time / num_images * 1000, num_correct / num_images * 100, (exit_counts / num_images).tolist()
+
+
+def main(args) -> None:
+    torch.set_num_threads(args.num_threads)
+
+    resnet_model = build_model_from_checkpoint(model.__dict__[args.model_arch_name], args.model_weights_path,
+                                               num_classes=args.model_num_classes,
+                                               early_exits=True)
+    resnet_model = resnet_model.to(memory_format=torch.channels_last).eval()
+    if args.fuse_for_inference:
+        resnet_model.fuse_for_inference()
+    print(f"Load `{args.model_arch_name}` model weights `{os.path.abspath(args.model_weights_path)}` successfully.")
+
+    # The images are decoded once, the timings only cover the model
+    batches = []
+    for batch_data in build_dataloader(args.valid_image_dir, args, False):
+        if len(batches) == args.num_batches:
+            break
+        batches.append((batch_data["image"].contiguous(memory_format=torch.channels_last), batch_data["target"]))
+    print(f"Cache {sum(images.size(0) for images, _ in batches)} validation images.")
+
+    # Warm up the allocator and the kernels of every stage
+    run_threshold(resnet_model, batches[:1], 2.0)
+
+    results = [(None, *run_threshold(resnet_model, batches, 2.0))]
+    for threshold in args.thresholds:
+        results.append((threshold, *run_threshold(resnet_model, batches, threshold)))
+
+    base_latency = results[0][1]
+    print(f"{'Threshold':>10} {'ms/image':>10} {'Speedup':>8} {'Acc@1':>8} "
+          + " ".join(f"{f'Exit {index}':>8}" for index in range(len(results[0][3]))))
+    for threshold, latency, acc1, exit_fractions in results:
+        threshold = "full" if threshold is None else f"{threshold:.2f}"
+        print(f"{threshold:>10} {latency:>10.2f} {base_latency / latency:>7.2f}x {acc1:>8.2f} "
+              + " ".join(f"{exit_fraction * 100:>7.1f}%" for exit_fraction in exit_fractions))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trade the accuracy of the early-exit heads for latency, over a range "
+                                                 "of confidence thresholds on the validation split.")
+    parser.add_argument("--model_arch_name", type=str, default="resnet50")
+    parser.add_argument("--model_num_classes", type=int, default=1000)
+    parser.add_argument("--model_weights_path", type=str, required=True, help="Checkpoint trained with `model_early_exits`.")
+    parser.add_argument("--model_mean_parameters", type=float, nargs=3, default=[0.485, 0.456, 0.406])
+    parser.add_argument("--model_std_parameters", type=float, nargs=3, default=[0.229, 0.224, 0.225])
+    parser.add_argument("--valid_image_dir", type=str, default="./data/ImageNet_1K/ILSVRC2012_img_val")
+    parser.add_argument("--decode_backend", type=str, default="opencv")
+    parser.add_argument("--image_size", type=int, default=224)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--num_batches", type=int, default=20)
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.7, 0.8, 0.9, 0.95, 0.99])
+    parser.add_argument("--fuse_for_inference", action="store_true", help="Fold the BatchNorms into the convolutions.")
+    parser.add_argument("--num_threads", type=int, default=torch.get_num_threads())
+    args = parser.parse_args()
+
+    main(args)
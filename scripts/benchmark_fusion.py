@@ -0,0 +1,86 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import copy
+import os
+import sys
+
+import torch
+from torch import nn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import model
+from utils import load_state_dict, measure_latency
+
+
+def build_model(args) -> nn.Module:
+    resnet_model = model.__dict__[args.model_arch_name](num_classes=args.model_num_classes)
+    if args.model_weights_path:
+        resnet_model, _, _, _, _, _ = load_state_dict(resnet_model, args.model_weights_path)
+    else:
+        # Freshly initialized BatchNorms are identities, give them real statistics so the check means something
+        for module in resnet_model.modules():
+            if isinstance(module, nn.BatchNorm2d):
+                module.running_mean.uniform_(-0.5, 0.5)
+                module.running_var.uniform_(0.5, 2.0)
+                module.weight.data.uniform_(0.5, 1.5)
+                module.bias.data.uniform_(-0.5, 0.5)
+
+    return resnet_model.to(memory_format=torch.channels_last).eval()
+
+
+def main(args) -> None:
+    torch.set_num_threads(args.num_threads)
+
+    resnet_model = build_model(args)
+    fused_resnet_model = copy.deepcopy(resnet_model).fuse_for_inference()
+    num_bn = sum(isinstance(module, nn.BatchNorm2d) for module in resnet_model.modules())
+    print(f"Folded {num_bn} BatchNorms of `{args.model_arch_name}` into their convolutions.")
+
+    # The fused model must produce the same logits as the original one
+    images = torch.randn([args.batch_sizes[0], 3, args.image_size, args.image_size]).contiguous(
+        memory_format=torch.channels_last)
+    with torch.no_grad():
+        output = resnet_model(images)
+        fused_output = fused_resnet_model(images)
+    max_error = (output - fused_output).abs().max().item()
+    is_close = torch.allclose(output, fused_output, rtol=args.rtol, atol=args.atol)
+    print(f"Max abs logit difference: {max_error:.3e} ({'OK' if is_close else 'MISMATCH'}).")
+    if not is_close:
+        raise RuntimeError(f"Fused model output differs by more than rtol={args.rtol}, atol={args.atol}.")
+
+    print(f"{'Batch size':>10} {'Unfused ms':>12} {'Fused ms':>12} {'Speedup':>8}")
+    for batch_size in args.batch_sizes:
+        latency = measure_latency(resnet_model, batch_size, args.image_size, args.num_iters)
+        fused_latency = measure_latency(fused_resnet_model, batch_size, args.image_size, args.num_iters)
+        print(f"{batch_size:>10d} {latency:>12.2f} {fused_latency:>12.2f} {latency / fused_latency:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the Conv+BN folded ResNet against the original and compare "
+                                                 "their CPU latency.")
+    parser.add_argument("--model_arch_name", type=str, default="resnet18")
+    parser.add_argument("--model_num_classes", type=int, default=1000)
+    parser.add_argument("--model_weights_path", type=str, default="",
+                        help="Optional checkpoint, random weights and BatchNorm statistics are used otherwise.")
+    parser.add_argument("--image_size", type=int, default=224)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--num_threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--num_iters", type=int, default=20)
+    parser.add_argument("--rtol", type=float, default=1e-3)
+    parser.add_argument("--atol", type=float, default=1e-3)
+    args = parser.parse_args()
+
+    main(args)
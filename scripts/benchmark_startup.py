@@ -0,0 +1,102 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import model
+from utils import build_model_from_checkpoint, load_state_dict, peak_host_memory
+
+
+def measure_startup(model_arch_name: str, model_num_classes: int, model_weights_path: str, method: str) -> [float, int]:
+    """Build a model with the weights of a checkpoint and run one image through it
+
+    Returns:
+        startup_time (float): Seconds until the first output
+        peak_memory (int): Peak bytes that the startup adds to the process
+    """
+    torch.set_num_threads(1)
+    images = torch.randn([1, 3, 224, 224]).contiguous(memory_format=torch.channels_last)
+    base_memory = peak_host_memory()
+
+    start_time = time.perf_counter()
+    if method == "eager":
+        resnet_model = model.__dict__[model_arch_name](num_classes=model_num_classes)
+        resnet_model, _, _, _, _, _ = load_state_dict(resnet_model, model_weights_path)
+    elif method == "meta":
+        resnet_model = build_model_from_checkpoint(model.__dict__[model_arch_name], model_weights_path,
+                                                   num_classes=model_num_classes)
+    else:
+        raise ValueError(f"Unsupported startup method `{method}`.")
+    resnet_model = resnet_model.to(memory_format=torch.channels_last).eval()
+    with torch.no_grad():
+        resnet_model(images)
+
+    return time.perf_counter() - start_time, peak_host_memory() - base_memory
+
+
+def main(args) -> None:
+    # Every startup runs in a fresh process, like a cold start. The checkpoint is read once beforehand, so every method
+    # finds it in the page cache
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        results = []
+        for model_arch_name in args.model_arch_names:
+            model_weights_path = os.path.join(checkpoint_dir, f"{model_arch_name}.pth.tar")
+            resnet_model = model.__dict__[model_arch_name](num_classes=args.model_num_classes)
+            torch.save({"state_dict": resnet_model.state_dict()}, model_weights_path)
+            with open(model_weights_path, "rb") as f:
+                while f.read(1 << 24):
+                    pass
+
+            for method in ["eager", "meta"]:
+                startup_times = []
+                for _ in range(args.num_runs):
+                    with context.Pool(1) as pool:
+                        startup_time, peak_memory = pool.apply(measure_startup, (model_arch_name,
+                                                                                 args.model_num_classes,
+                                                                                 model_weights_path,
+                                                                                 method))
+                    startup_times.append(startup_time)
+                results.append((model_arch_name, method, min(startup_times), peak_memory))
+                print(f"`{model_arch_name}` `{method}` start up: {min(startup_times) * 1000:.0f}ms, "
+                      f"{peak_memory / 1024 / 1024:.0f}MB peak.")
+            os.remove(model_weights_path)
+
+    print(f"{'Model':>10} {'Method':>8} {'Start ms':>10} {'Peak MB':>10} {'Speedup':>8}")
+    baselines = {model_arch_name: startup_time
+                 for model_arch_name, method, startup_time, _ in results if method == "eager"}
+    for model_arch_name, method, startup_time, peak_memory in results:
+        print(f"{model_arch_name:>10} {method:>8} {startup_time * 1000:>10.0f} {peak_memory / 1024 / 1024:>10.0f} "
+              f"{baselines[model_arch_name] / startup_time:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the cold start of an initialized model that loads a checkpoint "
+                                                 "with a meta-device model that takes the memory-mapped checkpoint "
+                                                 "tensors.")
+    parser.add_argument("--model_arch_names", type=str, nargs="+",
+                        default=["resnet18", "resnet34", "resnet50", "resnet101", "resnet152"])
+    parser.add_argument("--model_num_classes", type=int, default=1000)
+    parser.add_argument("--num_runs", type=int, default=3)
+    args = parser.parse_args()
+
+    main(args)
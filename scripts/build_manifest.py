@@ -0,0 +1,45 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dataset import build_manifest
+
+
+def main(args) -> None:
+    start_time = time.time()
+    manifest = build_manifest(args.image_dir, args.manifest_path, args.num_workers, args.verify)
+    print(f"Build `{args.manifest_path}` with {len(manifest)} images in {time.time() - start_time:.1f}s.")
+
+    invalid_indices = np.flatnonzero(~manifest["valid"])
+    for invalid_index in invalid_indices:
+        print(f"Unreadable image: `{manifest[invalid_index]['path'].decode('utf-8')}`")
+    print(f"{len(invalid_indices)} unreadable images will be skipped.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or refresh the file manifest of a class-folder dataset.")
+    parser.add_argument("--image_dir", type=str, default="../data/ImageNet_1K/ILSVRC2012_img_train")
+    parser.add_argument("--manifest_path", type=str, default="../data/ImageNet_1K/ILSVRC2012_img_train_manifest.npy")
+    parser.add_argument("--num_workers", type=int, default=16)
+    parser.add_argument("--verify", action="store_true", help="Fully decode every image instead of reading its header.")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,80 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import os
+import sys
+import time
+from typing import Any
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils import CheckpointReader, make_directory, save_indexed_checkpoint
+
+
+def is_equal(value: Any, other_value: Any) -> bool:
+    if isinstance(value, torch.Tensor):
+        return isinstance(other_value, torch.Tensor) and value.dtype == other_value.dtype \
+            and value.shape == other_value.shape and bool((value == other_value).all())
+    if isinstance(value, dict):
+        return isinstance(other_value, dict) and value.keys() == other_value.keys() \
+            and all(is_equal(value[k], other_value[k]) for k in value.keys())
+    if isinstance(value, (list, tuple)):
+        return type(value) == type(other_value) and len(value) == len(other_value) \
+            and all(is_equal(v, other_v) for v, other_v in zip(value, other_value))
+
+    return value == other_value
+
+
+def main(args) -> None:
+    if args.output_dir:
+        make_directory(args.output_dir)
+
+    for checkpoint_path in args.checkpoint_paths:
+        start_time = time.perf_counter()
+        checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
+        load_time = time.perf_counter() - start_time
+        if args.keys:
+            checkpoint = {k: checkpoint[k] for k in args.keys if k in checkpoint}
+
+        output_path = os.path.join(args.output_dir or os.path.dirname(checkpoint_path),
+                                   os.path.basename(checkpoint_path).replace(".pth.tar", "") + ".ckpt")
+        save_indexed_checkpoint(checkpoint, output_path)
+
+        # Every entry must read back unchanged
+        checkpoint_reader = CheckpointReader(output_path)
+        for key, value in checkpoint.items():
+            if not is_equal(value, checkpoint_reader[key]):
+                raise RuntimeError(f"`{key}` of `{output_path}` does not match `{checkpoint_path}`.")
+
+        start_time = time.perf_counter()
+        CheckpointReader(output_path)["state_dict"]
+        state_dict_time = time.perf_counter() - start_time
+        print(f"Convert `{checkpoint_path}` ({os.path.getsize(checkpoint_path) / 1024 / 1024:.1f}MB) to "
+              f"`{output_path}` ({os.path.getsize(output_path) / 1024 / 1024:.1f}MB) with "
+              f"{len(checkpoint_reader.tensor_names())} tensors. Load time: `torch.load` {load_time * 1000:.1f}ms, "
+              f"`state_dict` {state_dict_time * 1000:.1f}ms.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert `.pth.tar` checkpoints to indexed `.ckpt` checkpoints, whose "
+                                                 "entries are read lazily and whose tensors are memory mapped.")
+    parser.add_argument("checkpoint_paths", type=str, nargs="+")
+    parser.add_argument("--output_dir", type=str, default="", help="Empty writes next to every input checkpoint.")
+    parser.add_argument("--keys", type=str, nargs="+", default=[],
+                        help="Only keep these entries, e.g. `state_dict block_channels` for deployment.")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,109 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import json
+import os
+import random
+import tarfile
+import time
+from multiprocessing import Pool
+
+# Image formats supported by the image processing library
+IMG_EXTENSIONS = ("jpg", "jpeg", "png", "ppm", "bmp", "pgm", "tif", "tiff", "webp")
+
+
+def list_image_files(image_dir: str) -> list:
+    class_names = sorted(entry.name for entry in os.scandir(image_dir) if entry.is_dir())
+
+    image_files = []
+    for class_name in class_names:
+        for entry in os.scandir(os.path.join(image_dir, class_name)):
+            if entry.is_file() and entry.name.split(".")[-1].lower() in IMG_EXTENSIONS:
+                image_files.append((f"{class_name}/{entry.name}", entry.stat().st_size))
+
+    return class_names, image_files
+
+
+def split_shards(image_files: list, shard_size: int) -> list:
+    # Cut the (already shuffled) file list into shards of roughly `shard_size` bytes
+    shards = []
+    current_shard = []
+    current_size = 0
+    for image_file, image_size in image_files:
+        if current_shard and current_size + image_size > shard_size:
+            shards.append(current_shard)
+            current_shard = []
+            current_size = 0
+        current_shard.append(image_file)
+        current_size += image_size
+    if current_shard:
+        shards.append(current_shard)
+
+    return shards
+
+
+def write_shard(task: tuple) -> dict:
+    image_dir, output_dir, shard_name, image_files = task
+
+    shard_path = os.path.join(output_dir, shard_name)
+    temp_shard_path = shard_path + ".tmp"
+    with tarfile.open(temp_shard_path, "w", format=tarfile.GNU_FORMAT) as tar:
+        for image_file in image_files:
+            tar.add(os.path.join(image_dir, image_file), arcname=image_file, recursive=False)
+    os.replace(temp_shard_path, shard_path)
+
+    return {"name": shard_name, "num_samples": len(image_files), "size": os.path.getsize(shard_path)}
+
+
+def main(args) -> None:
+    start_time = time.time()
+    class_names, image_files = list_image_files(args.image_dir)
+    print(f"Found {len(image_files)} images of {len(class_names)} classes in `{args.image_dir}`.")
+
+    # Mix the classes across shards, otherwise the shuffle buffer would only ever see a few classes
+    random.Random(args.seed).shuffle(image_files)
+    shards = split_shards(image_files, args.shard_size_mb * 1024 * 1024)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    tasks = [(args.image_dir, args.output_dir, f"shard-{shard_index:06d}.tar", shard)
+             for shard_index, shard in enumerate(shards)]
+
+    shard_infos = []
+    with Pool(args.num_workers) as pool:
+        for shard_info in pool.imap(write_shard, tasks):
+            shard_infos.append(shard_info)
+            print(f"Write `{shard_info['name']}` ({shard_info['num_samples']} images, "
+                  f"{shard_info['size'] / 1024 / 1024:.1f}MB) [{len(shard_infos)}/{len(tasks)}]")
+
+    shard_index = {
+        "class_to_idx": {class_name: class_index for class_index, class_name in enumerate(class_names)},
+        "num_samples": len(image_files),
+        "shards": shard_infos,
+    }
+    with open(os.path.join(args.output_dir, "index.json"), "w") as f:
+        json.dump(shard_index, f, indent=2)
+
+    print(f"Packed {len(image_files)} images into {len(shard_infos)} shards in {time.time() - start_time:.1f}s.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack a class-folder image dataset into sequential tar shards.")
+    parser.add_argument("--image_dir", type=str, default="../data/ImageNet_1K/ILSVRC2012_img_train")
+    parser.add_argument("--output_dir", type=str, default="../data/ImageNet_1K/ILSVRC2012_img_train_shards")
+    parser.add_argument("--shard_size_mb", type=int, default=256)
+    parser.add_argument("--num_workers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    main(args)
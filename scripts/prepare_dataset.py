@@ -0,0 +1,234 @@
+# Copyright 2022 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import csv
+import os
+import re
+import tarfile
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+# Image formats supported by the image processing library
+IMG_EXTENSIONS = ("jpg", "jpeg", "png", "ppm", "bmp", "pgm", "tif", "tiff", "webp")
+JPEG_EXTENSIONS = ("jpg", "jpeg")
+
+
+class TarMemberReader:
+    """Read-only view of one member inside an uncompressed tar, so nested tars are streamed in place"""
+
+    def __init__(self, f, offset: int, size: int) -> None:
+        self.f = f
+        self.f.seek(offset)
+        self.remaining = size
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def output_file_name(file_name: str, max_short_side: int) -> str:
+    # Re-encoded images are always JPEG
+    base_name, extension = os.path.splitext(file_name)
+    if max_short_side > 0 and extension[1:].lower() not in JPEG_EXTENSIONS:
+        return base_name + ".jpg"
+    return file_name
+
+
+def write_image(image_bytes: bytes, output_path: str, max_short_side: int, jpeg_quality: int) -> int:
+    # Only images above the size cap are re-encoded, the others keep their original bytes
+    if max_short_side > 0:
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image is not None:
+            height, width = image.shape[:2]
+            is_jpeg = os.path.splitext(output_path)[1][1:].lower() in JPEG_EXTENSIONS
+            if min(height, width) > max_short_side:
+                scale = max_short_side / min(height, width)
+                image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+            if min(height, width) > max_short_side or not is_jpeg:
+                _, image_bytes = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+                image_bytes = image_bytes.tobytes()
+
+    # Write to a temporary file first, so an interrupted run never leaves a truncated image that looks done
+    with open(output_path + ".tmp", "wb") as f:
+        f.write(image_bytes)
+    os.replace(output_path + ".tmp", output_path)
+
+    return len(image_bytes)
+
+
+def process_task(task: tuple) -> [int, int, int, int]:
+    kind, source, items, output_dir, max_short_side, jpeg_quality = task
+
+    num_images = num_skipped = num_read_bytes = num_written_bytes = 0
+
+    def process_image(read_fn, file_name: str, class_name: str) -> None:
+        nonlocal num_images, num_skipped, num_read_bytes, num_written_bytes
+        if file_name.split(".")[-1].lower() not in IMG_EXTENSIONS:
+            return
+        output_path = os.path.join(output_dir, class_name, output_file_name(file_name, max_short_side))
+        num_images += 1
+        if os.path.exists(output_path):
+            num_skipped += 1
+            return
+        image_bytes = read_fn()
+        num_read_bytes += len(image_bytes)
+        num_written_bytes += write_image(image_bytes, output_path, max_short_side, jpeg_quality)
+
+    if kind == "class_tar":
+        # One class archive nested in the train tar, streamed member by member
+        offset, size, class_name = items
+        os.makedirs(os.path.join(output_dir, class_name), exist_ok=True)
+        with open(source, "rb") as f:
+            with tarfile.open(fileobj=TarMemberReader(f, offset, size), mode="r|") as class_tar:
+                for member in class_tar:
+                    if member.isfile():
+                        process_image(lambda: class_tar.extractfile(member).read(),
+                                      os.path.basename(member.name),
+                                      class_name)
+    elif kind == "tar_members":
+        # A chunk of images stored directly in the valid tar
+        with open(source, "rb") as f:
+            for offset, size, file_name, class_name in items:
+                os.makedirs(os.path.join(output_dir, class_name), exist_ok=True)
+
+                def read_member(offset=offset, size=size) -> bytes:
+                    f.seek(offset)
+                    return f.read(size)
+
+                process_image(read_member, file_name, class_name)
+    elif kind == "files":
+        # A chunk of loose image files
+        for file_path, class_name in items:
+            os.makedirs(os.path.join(output_dir, class_name), exist_ok=True)
+
+            def read_file(file_path=file_path) -> bytes:
+                with open(file_path, "rb") as f:
+                    return f.read()
+
+            process_image(read_file, os.path.basename(file_path), class_name)
+    else:
+        raise ValueError(f"Unsupported task `{kind}`.")
+
+    return num_images, num_skipped, num_read_bytes, num_written_bytes
+
+
+def chunk(items: list, chunk_size: int) -> list:
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def imagenet_train_tasks(args) -> list:
+    # Only the headers of the outer tar are read here, the workers stream the class archives
+    tasks = []
+    with tarfile.open(args.source, "r:") as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith(".tar"):
+                class_name = os.path.basename(member.name)[:-len(".tar")]
+                tasks.append(("class_tar", args.source, (member.offset_data, member.size, class_name),
+                              args.output_dir, args.max_short_side, args.jpeg_quality))
+
+    return tasks
+
+
+def imagenet_valid_tasks(args) -> list:
+    # `valprep.sh` moves every valid image into its class folder with `mv <image> <class>/`
+    class_names = {}
+    with open(args.valprep_path, "r") as f:
+        for line in f:
+            match = re.match(r"\s*mv\s+(\S+)\s+(\S+?)/?\s*$", line)
+            if match:
+                class_names[match.group(1)] = match.group(2)
+
+    members = []
+    with tarfile.open(args.source, "r:") as tar:
+        for member in tar:
+            file_name = os.path.basename(member.name)
+            if member.isfile() and file_name in class_names:
+                members.append((member.offset_data, member.size, file_name, class_names[file_name]))
+
+    return [("tar_members", args.source, items, args.output_dir, args.max_short_side, args.jpeg_quality)
+            for items in chunk(members, args.chunk_size)]
+
+
+def mini_imagenet_tasks(args) -> list:
+    # Only the images listed in the split CSVs are processed, every split gets its own folder
+    tasks = []
+    for split_name in ("train", "valid", "test"):
+        with open(os.path.join(args.csv_dir, f"{split_name}.csv"), "r") as f:
+            csv_reader = csv.reader(f)
+            next(csv_reader)
+            files = [(os.path.join(args.source, row[0]), row[1]) for row in csv_reader]
+
+        split_output_dir = os.path.join(args.output_dir, split_name)
+        tasks += [("files", args.source, items, split_output_dir, args.max_short_side, args.jpeg_quality)
+                  for items in chunk(files, args.chunk_size)]
+
+    return tasks
+
+
+def main(args) -> None:
+    start_time = time.time()
+    if args.dataset == "imagenet_train":
+        tasks = imagenet_train_tasks(args)
+    elif args.dataset == "imagenet_valid":
+        tasks = imagenet_valid_tasks(args)
+    elif args.dataset == "mini_imagenet":
+        tasks = mini_imagenet_tasks(args)
+    else:
+        raise ValueError(f"Unsupported dataset `{args.dataset}`.")
+    print(f"Prepare `{args.dataset}` into `{args.output_dir}` with {len(tasks)} tasks.")
+
+    total_images = total_skipped = total_read_bytes = total_written_bytes = 0
+    with Pool(args.num_workers) as pool:
+        for task_index, result in enumerate(pool.imap_unordered(process_task, tasks)):
+            num_images, num_skipped, num_read_bytes, num_written_bytes = result
+            total_images += num_images
+            total_skipped += num_skipped
+            total_read_bytes += num_read_bytes
+            total_written_bytes += num_written_bytes
+
+            elapsed_time = time.time() - start_time
+            print(f"[{task_index + 1}/{len(tasks)}] {total_images} images ({total_skipped} already done), "
+                  f"{(total_images - total_skipped) / elapsed_time:.1f} images/s, "
+                  f"read {total_read_bytes / elapsed_time / 1024 / 1024:.1f}MB/s, "
+                  f"write {total_written_bytes / elapsed_time / 1024 / 1024:.1f}MB/s")
+
+    print(f"Prepared {total_images} images in {time.time() - start_time:.1f}s, "
+          f"{total_read_bytes / 1024 / 1024:.1f}MB read, {total_written_bytes / 1024 / 1024:.1f}MB written.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract a dataset into class folders with a process pool. "
+                                                 "Images that already exist in the output are skipped.")
+    parser.add_argument("--dataset", type=str, default="imagenet_train",
+                        choices=["imagenet_train", "imagenet_valid", "mini_imagenet"])
+    parser.add_argument("--source", type=str, default="../data/ImageNet_1K/ILSVRC2012_img_train/ILSVRC2012_img_train.tar",
+                        help="Source tar of ImageNet, or the image directory of Mini-ImageNet.")
+    parser.add_argument("--output_dir", type=str, default="../data/ImageNet_1K/ILSVRC2012_img_train")
+    parser.add_argument("--valprep_path", type=str, default="../data/ImageNet_1K/ILSVRC2012_img_val/valprep.sh")
+    parser.add_argument("--csv_dir", type=str, default="../data/MiniImageNet_1K/original",
+                        help="Directory holding the `train.csv`, `valid.csv` and `test.csv` of Mini-ImageNet.")
+    parser.add_argument("--num_workers", type=int, default=16)
+    parser.add_argument("--chunk_size", type=int, default=1000, help="Images per task of the loose image datasets.")
+    parser.add_argument("--max_short_side", type=int, default=0,
+                        help="Re-encode images whose shorter side is longer than this, 0 to keep the original files.")
+    parser.add_argument("--jpeg_quality", type=int, default=90)
+    args = parser.parse_args()
+
+    main(args)
@@ -19,54 +19,98 @@ from torch import nn
 from torch.utils.data import DataLoader
 
 import config
+import imgproc
 import model
-from dataset import CUDAPrefetcher, ImageDataset
-from utils import load_state_dict, accuracy, Summary, AverageMeter, ProgressMeter
+from quantize import load_quantized_model
+from dataset import CPUPrefetcher, CUDAPrefetcher, ImageDataset, ShardedImageDataset, SharedMemoryPrefetcher, collate_uint8_batch
+from utils import build_model_from_checkpoint, accuracy, Summary, AverageMeter, ProgressMeter
 
 model_names = sorted(
-    name for name in model.__dict__ if name.islower() and not name.startswith("__") and callable(model.__dict__[name]))
+    name for name in model.__dict__ if name.islower() and not name.startswith("_") and callable(model.__dict__[name]))
 
 
 def build_model() -> nn.Module:
-    resnet_model = model.__dict__[config.model_arch_name](num_classes=config.model_num_classes)
+    # The weights come straight from the memory-mapped checkpoint, which also records the channels of a pruned model
+    resnet_model = build_model_from_checkpoint(model.__dict__[config.model_arch_name], config.model_weights_path,
+                                               num_classes=config.model_num_classes)
     resnet_model = resnet_model.to(device=config.device, memory_format=torch.channels_last)
 
     return resnet_model
 
 
 def load_dataset() -> CUDAPrefetcher:
-    test_dataset = ImageDataset(config.test_image_dir,
-                                config.image_size,
-                                config.model_mean_parameters,
-                                config.model_std_parameters,
-                                "Test")
+    # The shared memory loader reads the samples by index, which the streamed shards do not have
+    if config.dataloader_type == "shared_memory" and config.dataset_format == "shard":
+        raise ValueError("The `shared_memory` dataloader needs the `folder` dataset format.")
+
+    if config.dataset_format == "shard":
+        test_dataset = ShardedImageDataset(config.test_shard_dir,
+                                           config.image_size,
+                                           config.model_mean_parameters,
+                                           config.model_std_parameters,
+                                           "Test",
+                                           decode_backend=config.decode_backend,
+                                           uint8_output=config.uint8_pipeline)
+    else:
+        test_dataset = ImageDataset(config.test_image_dir,
+                                    config.image_size,
+                                    config.model_mean_parameters,
+                                    config.model_std_parameters,
+                                    "Test",
+                                    config.test_manifest_path,
+                                    config.test_cache_mode,
+                                    config.cache_dir,
+                                    config.decode_backend,
+                                    config.uint8_pipeline)
+    # The workers write whole batches into shared memory slots, no DataLoader is involved
+    if config.dataloader_type == "shared_memory":
+        return SharedMemoryPrefetcher(test_dataset,
+                                      config.batch_size,
+                                      shuffle=False,
+                                      drop_last=False,
+                                      num_workers=config.num_workers,
+                                      num_slots=config.shared_memory_slots)
+
     test_dataloader = DataLoader(test_dataset,
                                  batch_size=config.batch_size,
+                                 collate_fn=collate_uint8_batch if config.uint8_pipeline else None,
                                  shuffle=False,
                                  num_workers=config.num_workers,
-                                 pin_memory=True,
+                                 pin_memory=config.device.type == "cuda",
                                  drop_last=False,
                                  persistent_workers=True)
 
     # Place all data on the preprocessing data loader
-    test_prefetcher = CUDAPrefetcher(test_dataloader, config.device)
+    if config.device.type == "cuda":
+        test_prefetcher = CUDAPrefetcher(test_dataloader, config.device)
+    else:
+        test_prefetcher = CPUPrefetcher(test_dataloader)
 
     return test_prefetcher
 
 
 def main() -> None:
-    # Initialize the model
-    resnet_model = build_model()
-    print(f"Build `{config.model_arch_name}` model successfully.")
-
-    # Load model weights
-    resnet_model, _, _, _, _, _ = load_state_dict(resnet_model, config.model_weights_path)
-    print(f"Load `{config.model_arch_name}` "
-          f"model weights `{os.path.abspath(config.model_weights_path)}` successfully.")
+    if config.model_quantized:
+        # int8 models written by `quantize.py` only run on the CPU
+        config.device = torch.device("cpu")
+        resnet_model = load_quantized_model(config.model_arch_name, config.model_num_classes, config.model_weights_path)
+        print(f"Load `{config.model_arch_name}` "
+              f"int8 model weights `{os.path.abspath(config.model_weights_path)}` successfully.")
+    else:
+        # Build the model with its weights
+        resnet_model = build_model()
+        print(f"Build `{config.model_arch_name}` model successfully.")
+        print(f"Load `{config.model_arch_name}` "
+              f"model weights `{os.path.abspath(config.model_weights_path)}` successfully.")
 
     # Start the verification mode of the model.
     resnet_model.eval()
 
+    # Fold the BatchNorms into the convolutions, a quantized model is fused already
+    if config.model_fuse_for_inference and not config.model_quantized:
+        resnet_model.fuse_for_inference()
+        print(f"Fuse `{config.model_arch_name}` model for inference successfully.")
+
     # Load test dataloader
     test_prefetcher = load_dataset()
 
@@ -93,6 +137,10 @@ def main() -> None:
             images = batch_data["image"].to(device=config.device, non_blocking=True)
             target = batch_data["target"].to(device=config.device, non_blocking=True)
 
+            # Convert uint8 batches to normalized float on the device
+            if images.dtype == torch.uint8:
+                images = imgproc.normalize_image_batch(images, config.model_mean_parameters, config.model_std_parameters)
+
             # Get batch size
             batch_size = images.size(0)
 
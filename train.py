@@ -11,41 +11,75 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import copy
 import os
 import time
+from contextlib import nullcontext
+from typing import List, Optional
 
+import numpy as np
 import torch
+from torch import Tensor
+from torch import distributed as dist
 from torch import nn
 from torch import optim## import package with optimization algorithms
+from torch.ao import quantization
+from torch.ao.nn.intrinsic.qat import freeze_bn_stats
 from torch.cuda import amp## automatic mixed precision training, providesconvenience methods for mixed precision, where some operations use the torch.float32 data type and other operations use other data types
 from torch.optim import lr_scheduler## class that decays the learning rate of each parameter group by gamma every step_size epochs
+from torch.nn.parallel import DistributedDataParallel
 from torch.optim.swa_utils import AveragedModel## class that allows to compute running averages of the parameters
 from torch.utils.data import DataLoader## class that combines a dataset and a sampler, and provides an iterable over the given dataset
 from torch.utils.tensorboard import SummaryWriter## class that writes entries directly to event files in the log_dir to be consumed by TensorBoard
 
 import config## import module defined in this project for configurations
+from autotune import autotune_dataloader, load_or_autotune_dataloader, measure_step_time
+from distill import DistillationLoss, build_teacher_logits_cache, load_teacher_logits_cache, load_teacher_model
+import imgproc
 import model## import the model module defined in this project
-from dataset import CUDAPrefetcher, ImageDataset## import the data sets
-from utils import accuracy, load_state_dict, make_directory, save_checkpoint, Summary, AverageMeter, ProgressMeter## import util functions defiend in this project
+from quantize import convert_static_quantization, prepare_quantization_aware_training
+from dataset import CPUPrefetcher, CUDAPrefetcher, ImageDataset, ShardedImageDataset, SharedMemoryPrefetcher, ResumableRandomSampler, \
+    collate_uint8_batch, TRAIN_ROTATION_DEGREES, VALID_CROP_FRACTION## import the data sets
+from utils import accuracy, load_block_channels, load_state_dict, make_directory, save_checkpoint, is_main_process, CheckpointWriter, Summary, AverageMeter, \
+    ProgressMeter## import util functions defiend in this project
 
 model_names = sorted(
-    name for name in model.__dict__ if name.islower() and not name.startswith("__") and callable(model.__dict__[name]))
+    name for name in model.__dict__ if name.islower() and not name.startswith("_") and callable(model.__dict__[name]))
 
 
 def main():## defines the starting point of this script
+    # Join the process group when launched with `torchrun`
+    init_distributed()
+
     # Initialize the number of training epochs
     start_epoch = 0## number of training epochs is initially 0
 
     # Initialize training network evaluation indicators
     best_acc1 = 0.0## network evaluation indicators are 0.0 at first
 
-    train_prefetcher, valid_prefetcher = load_dataset()## load the datasets
+    # The dataloaders are rebuilt whenever a new stage of the progressive resizing schedule starts
+    dataset_stage = get_resolution_stage(start_epoch)
+    train_prefetcher, valid_prefetcher, train_sampler = load_dataset(*dataset_stage)## load the datasets
     print(f"Load `{config.model_arch_name}` datasets successfully.")
 
     resnet_model, ema_resnet_model = build_model()## build the ResNEt model
     print(f"Build `{config.model_arch_name}` model successfully.")
 
-    pixel_criterion = define_loss()## get definition of loss functions
+    # Knowledge distillation runs a frozen teacher on every batch, or looks its top-k logits up in a cache
+    teacher_model = None
+    teacher_logits = None
+    if config.teacher_model_arch_name:
+        teacher_model = load_teacher_model(config.teacher_model_arch_name,
+                                           config.model_num_classes,
+                                           config.teacher_model_weights_path,
+                                           config.device)
+        print(f"Load `{config.teacher_model_arch_name}` teacher model weights "
+              f"`{os.path.abspath(config.teacher_model_weights_path)}` successfully.")
+        if config.teacher_logits_cache_path:
+            teacher_logits = load_teacher_logits(teacher_model)
+            teacher_model = None
+
+    pixel_criterion = define_distillation_loss() if config.teacher_model_arch_name else define_loss()## get definition of loss functions
     print("Define all loss functions successfully.")
 
     optimizer = define_optimizer(resnet_model)## get the optimiser for the model previously created
@@ -55,7 +89,7 @@ def main():## defines the starting point of this script
     print("Define all optimizer scheduler functions successfully.")
 
     print("Check whether to load pretrained model weights...")
-    if config.pretrained_model_weights_path:## if the pretrained model has existing weights
+    if config.pretrained_model_weights_path and not config.qat:## if the pretrained model has existing weights
         resnet_model, ema_resnet_model, start_epoch, best_acc1, optimizer, scheduler = load_state_dict(## load the model weights
             resnet_model,## load the weights on the model
             config.pretrained_model_weights_path,## specify the model weights path to know where to load from
@@ -68,37 +102,109 @@ def main():## defines the starting point of this script
     else:
         print("Pretrained model weights not found.")
 
+    # Initialize the gradient scaler
+    scaler = amp.GradScaler(enabled=config.device.type == "cuda")## undefined
+
     print("Check whether the pretrained model is restored...")
     if config.resume:## undefined
         resnet_model, ema_resnet_model, start_epoch, best_acc1, optimizer, scheduler = load_state_dict(## undefined
             resnet_model,## undefined
-            config.pretrained_model_weights_path,## undefined
+            config.resume,## undefined
             ema_resnet_model,## undefined
             start_epoch,## undefined
             best_acc1,## undefined
             optimizer,## undefined
             scheduler,## undefined
-            "resume")
-        print("Loaded pretrained generator model weights.")
+            "resume",
+            scaler,
+            train_sampler)
+        print(f"Loaded `{config.resume}` resume model weights successfully.")
     else:
         print("Resume training model not found. Start training from scratch.")
 
+    # The exit heads are trained through the outputs of every exit
+    train_model = _EarlyExitOutputs(resnet_model) if config.model_early_exits else resnet_model
+    # Every process trains a replica, the gradients are averaged across all of them
+    if dist.is_initialized():
+        train_model = DistributedDataParallel(train_model,
+                                              device_ids=[config.device.index] if config.device.type == "cuda" else None)
+
     # Create a experiment results
     samples_dir = os.path.join("samples", config.exp_name)## create path for sample directory
     results_dir = os.path.join("results", config.exp_name)## create path fot results directory
-    make_directory(samples_dir)## make sample directory
-    make_directory(results_dir)## make results directory
+    if is_main_process():
+        make_directory(samples_dir)## make sample directory
+        make_directory(results_dir)## make results directory
 
     # Create training process log file
-    writer = SummaryWriter(os.path.join("samples", "logs", config.exp_name))## init the writer to make logging in files possible
-
-    # Initialize the gradient scaler
-    scaler = amp.GradScaler()## undefined
+    if is_main_process():
+        writer = SummaryWriter(os.path.join("samples", "logs", config.exp_name))## init the writer to make logging in files possible
+        checkpoint_writer = CheckpointWriter(samples_dir, results_dir, config.checkpoint_keep_last, config.checkpoint_async)
+    else:
+        writer = None
+        checkpoint_writer = None
+
+    def save_step_checkpoint(epoch: int, num_consumed_samples: int) -> None:
+        # Mid-epoch checkpoint, resuming from it continues with the next batch of the same epoch
+        if not is_main_process():
+            return
+        checkpoint_writer.save({"epoch": epoch,
+                                "best_acc1": best_acc1,
+                                "state_dict": resnet_model.state_dict(),
+                                "ema_state_dict": ema_resnet_model.state_dict(),
+                                "optimizer": optimizer.state_dict(),
+                                "scheduler": scheduler.state_dict(),
+                                "scaler": scaler.state_dict(),
+                                "sampler": train_sampler.state_dict(num_consumed_samples),
+                                "block_channels": resnet_model.block_channels()},
+                               "last_step.pth.tar",
+                               rotate=False)
 
     for epoch in range(start_epoch, config.epochs):## iterate throung all the epochs 
-        train(resnet_model, ema_resnet_model, train_prefetcher, pixel_criterion, optimizer, epoch, scaler, writer)## train the model each time
+        if get_resolution_stage(epoch) != dataset_stage:
+            dataset_stage = get_resolution_stage(epoch)
+            # Keep the sample order, including a position restored by `resume`
+            sampler_state = train_sampler.state_dict() if train_sampler is not None else None
+            # Stop the workers and free the shared memory of the previous stage before the new loaders start theirs
+            train_prefetcher.close()
+            valid_prefetcher.close()
+            train_prefetcher, valid_prefetcher, train_sampler = load_dataset(*dataset_stage)
+            if sampler_state is not None:
+                train_sampler.load_state_dict(sampler_state)
+            if is_main_process():
+                print(f"Switch to image size {dataset_stage[0]} and batch size {dataset_stage[1]} at epoch {epoch + 1}.")
+
+        # Freeze the BatchNorm statistics and then the quantization ranges for the last epochs of quantization aware training
+        if config.qat:
+            if epoch >= config.qat_freeze_bn_epoch:
+                resnet_model.apply(freeze_bn_stats)
+            if epoch >= config.qat_freeze_observer_epoch:
+                resnet_model.apply(quantization.disable_observer)
+
+        epoch_start_time = time.time()
+        train(train_model,## train the model each time
+              ema_resnet_model,
+              train_prefetcher,
+              pixel_criterion,
+              optimizer,
+              epoch,
+              scaler,
+              writer,
+              train_sampler,
+              save_step_checkpoint if train_sampler is not None else None,
+              teacher_model,
+              teacher_logits)
+        train_time = time.time() - epoch_start_time
+        # The EMA model takes its quantization ranges from the trained model, it must not observe the valid images
+        if config.qat:
+            ema_resnet_model.apply(quantization.disable_observer)
         acc1 = validate(ema_resnet_model, valid_prefetcher, epoch, writer, "Valid")## validate the result and save the accuracy
-        print("\n")
+        if is_main_process():
+            print(f"Epoch {epoch + 1} trained in {train_time:.1f}s at image size {dataset_stage[0]}.")
+            print("\n")
+        if writer is not None:
+            writer.add_scalar("Train/EpochTime", train_time, epoch + 1)
+            writer.add_scalar("Train/ImageSize", dataset_stage[0], epoch + 1)
 
         # Update LR
         scheduler.step()## update the scheduler
@@ -107,67 +213,281 @@ def main():## defines the starting point of this script
         is_best = acc1 > best_acc1## iscalcualte if the currect accuracy is the best so far
         is_last = (epoch + 1) == config.epochs## calcualte if this is the last epoch
         best_acc1 = max(acc1, best_acc1)## update best accuracy so fat
-        save_checkpoint({"epoch": epoch + 1,## save current epoch in the checkpoint
-                         "best_acc1": best_acc1,## save best accuracy in the checkpoint
-                         "state_dict": resnet_model.state_dict(),## save the state dictionary of the model in the checkpoint
-                         "ema_state_dict": ema_resnet_model.state_dict(),## save the state dictionary of the ema model in the checkpoint
-                         "optimizer": optimizer.state_dict(),## save optimizer in the checkpoint
-                         "scheduler": scheduler.state_dict()},## and the scheduler
-                        f"epoch_{epoch + 1}.pth.tar",
-                        samples_dir,
+        if not is_main_process():
+            continue
+        checkpoint_writer.save({"epoch": epoch + 1,## save current epoch in the checkpoint
+                                "best_acc1": best_acc1,## save best accuracy in the checkpoint
+                                "state_dict": resnet_model.state_dict(),## save the state dictionary of the model in the checkpoint
+                                "ema_state_dict": ema_resnet_model.state_dict(),## save the state dictionary of the ema model in the checkpoint
+                                "optimizer": optimizer.state_dict(),## save optimizer in the checkpoint
+                                "scheduler": scheduler.state_dict(),## and the scheduler
+                                "scaler": scaler.state_dict(),
+                                "block_channels": resnet_model.block_channels()},
+                               f"epoch_{epoch + 1}.pth.tar",
+                               is_best,
+                               is_last)
+
+    # Wait for the checkpoints that are still being written
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+
+    # Convert the fake-quant EMA model into the int8 model, loadable like the ones written by `quantize.py`
+    if config.qat and is_main_process():
+        int8_resnet_model = convert_static_quantization(copy.deepcopy(ema_resnet_model.module).cpu().eval())
+        save_checkpoint({"state_dict": int8_resnet_model.state_dict(),
+                         "model_arch_name": config.model_arch_name,
+                         "block_channels": ema_resnet_model.module.block_channels(),
+                         "quantization_backend": config.qat_backend},
+                        "int8.pth.tar",
                         results_dir,
-                        is_best,
-                        is_last)
+                        results_dir)
+        print(f"Save int8 model weights to `{os.path.abspath(os.path.join(results_dir, 'int8.pth.tar'))}`.")
+
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def init_distributed() -> None:
+    # `torchrun` sets the rank and world size of every process in the environment
+    if int(os.environ.get("WORLD_SIZE", "1")) <= 1:
+        return
+
+    # One GPU per process with NCCL, or any number of CPU processes with gloo
+    if config.device.type == "cuda":
+        config.device = torch.device("cuda", int(os.environ["LOCAL_RANK"]))
+        torch.cuda.set_device(config.device)
+    dist.init_process_group("nccl" if config.device.type == "cuda" else "gloo")
+    print(f"Initialized process {dist.get_rank()}/{dist.get_world_size()} on `{config.device}`.")
+
+
+def get_resolution_stage(epoch: int) -> [int, int]:
+    # Image size and batch size of the last progressive resizing stage that started at or before this epoch
+    image_size, batch_size = config.image_size, config.batch_size
+    for stage_epoch, stage_image_size, stage_batch_size in config.progressive_resize_schedule:
+        if epoch >= stage_epoch:
+            image_size, batch_size = stage_image_size, stage_batch_size
+
+    return image_size, batch_size
 
 
-def load_dataset() -> [CUDAPrefetcher, CUDAPrefetcher]:## function that load the data sets
+def load_dataset(
+        image_size: int,
+        batch_size: int,
+) -> [CUDAPrefetcher, CUDAPrefetcher, ResumableRandomSampler]:## function that load the data sets
+    # FixRes: the random-resized train crops show objects larger than the center crops, validating at a higher
+    # resolution than the training one compensates for it
+    valid_image_size = int(round(image_size * config.fixres_valid_ratio))
+    valid_resize_size = int(round(valid_image_size / VALID_CROP_FRACTION))
+
+    # The shared memory loader reads the samples by index, which the streamed shards do not have
+    if config.dataloader_type == "shared_memory" and config.dataset_format == "shard":
+        raise ValueError("The `shared_memory` dataloader needs the `folder` dataset format.")
+
     # Load train, test and valid datasets
-    train_dataset = ImageDataset(config.train_image_dir,## provide the dirrectory with the training image
-                                 config.image_size,## provide the image size
-                                 config.model_mean_parameters,## provide the model mean parameters for the mean deviation on tensor later
-                                 config.model_std_parameters,## and the standars parameters for the standard deviation on tensor later
-                                 "Train")## set the mod in training
-    valid_dataset = ImageDataset(config.valid_image_dir,
-                                 config.image_size,
-                                 config.model_mean_parameters,
-                                 config.model_std_parameters,
-                                 "Valid")
+    if config.dataset_format == "shard":
+        train_dataset = ShardedImageDataset(config.train_shard_dir,
+                                            image_size,
+                                            config.model_mean_parameters,
+                                            config.model_std_parameters,
+                                            "Train",
+                                            config.shuffle_buffer_size,
+                                            config.decode_backend,
+                                            config.uint8_pipeline,
+                                            config.batch_augment)
+        valid_dataset = ShardedImageDataset(config.valid_shard_dir,
+                                            valid_image_size,
+                                            config.model_mean_parameters,
+                                            config.model_std_parameters,
+                                            "Valid",
+                                            decode_backend=config.decode_backend,
+                                            uint8_output=config.uint8_pipeline,
+                                            resize_size=valid_resize_size)
+    else:
+        # The manifests and the decoded image cache are built by the main process, the other processes wait for them
+        # and then load them
+        if dist.is_initialized() and not is_main_process():
+            dist.barrier()
+        train_dataset = ImageDataset(config.train_image_dir,## provide the dirrectory with the training image
+                                     image_size,## provide the image size
+                                     config.model_mean_parameters,## provide the model mean parameters for the mean deviation on tensor later
+                                     config.model_std_parameters,## and the standars parameters for the standard deviation on tensor later
+                                     "Train",## set the mod in training
+                                     config.train_manifest_path,
+                                     decode_backend=config.decode_backend,
+                                     uint8_output=config.uint8_pipeline,
+                                     batch_augment=config.batch_augment)
+        valid_dataset = ImageDataset(config.valid_image_dir,
+                                     valid_image_size,
+                                     config.model_mean_parameters,
+                                     config.model_std_parameters,
+                                     "Valid",
+                                     config.valid_manifest_path,
+                                     config.valid_cache_mode,
+                                     config.cache_dir,
+                                     config.decode_backend,
+                                     config.uint8_pipeline,
+                                     resize_size=valid_resize_size)
+        if dist.is_initialized() and is_main_process():
+            dist.barrier()
+
+    # Seeded sample order that can be resumed in the middle of an epoch, the shards shuffle themselves.
+    # Distributed processes each take their own slice of the training and validation samples
+    rank, world_size = (dist.get_rank(), dist.get_world_size()) if dist.is_initialized() else (0, 1)
+    if isinstance(train_dataset, ShardedImageDataset):
+        train_sampler = None
+        valid_sampler = None
+    else:
+        train_sampler = ResumableRandomSampler(train_dataset, config.sampler_seed, world_size, rank)
+        valid_sampler = range(rank, len(valid_dataset), world_size) if world_size > 1 else None
+
+    # uint8 samples are collated straight into channels_last batches
+    collate_fn = collate_uint8_batch if config.uint8_pipeline else None
+
+    # Reuse or search the cheapest loader setting that keeps the model fed on this host
+    num_workers = config.num_workers
+    prefetch_factor = config.prefetch_factor
+    if config.dataloader_autotune and config.dataloader_type == "shared_memory":
+        # The probes measure a `DataLoader`, their setting would not describe the shared memory loader
+        print("Skip the dataloader autotuning, it does not support the `shared_memory` dataloader.")
+    elif config.dataloader_autotune:
+        # Rank 0 decides, so that all processes use the same batch size
+        dataloader_setting = [autotune_train_dataloader(train_dataset, collate_fn, image_size, batch_size)
+                              if is_main_process() else None]
+        if dist.is_initialized():
+            dist.broadcast_object_list(dataloader_setting, 0)
+        dataloader_setting = dataloader_setting[0]
+        if dataloader_setting is None:
+            print(f"The dataloader autotuning could not measure any setting, keep batch_size {batch_size}, "
+                  f"num_workers {num_workers}, prefetch_factor {prefetch_factor}.")
+        else:
+            batch_size = dataloader_setting["batch_size"]
+            num_workers = dataloader_setting["num_workers"]
+            prefetch_factor = dataloader_setting["prefetch_factor"]
+            print(f"Use autotuned dataloader setting: batch_size {batch_size}, "
+                  f"num_workers {num_workers}, prefetch_factor {prefetch_factor}.")
+
+    # The workers write whole batches into shared memory slots, no DataLoader is involved
+    if config.dataloader_type == "shared_memory":
+        train_prefetcher = SharedMemoryPrefetcher(train_dataset,
+                                                  batch_size,
+                                                  shuffle=True,
+                                                  drop_last=True,
+                                                  num_workers=num_workers,
+                                                  num_slots=config.shared_memory_slots,
+                                                  sampler=train_sampler)
+        valid_prefetcher = SharedMemoryPrefetcher(valid_dataset,
+                                                  batch_size,
+                                                  shuffle=False,
+                                                  drop_last=False,
+                                                  num_workers=num_workers,
+                                                  num_slots=config.shared_memory_slots,
+                                                  sampler=valid_sampler)
+
+        return train_prefetcher, valid_prefetcher, train_sampler
 
     # Generator all dataloader
     train_dataloader = DataLoader(train_dataset,## give the train data set as the data set of the data loader
-                                  batch_size=config.batch_size,## how many samples per batch to load? parameter taken from config file
-                                  shuffle=True,## true, to reshuffle data at each epoch
-                                  num_workers=config.num_workers,## number of processes to use for data loading, parameter from config file
-                                  pin_memory=True,## tell that the data loader will copy Tensors into device/CUDA pinned memory before returning them
+                                  batch_size=batch_size,## how many samples per batch to load? parameter taken from config file
+                                  collate_fn=collate_fn,
+                                  sampler=train_sampler,## reshuffle the data at each epoch
+                                  num_workers=num_workers,## number of processes to use for data loading, parameter from config file
+                                  prefetch_factor=prefetch_factor if num_workers > 0 else None,
+                                  pin_memory=config.device.type == "cuda",## tell that the data loader will copy Tensors into device/CUDA pinned memory before returning them
                                   drop_last=True,## drop the last incomplete batch
                                   persistent_workers=True)## the data loader will not shutdown the worker processes after a dataset has been consumed once
     valid_dataloader = DataLoader(valid_dataset,
-                                  batch_size=config.batch_size,
+                                  batch_size=batch_size,
+                                  collate_fn=collate_fn,
+                                  sampler=valid_sampler,
                                   shuffle=False,
-                                  num_workers=config.num_workers,
-                                  pin_memory=True,
+                                  num_workers=num_workers,
+                                  prefetch_factor=prefetch_factor if num_workers > 0 else None,
+                                  pin_memory=config.device.type == "cuda",
                                   drop_last=False,
                                   persistent_workers=True)
 
     # Place all data on the preprocessing data loader
-    train_prefetcher = CUDAPrefetcher(train_dataloader, config.device)## use the CUDA prefetcher as the trining prefetcher
-    valid_prefetcher = CUDAPrefetcher(valid_dataloader, config.device)## and as the validation prefetcher
+    if config.device.type == "cuda":
+        train_prefetcher = CUDAPrefetcher(train_dataloader, config.device)## use the CUDA prefetcher as the trining prefetcher
+        valid_prefetcher = CUDAPrefetcher(valid_dataloader, config.device)## and as the validation prefetcher
+    else:
+        train_prefetcher = CPUPrefetcher(train_dataloader)
+        valid_prefetcher = CPUPrefetcher(valid_dataloader)
+
+    return train_prefetcher, valid_prefetcher, train_sampler## return the prefetchers and the training sampler
+
 
-    return train_prefetcher, valid_prefetcher## return the prefetchers
+def autotune_train_dataloader(train_dataset, collate_fn, image_size: int, batch_size: int) -> Optional[dict]:
+    def run_autotune() -> dict:
+        # Time the real model once, the probes then stand in for it with a sleep of the same length
+        probe_model = model.__dict__[config.model_arch_name](num_classes=config.model_num_classes,
+                                                             checkpoint_policy=config.model_checkpoint_policy)
+        probe_model = probe_model.to(device=config.device, memory_format=torch.channels_last)
+        sample_step_time = measure_step_time(probe_model, batch_size, image_size, config.device)
+        del probe_model
+        print(f"Measured `{config.model_arch_name}` training step time: {sample_step_time * 1000:.3f}ms per image.")
+
+        # The candidates follow the batch size of the stage, so that every stage of the schedule keeps its own scale
+        batch_sizes = sorted({max(int(round(batch_size * scale)), 1) for scale in config.autotune_batch_size_scales})
+        return autotune_dataloader(train_dataset,
+                                   batch_sizes,
+                                   config.autotune_num_workers,
+                                   config.autotune_prefetch_factors,
+                                   sample_step_time,
+                                   config.autotune_max_stall_fraction,
+                                   collate_fn=collate_fn)
+
+    train_data_path = config.train_shard_dir if config.dataset_format == "shard" else config.train_image_dir
+    cache_key = "|".join([os.path.abspath(train_data_path), config.model_arch_name, str(image_size), str(batch_size),
+                          str(config.autotune_batch_size_scales), config.decode_backend, str(config.uint8_pipeline), str(config.batch_augment)])
+
+    return load_or_autotune_dataloader(config.autotune_cache_path, cache_key, run_autotune)
 
 
 def build_model() -> [nn.Module, nn.Module]:## function to build and return the model
     # __dict__ is an attribute of objects, it is a dictionary that stores the attributes and their corresponding values for an object
-    resnet_model = model.__dict__[config.model_arch_name](num_classes=config.model_num_classes)## takes the resnet18 attribute(in this case, function) from the model
+    # A pruned model is rebuilt with the block channels recorded in its checkpoint
+    block_channels = load_block_channels(config.resume or config.pretrained_model_weights_path)
+    if config.model_early_exits and config.qat:
+        raise ValueError("Early exits are not supported with quantization aware training.")
+    resnet_model = model.__dict__[config.model_arch_name](num_classes=config.model_num_classes,
+                                                          block_channels=block_channels,
+                                                          checkpoint_policy=config.model_checkpoint_policy,
+                                                          early_exits=config.model_early_exits)## takes the resnet18 attribute(in this case, function) from the model
+    if config.model_early_exits and config.early_exit_freeze_trunk:
+        resnet_model.freeze_trunk()
+    # Quantization aware training starts from fp32 weights, load them before the modules are swapped for fake-quant ones
+    if config.qat:
+        resnet_model, _, _, _, _, _ = load_state_dict(resnet_model, config.pretrained_model_weights_path)
+        resnet_model = prepare_quantization_aware_training(resnet_model, config.qat_backend)
+        print(f"Prepare `{config.model_arch_name}` quantization aware training "
+              f"from `{config.pretrained_model_weights_path}` successfully.")
     resnet_model = resnet_model.to(device=config.device, memory_format=torch.channels_last)## move the model and its associated parameters to a cuda device, enabling computations to be performed on that devic
+    ema_resnet_model = define_ema_model(resnet_model)
+
+    return resnet_model, ema_resnet_model## return the ResNet model and the ema model
+
 
+class _EarlyExitOutputs(nn.Module):
+    """Return the logits of every exit from `forward`, so that `DistributedDataParallel` sees the exit heads used"""
+
+    def __init__(self, resnet_model: nn.Module) -> None:
+        super(_EarlyExitOutputs, self).__init__()
+        self.module = resnet_model
+
+    def forward(self, x: Tensor) -> List[Tensor]:
+        return self.module.forward_exits(x)
+
+
+def define_ema_model(resnet_model: nn.Module) -> AveragedModel:
     """The EMA technique involves maintaining a weighted average of the model's parameters over time. 
         It helps to stabilize the training process, reduce the impact of noisy updates, and improve the generalization ability of the model. 
     """
 
     ema_avg = lambda averaged_model_parameter, model_parameter, num_averaged: (1 - config.model_ema_decay) * averaged_model_parameter + config.model_ema_decay * model_parameter## undefined
     ema_resnet_model = AveragedModel(resnet_model, avg_fn=ema_avg)## init the ema model
-    return resnet_model, ema_resnet_model## return the ResNet model and the ema model
+
+    return ema_resnet_model
 
 
 def define_loss() -> nn.CrossEntropyLoss:
@@ -177,6 +497,46 @@ def define_loss() -> nn.CrossEntropyLoss:
     return criterion
 
 
+def define_distillation_loss() -> DistillationLoss:
+    criterion = DistillationLoss(config.distill_temperature, config.distill_alpha, config.loss_label_smoothing)
+    criterion = criterion.to(device=config.device)
+
+    return criterion
+
+
+def load_teacher_logits(teacher_model: nn.Module) -> np.ndarray:
+    # The cache records are looked up by the `index` of the training samples, which only the folder format has
+    if config.dataset_format != "folder":
+        raise ValueError("The teacher logits cache needs the `folder` dataset format.")
+
+    # The teacher sees the center crop of every training image, the student its random augmentations
+    dataset = ImageDataset(config.train_image_dir,
+                           config.image_size,
+                           config.model_mean_parameters,
+                           config.model_std_parameters,
+                           "Valid",
+                           config.train_manifest_path,
+                           decode_backend=config.decode_backend)
+    file_list_hash = dataset.file_list_hash()
+    teacher_logits = load_teacher_logits_cache(config.teacher_logits_cache_path,
+                                               len(dataset),
+                                               config.teacher_logits_topk,
+                                               file_list_hash)
+    if teacher_logits is None:
+        teacher_logits = build_teacher_logits_cache(teacher_model,
+                                                    dataset,
+                                                    config.teacher_logits_cache_path,
+                                                    config.teacher_logits_topk,
+                                                    config.batch_size,
+                                                    config.num_workers,
+                                                    config.device,
+                                                    file_list_hash)
+    print(f"Load the top-{config.teacher_logits_topk} teacher logits cache "
+          f"`{os.path.abspath(config.teacher_logits_cache_path)}` successfully.")
+
+    return teacher_logits
+
+
 def define_optimizer(model) -> optim.SGD:
     optimizer = optim.SGD(model.parameters(),
                           lr=config.model_lr,
@@ -203,10 +563,20 @@ def train(## function used to train the model
         optimizer: optim.Adam,## optimizer object
         epoch: int,## which epoch are we at
         scaler: amp.GradScaler,## scaler
-        writer: SummaryWriter## writer
+        writer: SummaryWriter,## writer
+        train_sampler: ResumableRandomSampler = None,
+        save_step_checkpoint=None,
+        teacher_model: nn.Module = None,
+        teacher_logits: np.ndarray = None,
 ) -> None:
-    # Calculate how many batches of data are in each Epoch
-    batches = len(train_prefetcher)
+    # Select the sample order of this epoch, a resumed epoch keeps its restored position. The shards shuffle themselves
+    if train_sampler is not None:
+        train_sampler.set_epoch(epoch)
+    elif isinstance(train_prefetcher.original_dataloader.dataset, ShardedImageDataset):
+        train_prefetcher.original_dataloader.dataset.set_epoch(epoch)
+
+    # Calculate how many batches of data are in each Epoch, every loaded batch is trained on `data_echo_factor` times
+    batches = len(train_prefetcher) * config.data_echo_factor
     # Print information of progress bar during training
     batch_time = AverageMeter("Time", ":6.3f")## print the batch time meter
     data_time = AverageMeter("Data", ":6.3f")## print the data time meter
@@ -222,6 +592,10 @@ def train(## function used to train the model
 
     # Initialize the number of data batches to print logs on the terminal
     batch_index = 0
+    # Number of loaded samples trained on since the start of this (possibly resumed) epoch
+    num_consumed_samples = 0
+    # How often the current batch has been trained on already
+    echo_index = 0
 
     # Initialize the data loader and load the first batch of data
     train_prefetcher.reset()## reset the training prefetcher
@@ -230,55 +604,129 @@ def train(## function used to train the model
     # Get the initialization training time
     end = time.time()## initialization training time
 
-    while batch_data is not None:## if the batch data is present
-        # Calculate the time it takes to load a batch of data
-        data_time.update(time.time() - end)## compute time it took to load the batch data
+    # Processes that run out of shard samples early keep joining the gradient all-reduce of the others
+    join_context = model.join() if isinstance(model, DistributedDataParallel) else nullcontext()
+    with join_context:
+        while batch_data is not None:## if the batch data is present
+            # Calculate the time it takes to load a batch of data
+            data_time.update(time.time() - end)## compute time it took to load the batch data
 
-        # Transfer in-memory data to CUDA devices to speed up training
-        images = batch_data["image"].to(device=config.device, memory_format=torch.channels_last, non_blocking=True)## transfer image data to cuda devices
-        target = batch_data["target"].to(device=config.device, non_blocking=True)## tranfer target data to cuda devices
+            # Transfer in-memory data to CUDA devices to speed up training
+            images = batch_data["image"].to(device=config.device, memory_format=torch.channels_last, non_blocking=True)## transfer image data to cuda devices
+            target = batch_data["target"].to(device=config.device, non_blocking=True)## tranfer target data to cuda devices
 
-        # Get batch size
-        batch_size = images.size(0)## get the size of the batch
+            # Echoed batches get cheap on-device augmentations, so that the repeats are not identical
+            if echo_index > 0:
+                images = imgproc.batch_random_shift(images, config.data_echo_max_shift)
+                images = imgproc.batch_random_horizontally_flip(images, 0.5)
 
-        # Initialize generator gradients
-        model.zero_grad(set_to_none=True)## initialize gradient
+            # Random rotation and flips of the whole batch, every image draws its own parameters
+            if config.batch_augment:
+                images = imgproc.batch_random_rotate(images, TRAIN_ROTATION_DEGREES)
+                images = imgproc.batch_random_horizontally_flip(images, 0.5)
+                images = imgproc.batch_random_vertically_flip(images, 0.5)
 
-        # Mixed precision training
-        with amp.autocast():
-            output = model(images)## get the output
-            loss = config.loss_weights * criterion(output, target)## compute the loss
+            # Convert uint8 batches to normalized float on the device
+            if images.dtype == torch.uint8:
+                images = imgproc.normalize_image_batch(images, config.model_mean_parameters, config.model_std_parameters)
 
-        # Backpropagation
-        scaler.scale(loss).backward()## scale the loss backwards to obtain the back propagation
-        # update generator weights
-        scaler.step(optimizer)## optimize the scaler step
-        scaler.update()## update the weights
+            # Get batch size
+            batch_size = images.size(0)## get the size of the batch
+
+            # Initialize generator gradients
+            model.zero_grad(set_to_none=True)## initialize gradient
+
+            # Soft targets of the teacher for knowledge distillation
+            teacher_output = None
+            teacher_indices = None
+            if teacher_logits is not None:
+                teacher_topk = teacher_logits[batch_data["index"].cpu().numpy()]
+                # The fields of the packed records are copied out, they are not aligned for torch
+                teacher_output = torch.from_numpy(np.ascontiguousarray(teacher_topk["values"]))
+                teacher_indices = torch.from_numpy(np.ascontiguousarray(teacher_topk["indices"]))
+                teacher_output = teacher_output.to(device=config.device, non_blocking=True)
+                teacher_indices = teacher_indices.to(device=config.device, dtype=torch.int64, non_blocking=True)
+
+            # Mixed precision training, the fake-quant modules of quantization aware training run in fp32
+            with amp.autocast(enabled=not config.qat):
+                output = model(images)## get the output
+                if teacher_model is not None:
+                    with torch.no_grad():
+                        teacher_output = teacher_model(images)
+                # With early exits the losses of all exits are weighted, the accuracy is the one of the final classifier
+                outputs = output if isinstance(output, list) else [output]
+                output = outputs[-1]
+                exit_loss_weights = config.early_exit_loss_weights if len(outputs) > 1 else [1.0]
+                loss = 0.0
+                for exit_loss_weight, exit_output in zip(exit_loss_weights, outputs):
+                    if teacher_output is not None:
+                        exit_loss = criterion(exit_output, target, teacher_output, teacher_indices)
+                    else:
+                        exit_loss = criterion(exit_output, target)## compute the loss
+                    loss = loss + exit_loss_weight * exit_loss
+                loss = config.loss_weights * loss
+
+            # Backpropagation
+            scaler.scale(loss).backward()## scale the loss backwards to obtain the back propagation
+            # update generator weights
+            scaler.step(optimizer)## optimize the scaler step
+            scaler.update()## update the weights
+
+            # Update EMA
+            if config.qat:
+                match_buffer_shapes(ema_model, model)
+            ema_model.update_parameters(model)## update the ema as well
 
-        # Update EMA
-        ema_model.update_parameters(model)## update the ema as well
+            # measure accuracy and record loss
+            top1, top5 = accuracy(output, target, topk=(1, 5))## compute top1 and top5 accuracies
+            losses.update(loss.item(), batch_size)## update losses for batch size
+            acc1.update(top1[0].item(), batch_size)## update accuracy 1 for batch size
+            acc5.update(top5[0].item(), batch_size)## update accuracy 5 for batch size
+            if echo_index == 0:
+                num_consumed_samples += batch_size
+
+            # Save the exact position in the epoch, so an interrupted run does not repeat any batch
+            if save_step_checkpoint is not None and config.checkpoint_step_interval > 0 \
+                    and (batch_index + 1) % config.checkpoint_step_interval == 0:
+                save_step_checkpoint(epoch, num_consumed_samples)
 
-        # measure accuracy and record loss
-        top1, top5 = accuracy(output, target, topk=(1, 5))## compute top1 and top5 accuracies
-        losses.update(loss.item(), batch_size)## update losses for batch size
-        acc1.update(top1[0].item(), batch_size)## update accuracy 1 for batch size
-        acc5.update(top5[0].item(), batch_size)## update accuracy 5 for batch size
+            # Calculate the time it takes to fully train a batch of data
+            batch_time.update(time.time() - end)## calculate tme neede dto train a batch
+            end = time.time()## reset timer
 
-        # Calculate the time it takes to fully train a batch of data
-        batch_time.update(time.time() - end)## calculate tme neede dto train a batch
-        end = time.time()## reset timer
+            # Write the data during training to the training log file
+            if batch_index % config.train_print_frequency == 0 and is_main_process():## undefined
+                # Record loss during training and output to file
+                if writer is not None:
+                    writer.add_scalar("Train/Loss", loss.item(), batch_index + epoch * batches + 1)## write the training loss information in the log file
+                progress.display(batch_index + 1)## move to the next batch
+
+            # Preload the next batch of data once the current one was trained on `data_echo_factor` times
+            echo_index = (echo_index + 1) % config.data_echo_factor
+            if echo_index == 0:
+                batch_data = train_prefetcher.next()## preload the next batch of data
 
-        # Write the data during training to the training log file
-        if batch_index % config.train_print_frequency == 0:## undefined
-            # Record loss during training and output to file
-            writer.add_scalar("Train/Loss", loss.item(), batch_index + epoch * batches + 1)## write the training loss information in the log file
-            progress.display(batch_index + 1)## move to the next batch
+            # Add 1 to the number of data batches to ensure that the terminal prints data normally
+            batch_index += 1## update the batch index to fit the new loaded batch
 
-        # Preload the next batch of data
-        batch_data = train_prefetcher.next()## preload the next batch of data
+    # Share of the epoch the model spent waiting for data, and how many new and trained samples per second it saw
+    if batch_time.sum > 0:
+        fresh_samples_per_second = num_consumed_samples / batch_time.sum
+        trained_samples_per_second = losses.count / batch_time.sum
+        if is_main_process():
+            print(f"Fresh samples {fresh_samples_per_second:.1f}/s, "
+                  f"trained samples {trained_samples_per_second:.1f}/s (data echo factor {config.data_echo_factor}).")
+        if writer is not None:
+            writer.add_scalar("Train/DataStallFraction", data_time.sum / batch_time.sum, epoch + 1)
+            writer.add_scalar("Train/FreshSamplesPerSecond", fresh_samples_per_second, epoch + 1)
+            writer.add_scalar("Train/TrainedSamplesPerSecond", trained_samples_per_second, epoch + 1)
 
-        # Add 1 to the number of data batches to ensure that the terminal prints data normally
-        batch_index += 1## update the batch index to fit the new loaded batch
+
+def match_buffer_shapes(ema_model: AveragedModel, model: nn.Module) -> None:
+    # The per-channel quantization observers only get their shape in the first forward pass
+    for ema_buffer, buffer in zip(ema_model.module.buffers(), model.buffers()):
+        if ema_buffer.shape != buffer.shape:
+            ema_buffer.resize_(buffer.shape)
 
 
 def validate(
@@ -314,6 +762,10 @@ def validate(
             images = batch_data["image"].to(device=config.device, memory_format=torch.channels_last, non_blocking=True)
             target = batch_data["target"].to(device=config.device, non_blocking=True)
 
+            # Convert uint8 batches to normalized float on the device
+            if images.dtype == torch.uint8:
+                images = imgproc.normalize_image_batch(images, config.model_mean_parameters, config.model_std_parameters)
+
             # Get batch size
             batch_size = images.size(0)
 
@@ -330,7 +782,7 @@ def validate(
             end = time.time()
 
             # Write the data during training to the training log file
-            if batch_index % config.valid_print_frequency == 0:
+            if batch_index % config.valid_print_frequency == 0 and is_main_process():
                 progress.display(batch_index + 1)
 
             # Preload the next batch of data
@@ -339,13 +791,19 @@ def validate(
             # Add 1 to the number of data batches to ensure that the terminal prints data normally
             batch_index += 1
 
+    # Every process validated its own slice of the samples
+    if dist.is_initialized():
+        acc1.all_reduce(config.device)
+        acc5.all_reduce(config.device)
+
     # print metrics
-    progress.display_summary()
+    if is_main_process():
+        progress.display_summary()
 
-    if mode == "Valid" or mode == "Test":
-        writer.add_scalar(f"{mode}/Acc@1", acc1.avg, epoch + 1)## write the accuracy information in the log file
-    else:
+    if mode != "Valid" and mode != "Test":
         raise ValueError("Unsupported mode, please use `Valid` or `Test`.")
+    if writer is not None:
+        writer.add_scalar(f"{mode}/Acc@1", acc1.avg, epoch + 1)## write the accuracy information in the log file
 
     return acc1.avg
 
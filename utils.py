@@ -11,21 +11,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import hashlib
+import io
+import json
 import os
+import pickle
+import queue
+import re
 import shutil
+import struct
+import threading
+import time
+import zipfile
+from collections.abc import Mapping
 from enum import Enum
-from typing import Any, Dict, TypeVar, Optional
+from typing import Any, Callable, Dict, Iterator, TypeVar, Optional
 
 import torch
+from torch import distributed as dist
 from torch import nn
+from torch.utils.data import DataLoader, Sampler
+
+from dataset import ImageDataset
 
 __all__ = [
-    "accuracy", "load_state_dict", "make_directory", "ovewrite_named_param", "make_divisible", "save_checkpoint",
+    "accuracy", "CheckpointReader", "save_indexed_checkpoint", "is_indexed_checkpoint", "state_dict_sha256", "load_checkpoint", "load_state_dict", "build_model_from_checkpoint", "load_block_channels", "make_directory", "ovewrite_named_param", "make_divisible", "save_checkpoint", "CheckpointWriter",
+    "is_main_process", "load_torchscript", "TORCHSCRIPT_META_FILE", "build_dataloader", "measure_latency", "peak_host_memory",
     "Summary", "AverageMeter", "ProgressMeter"
 ]
 
 V = TypeVar("V")
 
+# Name of the extra file inside the TorchScript archive of `export.py` that describes the exported model
+TORCHSCRIPT_META_FILE = "meta.json"
+
+# An indexed checkpoint is the magic, the little-endian byte size of a JSON header, the header and the data section.
+# The data section holds the raw bytes of every tensor and one pickle per top-level entry, at aligned offsets
+INDEXED_CHECKPOINT_MAGIC = b"RNCKPT01"
+INDEXED_CHECKPOINT_ALIGNMENT = 64
+
 
 def accuracy(output, target, topk=(1,)):## undefined
     """Computes the accuracy over the k top predictions for the specified values of k"""
@@ -44,6 +68,172 @@ def accuracy(output, target, topk=(1,)):## undefined
         return results
 
 
+def _align(offset: int) -> int:
+    return (offset + INDEXED_CHECKPOINT_ALIGNMENT - 1) // INDEXED_CHECKPOINT_ALIGNMENT * INDEXED_CHECKPOINT_ALIGNMENT
+
+
+def _index_tensors(obj: Any, prefix: str, tensor_names: Dict[int, str]) -> None:
+    # Name the tensors of nested dicts, lists and tuples by their path, e.g. `optimizer/state/0/momentum_buffer`
+    if isinstance(obj, torch.Tensor):
+        # Quantized and sparse tensors are pickled with their entry
+        if obj.layout == torch.strided and not obj.is_quantized and id(obj) not in tensor_names:
+            tensor_names[id(obj)] = prefix
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            _index_tensors(value, f"{prefix}/{key}", tensor_names)
+    elif isinstance(obj, (list, tuple)):
+        for index, value in enumerate(obj):
+            _index_tensors(value, f"{prefix}/{index}", tensor_names)
+
+
+def save_indexed_checkpoint(checkpoint: dict, checkpoint_path: str) -> None:
+    """Save a checkpoint in the indexed format of ``CheckpointReader``
+
+    Every tensor is stored as raw bytes under the path of its keys, every top-level entry as a separate pickle that
+    refers to its tensors by name. A reader only unpickles the entries it asks for and memory maps their tensors.
+
+    Args:
+        checkpoint (dict): Checkpoint of ``torch.save``, e.g. with `state_dict`, `ema_state_dict` and `optimizer`.
+        checkpoint_path (str): Output path, written through a temporary file.
+    """
+    tensor_index = {}
+    objects_index = {}
+    # Both hold (offset, tensor or pickled bytes) in the order of the data section
+    sections = []
+    offset = 0
+
+    for key, value in checkpoint.items():
+        tensor_names = {}
+        _index_tensors(value, str(key), tensor_names)
+        tensors = {}
+
+        def persistent_id(obj: Any) -> Optional[str]:
+            if isinstance(obj, torch.Tensor) and id(obj) in tensor_names:
+                name = tensor_names[id(obj)]
+                tensors[name] = obj
+                return name
+            return None
+
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        pickler.dump(value)
+
+        for name, tensor in tensors.items():
+            tensor = tensor.detach().cpu().contiguous()
+            tensor_index[name] = {"dtype": str(tensor.dtype).replace("torch.", ""),
+                                  "shape": list(tensor.shape),
+                                  "offset": offset}
+            sections.append((offset, tensor))
+            offset = _align(offset + tensor.numel() * tensor.element_size())
+        objects_index[str(key)] = {"offset": offset, "nbytes": buffer.tell()}
+        sections.append((offset, buffer.getvalue()))
+        offset = _align(offset + buffer.tell())
+
+    header = json.dumps({"tensors": tensor_index, "objects": objects_index}).encode("utf-8")
+    data_offset = _align(len(INDEXED_CHECKPOINT_MAGIC) + 8 + len(header))
+
+    # Write to a temporary file first, so an interrupted save never leaves a truncated checkpoint behind
+    with open(checkpoint_path + ".tmp", "wb") as f:
+        f.write(INDEXED_CHECKPOINT_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for section_offset, section in sections:
+            f.seek(data_offset + section_offset)
+            if isinstance(section, torch.Tensor):
+                f.write(section.reshape(-1).view(torch.uint8).numpy().data)
+            else:
+                f.write(section)
+        f.truncate(data_offset + offset)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+def is_indexed_checkpoint(checkpoint_path: str) -> bool:
+    with open(checkpoint_path, "rb") as f:
+        return f.read(len(INDEXED_CHECKPOINT_MAGIC)) == INDEXED_CHECKPOINT_MAGIC
+
+
+class CheckpointReader(Mapping):
+    """Read-only view of a checkpoint written by ``save_indexed_checkpoint``
+
+    Behaves like the dict of ``torch.load``, but an entry is only read when it is accessed, and its tensors are copy on
+    write memory maps of the file. ``reader["state_dict"]`` touches neither the EMA weights nor the optimizer state.
+
+    Args:
+        checkpoint_path (str): Path of the indexed checkpoint.
+    """
+
+    def __init__(self, checkpoint_path: str) -> None:
+        with open(checkpoint_path, "rb") as f:
+            if f.read(len(INDEXED_CHECKPOINT_MAGIC)) != INDEXED_CHECKPOINT_MAGIC:
+                raise ValueError(f"`{checkpoint_path}` is not an indexed checkpoint.")
+            header_size = struct.unpack("<Q", f.read(8))[0]
+            header = json.loads(f.read(header_size).decode("utf-8"))
+        self.checkpoint_path = checkpoint_path
+        self.tensor_index = header["tensors"]
+        self.objects_index = header["objects"]
+        self.data_offset = _align(len(INDEXED_CHECKPOINT_MAGIC) + 8 + header_size)
+
+        # One private mapping of the whole file, writes to the tensors never reach the file
+        self.data = torch.from_file(checkpoint_path, shared=False, size=os.path.getsize(checkpoint_path),
+                                    dtype=torch.uint8)
+
+    def tensor_names(self) -> list:
+        return list(self.tensor_index.keys())
+
+    def tensor(self, name: str) -> torch.Tensor:
+        """A single tensor by its flattened name, e.g. `state_dict/conv1.weight`"""
+        index = self.tensor_index[name]
+        dtype = getattr(torch, index["dtype"])
+        shape = index["shape"]
+        num_bytes = torch.Size(shape).numel() * torch.empty([], dtype=dtype).element_size()
+        start = self.data_offset + index["offset"]
+
+        return self.data[start:start + num_bytes].view(dtype).view(shape)
+
+    def __getitem__(self, key: str) -> Any:
+        index = self.objects_index[key]
+        start = self.data_offset + index["offset"]
+        unpickler = pickle.Unpickler(io.BytesIO(self.data[start:start + index["nbytes"]].numpy().tobytes()))
+        unpickler.persistent_load = self.tensor
+
+        return unpickler.load()
+
+    def __contains__(self, key: object) -> bool:
+        # A header lookup, the default of `Mapping` would read the entry
+        return key in self.objects_index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.objects_index)
+
+    def __len__(self) -> int:
+        return len(self.objects_index)
+
+
+def state_dict_sha256(state_dict: Mapping) -> str:
+    """SHA-256 over the names, dtypes, shapes and bytes of the tensors of a state dict, in their order"""
+    sha256 = hashlib.sha256()
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().cpu().contiguous()
+        sha256.update(f"{name}|{tensor.dtype}|{list(tensor.shape)}|".encode("utf-8"))
+        sha256.update(tensor.reshape(-1).view(torch.uint8).numpy().data)
+
+    return sha256.hexdigest()
+
+
+def load_checkpoint(model_weights_path: str) -> Mapping:
+    """Load a checkpoint on the CPU. The tensors of zip checkpoints are memory mapped, they are only read from the file
+    when they are used, and copying them into a model does not hold a second copy of the weights in memory. Indexed
+    checkpoints are opened with a ``CheckpointReader`` and only read the entries that are accessed
+    """
+    if is_indexed_checkpoint(model_weights_path):
+        return CheckpointReader(model_weights_path)
+
+    return torch.load(model_weights_path,
+                      map_location=lambda storage, loc: storage,
+                      mmap=zipfile.is_zipfile(model_weights_path))
+
+
 def load_state_dict(## undefined
         model: nn.Module,## undefined
         model_weights_path: str,## undefined
@@ -53,9 +243,11 @@ def load_state_dict(## undefined
         optimizer: torch.optim.Optimizer = None,## undefined
         scheduler: torch.optim.lr_scheduler = None,## undefined
         load_mode: str = None,## undefined
+        scaler: torch.cuda.amp.GradScaler = None,
+        sampler: Sampler = None,
 ) -> [nn.Module, nn.Module, str, int, float, torch.optim.Optimizer, torch.optim.lr_scheduler]:
     # Load model weights
-    checkpoint = torch.load(model_weights_path, map_location=lambda storage, loc: storage)
+    checkpoint = load_checkpoint(model_weights_path)
 
     if load_mode == "resume":## undefined
         # Restore the parameters in the training node to this point
@@ -77,6 +269,11 @@ def load_state_dict(## undefined
         optimizer.load_state_dict(checkpoint["optimizer"])## undefined
         # Load the scheduler model
         scheduler.load_state_dict(checkpoint["scheduler"])## undefined
+        # Load the gradient scaler and the position of the training sampler, if the checkpoint has them
+        if scaler is not None and "scaler" in checkpoint:
+            scaler.load_state_dict(checkpoint["scaler"])
+        if sampler is not None and "sampler" in checkpoint:
+            sampler.load_state_dict(checkpoint["sampler"])
     else:## undefined
         # Load model state dict. Extract the fitted model weights
         model_state_dict = model.state_dict()## undefined
@@ -89,6 +286,58 @@ def load_state_dict(## undefined
     return model, ema_model, start_epoch, best_acc1, optimizer, scheduler
 
 
+def load_block_channels(model_weights_path: str) -> Optional[list]:
+    """The inner block channels of a model pruned by ``prune.py``, None for the full width model"""
+    if not model_weights_path:
+        return None
+    checkpoint = load_checkpoint(model_weights_path)
+
+    return checkpoint.get("block_channels")
+
+
+def build_model_from_checkpoint(model_fn: Callable[..., nn.Module], model_weights_path: str, **kwargs) -> nn.Module:
+    """Build a model with the weights of a checkpoint, without initializing weights that are overwritten right away
+
+    The model is constructed on the meta device, where no memory is allocated and the weight initialization does
+    nothing, and its parameters and buffers are then assigned the memory-mapped tensors of the checkpoint. A checkpoint
+    that does not cover every tensor of the model with the same shape falls back to an initialized model that is loaded
+    like ``load_state_dict``. Half precision weights, e.g. of ``export.py --format weights``, are cast to the dtype of
+    the model, and the ``sha256`` that such a checkpoint records is checked.
+
+    Args:
+        model_fn (Callable[..., nn.Module]): Architecture function of ``model.py``, e.g. ``model.resnet50``.
+        model_weights_path (str): Checkpoint with a ``state_dict``, the ``block_channels`` of a pruned model are read
+            from it as well.
+        **kwargs: Arguments of ``model_fn``.
+
+    Returns:
+        model (nn.Module): The model on the CPU
+    """
+    checkpoint = load_checkpoint(model_weights_path)
+    state_dict = checkpoint["state_dict"]
+    kwargs.setdefault("block_channels", checkpoint.get("block_channels"))
+    if "sha256" in checkpoint and state_dict_sha256(state_dict) != checkpoint["sha256"]:
+        raise RuntimeError(f"The weights of `{model_weights_path}` do not match their SHA-256, the file is corrupted.")
+
+    with torch.device("meta"):
+        model = model_fn(**kwargs)
+    model_state_dict = model.state_dict()
+    if all(k in state_dict and state_dict[k].size() == v.size() and
+           (state_dict[k].dtype == v.dtype or state_dict[k].is_floating_point() and v.is_floating_point())
+           for k, v in model_state_dict.items()):
+        model.load_state_dict({k: state_dict[k].to(v.dtype) for k, v in model_state_dict.items()}, assign=True)
+        return model
+
+    model = model_fn(**kwargs)
+    model_state_dict = model.state_dict()
+    state_dict = {k: v for k, v in state_dict.items() if
+                  k in model_state_dict.keys() and v.size() == model_state_dict[k].size()}
+    model_state_dict.update(state_dict)
+    model.load_state_dict(model_state_dict)
+
+    return model
+
+
 def make_directory(dir_path: str) -> None:
     if not os.path.exists(dir_path):
         os.makedirs(dir_path)
@@ -123,12 +372,234 @@ def save_checkpoint(
         is_last: bool = False,
 ) -> None:
     checkpoint_path = os.path.join(samples_dir, file_name)
-    torch.save(state_dict, checkpoint_path)
+    # Write to a temporary file first, so an interrupted save never leaves a truncated checkpoint behind
+    torch.save(state_dict, checkpoint_path + ".tmp")
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
 
     if is_best:
-        shutil.copyfile(checkpoint_path, os.path.join(results_dir, "best.pth.tar"))
+        _link_checkpoint(checkpoint_path, os.path.join(results_dir, "best.pth.tar"))
     if is_last:
-        shutil.copyfile(checkpoint_path, os.path.join(results_dir, "last.pth.tar"))
+        _link_checkpoint(checkpoint_path, os.path.join(results_dir, "last.pth.tar"))
+
+
+def _link_checkpoint(checkpoint_path: str, link_path: str) -> None:
+    # A hardlink shares the bytes of the checkpoint and outlives its deletion, file systems without links get a copy
+    tmp_link_path = link_path + ".tmp"
+    if os.path.lexists(tmp_link_path):
+        os.remove(tmp_link_path)
+    try:
+        os.link(checkpoint_path, tmp_link_path)
+    except OSError:
+        shutil.copyfile(checkpoint_path, tmp_link_path)
+    os.replace(tmp_link_path, link_path)
+
+
+def _snapshot(obj: Any) -> Any:
+    # Copy the tensors of nested dicts, lists and tuples to the CPU, training goes on to update the originals in place
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    elif isinstance(obj, dict):
+        return {k: _snapshot(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_snapshot(v) for v in obj)
+
+    return obj
+
+
+def _find_rotated_checkpoints(samples_dir: str) -> list:
+    # The `epoch_*.pth.tar` checkpoints of an earlier run, oldest first
+    if not os.path.isdir(samples_dir):
+        return []
+    checkpoint_epochs = {}
+    for file_name in os.listdir(samples_dir):
+        match = re.fullmatch(r"epoch_(\d+)\.pth\.tar", file_name)
+        if match is not None:
+            checkpoint_epochs[os.path.join(samples_dir, file_name)] = int(match.group(1))
+
+    return sorted(checkpoint_epochs, key=checkpoint_epochs.get)
+
+
+def _find_linked_checkpoint(link_path: str, checkpoint_paths: list) -> Optional[str]:
+    # The checkpoint that a hardlink points to, None for a copy or a missing link
+    if not os.path.exists(link_path):
+        return None
+    for checkpoint_path in checkpoint_paths:
+        if os.path.samefile(checkpoint_path, link_path):
+            return checkpoint_path
+
+    return None
+
+
+class CheckpointWriter(object):
+    """Write the checkpoints of a training run on a background thread and keep only the recent ones
+
+    ``save`` copies the state to CPU memory and returns, the thread then writes it like ``save_checkpoint``. At most
+    two snapshots are held, one being written and one waiting, a further ``save`` blocks before it copies anything
+    until the thread catches up. Rotated checkpoints are deleted once ``keep_last`` newer ones exist, except the best
+    one, which `best.pth.tar` links to. The `epoch_*.pth.tar` checkpoints already in ``samples_dir`` count towards
+    ``keep_last``, so a resumed run goes on rotating them.
+
+    Args:
+        samples_dir (str): Directory of the checkpoints.
+        results_dir (str): Directory of `best.pth.tar` and `last.pth.tar`.
+        keep_last (int): Number of rotated checkpoints to keep, 0 keeps all of them.
+        asynchronous (bool): Write on a background thread, False writes inside ``save``.
+    """
+
+    def __init__(self, samples_dir: str, results_dir: str, keep_last: int = 0, asynchronous: bool = True) -> None:
+        self.samples_dir = samples_dir
+        self.results_dir = results_dir
+        self.keep_last = keep_last
+        self.asynchronous = asynchronous
+        self.checkpoint_paths = _find_rotated_checkpoints(samples_dir)
+        self.best_checkpoint_path = _find_linked_checkpoint(os.path.join(results_dir, "best.pth.tar"),
+                                                            self.checkpoint_paths)
+        # A best checkpoint older than the last `keep_last` ones was already rotated out and is only kept as the best
+        if 0 < keep_last < len(self.checkpoint_paths) \
+                and self.best_checkpoint_path in self.checkpoint_paths[:-keep_last]:
+            self.checkpoint_paths.remove(self.best_checkpoint_path)
+        self.error = None
+
+        if asynchronous:
+            # One slot for the snapshot being written and one for the waiting one, taken before the copy is made
+            self.slots = threading.Semaphore(2)
+            self.queue = queue.Queue()
+            self.thread = threading.Thread(target=self._run, name="CheckpointWriter", daemon=True)
+            self.thread.start()
+
+    def save(self, state_dict: dict, file_name: str, is_best: bool = False, is_last: bool = False, rotate: bool = True) -> None:
+        """Write a checkpoint to ``samples_dir/file_name``, ``rotate`` counts it towards ``keep_last``"""
+        self._raise_error()
+        if self.asynchronous:
+            self.slots.acquire()
+            try:
+                self.queue.put((_snapshot(state_dict), file_name, is_best, is_last, rotate))
+            except BaseException:
+                self.slots.release()
+                raise
+        else:
+            self._write(state_dict, file_name, is_best, is_last, rotate)
+
+    def flush(self) -> None:
+        """Wait until every saved checkpoint is written"""
+        if self.asynchronous:
+            self.queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        self.flush()
+        if self.asynchronous and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                # Later checkpoints are dropped after an error, it is raised by the next call on the training thread
+                if self.error is None:
+                    self._write(*item)
+            except BaseException as error:
+                self.error = error
+            finally:
+                if item is not None:
+                    self.slots.release()
+                self.queue.task_done()
+
+    def _write(self, state_dict: dict, file_name: str, is_best: bool, is_last: bool, rotate: bool) -> None:
+        save_checkpoint(state_dict, file_name, self.samples_dir, self.results_dir, is_best, is_last)
+        checkpoint_path = os.path.join(self.samples_dir, file_name)
+
+        if is_best:
+            # The previous best checkpoint was only kept because it was the best one
+            if self.best_checkpoint_path not in (None, checkpoint_path) \
+                    and self.best_checkpoint_path not in self.checkpoint_paths:
+                os.remove(self.best_checkpoint_path)
+            self.best_checkpoint_path = checkpoint_path
+        if rotate:
+            # A resumed run overwrites the checkpoints of the epochs it repeats
+            if checkpoint_path in self.checkpoint_paths:
+                self.checkpoint_paths.remove(checkpoint_path)
+            self.checkpoint_paths.append(checkpoint_path)
+            while 0 < self.keep_last < len(self.checkpoint_paths):
+                old_checkpoint_path = self.checkpoint_paths.pop(0)
+                if old_checkpoint_path != self.best_checkpoint_path and os.path.exists(old_checkpoint_path):
+                    os.remove(old_checkpoint_path)
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            raise RuntimeError("Writing a checkpoint failed.") from self.error
+
+
+def is_main_process() -> bool:
+    # Only rank 0 writes checkpoints and logs in distributed training
+    return not (dist.is_available() and dist.is_initialized()) or dist.get_rank() == 0
+
+
+def load_torchscript(
+        torchscript_path: str,
+        device: torch.device,
+        optimize: bool = True,
+) -> [torch.jit.ScriptModule, dict]:
+    """Load a model exported by ``export.py`` together with its meta data, without importing ``model.py``
+
+    Args:
+        torchscript_path (str): Path of the TorchScript archive.
+        device (torch.device): Device to load the weights to.
+        optimize (bool): Apply the host specific ``torch.jit.optimize_for_inference`` passes to fp32 models.
+
+    Returns:
+        script_model (torch.jit.ScriptModule): The frozen model
+        meta (dict): Architecture and preprocessing parameters recorded by ``export.py``
+    """
+    extra_files = {TORCHSCRIPT_META_FILE: ""}
+    script_model = torch.jit.load(torchscript_path, map_location=device, _extra_files=extra_files)
+    meta = json.loads(extra_files[TORCHSCRIPT_META_FILE])
+    if optimize and not meta["quantized"]:
+        script_model = torch.jit.optimize_for_inference(script_model)
+
+    return script_model, meta
+
+
+def build_dataloader(image_dir: str, args, shuffle: bool) -> DataLoader:
+    """Center-crop dataloader of the command line tools, ``args`` holds the image size, normalization and loader options"""
+    dataset = ImageDataset(image_dir,
+                           args.image_size,
+                           args.model_mean_parameters,
+                           args.model_std_parameters,
+                           "Valid",
+                           decode_backend=args.decode_backend)
+    dataloader = DataLoader(dataset,
+                            batch_size=args.batch_size,
+                            shuffle=shuffle,
+                            num_workers=args.num_workers,
+                            drop_last=False)
+
+    return dataloader
+
+
+def measure_latency(resnet_model: nn.Module, batch_size: int, image_size: int, num_iters: int) -> float:
+    """Median milliseconds of a forward pass over a random channels_last batch, after a short warm up"""
+    images = torch.randn([batch_size, 3, image_size, image_size]).contiguous(memory_format=torch.channels_last)
+    with torch.no_grad():
+        for _ in range(3):
+            resnet_model(images)
+
+        latencies = []
+        for _ in range(num_iters):
+            start_time = time.perf_counter()
+            resnet_model(images)
+            latencies.append(time.perf_counter() - start_time)
+
+    return sorted(latencies)[len(latencies) // 2] * 1000
+
+
+def peak_host_memory() -> int:
+    # Peak resident set size of this process in bytes, Linux reports it in kilobytes. `resource` only exists on Unix
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
 
 
 class Summary(Enum):
@@ -157,6 +628,13 @@ class AverageMeter(object):## undefined
         self.count += n
         self.avg = self.sum / self.count
 
+    def all_reduce(self, device: torch.device = torch.device("cpu")):
+        # Sum the values of all distributed processes
+        total = torch.tensor([self.sum, self.count], dtype=torch.float64, device=device)
+        dist.all_reduce(total, dist.ReduceOp.SUM)
+        self.sum, self.count = total.tolist()
+        self.avg = self.sum / self.count
+
     def __str__(self):## undefined
         fmtstr = "{name} {val" + self.fmt + "} ({avg" + self.fmt + "})"
         return fmtstr.format(**self.__dict__)